@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Change
+
+@admin.register(Change)
+class ChangeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'entity', 'entity_id', 'action', 'company', 'created_at']
+    list_filter = ['entity', 'action', 'company']
+    search_fields = ['entity_id']
+    readonly_fields = ['id', 'company', 'entity', 'entity_id', 'action', 'data', 'created_at']
@@ -0,0 +1,36 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from companies.models import Company
+
+
+class Change(models.Model):
+    """
+    Append-only log entry of one change to a domain object.
+
+    Written in the same transaction as the change itself. The ID is taken
+    from an IngestSequence rather than the table's autoincrement, so entries
+    become visible in ID order and a client reading the feed after an ID
+    never misses one.
+    """
+
+    ACTIONS = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+    ]
+
+    id = models.BigIntegerField(primary_key=True)
+    # Null for objects that belong to no company (orders and their stops)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    entity = models.CharField(max_length=20)
+    entity_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    # State of the object after the change; null when deleted
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.id}: {self.entity} {self.entity_id} {self.action}"
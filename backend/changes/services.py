@@ -0,0 +1,107 @@
+from typing import List, Dict, Any, Callable, Iterable, NamedTuple, Optional
+from django.db import models
+from django.db.models import Q
+from orders.models import Order, Stop
+from trips.models import Trip, TripStop
+from vehicles.models import Vehicle
+from positions.services import next_sequence
+from .models import Change
+
+# IngestSequence numbering the change log
+CHANGE_SEQUENCE = 'changes'
+
+# Page size of the change feed, and the largest one a client may ask for
+DEFAULT_CHANGE_LIMIT = 500
+MAX_CHANGE_LIMIT = 5000
+
+
+def _vehicle_company(vehicle: Vehicle) -> Optional[int]:
+    return vehicle.company_id
+
+
+def _trip_company(trip: Trip) -> Optional[int]:
+    return Vehicle.objects.filter(id=trip.vehicle_id).values_list('company_id', flat=True).first()
+
+
+def _trip_stop_company(trip_stop: TripStop) -> Optional[int]:
+    return Trip.objects.filter(id=trip_stop.trip_id).values_list('vehicle__company_id', flat=True).first()
+
+
+class Entity(NamedTuple):
+    """A logged model: its name in the feed, and how to find the company an instance belongs to"""
+
+    name: str
+    company: Optional[Callable[[models.Model], Optional[int]]]
+
+
+# Models whose changes are logged; orders and their stops belong to no company
+ENTITIES: Dict[type, Entity] = {
+    Vehicle: Entity('vehicle', _vehicle_company),
+    Trip: Entity('trip', _trip_company),
+    TripStop: Entity('trip_stop', _trip_stop_company),
+    Order: Entity('order', None),
+    Stop: Entity('stop', None),
+}
+
+
+def serialize_instance(instance: models.Model) -> Dict[str, Any]:
+    """Values of the concrete fields of an instance, foreign keys as IDs (``trip_id``)"""
+    return {field.attname: field.value_from_object(instance) for field in instance._meta.concrete_fields}
+
+
+def record_change(instance: models.Model, action: str) -> Optional[Change]:
+    """
+    Append a change of a logged model instance to the change log.
+
+    Must run in the transaction of the change, so the entry commits or rolls
+    back with it; the write views and services wrap their writes in
+    transaction.atomic(). Instances of company-owned models whose company
+    cannot be found any more, e.g. trip stops deleted with their trip, are
+    not logged; the change of their parent covers them.
+
+    Returns:
+        The entry written, if any
+    """
+    entity = ENTITIES[type(instance)]
+    company_id = None
+    if entity.company is not None:
+        company_id = entity.company(instance)
+        if company_id is None:
+            return None
+
+    return Change.objects.create(
+        id=next_sequence(CHANGE_SEQUENCE),
+        company_id=company_id,
+        entity=entity.name,
+        entity_id=instance.pk,
+        action=action,
+        data=None if action == 'deleted' else serialize_instance(instance),
+    )
+
+
+def record_updates(model: type, ids: Iterable[int]) -> List[Change]:
+    """Log objects changed by queryset updates, which send no signals"""
+    return [
+        change
+        for instance in model.objects.filter(id__in=set(ids)).order_by('id')
+        if (change := record_change(instance, 'updated')) is not None
+    ]
+
+
+def change_feed(company_id: int, after: int = 0, limit: int = DEFAULT_CHANGE_LIMIT) -> List[Change]:
+    """Entries after ``after`` that a company's users may see, oldest first"""
+    return list(
+        Change.objects.filter(Q(company_id=company_id) | Q(company__isnull=True), id__gt=after)
+        .order_by('id')[:limit]
+    )
+
+
+def serialize_change(change: Change) -> Dict[str, Any]:
+    return {
+        'id': change.id,
+        'entity': change.entity,
+        'entity_id': change.entity_id,
+        'action': change.action,
+        'data': change.data,
+        'created_at': change.created_at.isoformat(),
+    }
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from .services import ENTITIES, record_change
+
+
+def instance_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_change(instance, 'created' if created else 'updated')
+
+
+def instance_deleted(sender, instance, **kwargs):
+    record_change(instance, 'deleted')
+
+
+for model in ENTITIES:
+    post_save.connect(instance_saved, sender=model, dispatch_uid=f'changes.{model.__name__}.saved')
+    post_delete.connect(instance_deleted, sender=model, dispatch_uid=f'changes.{model.__name__}.deleted')
@@ -0,0 +1,169 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import transaction
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import json
+from unittest.mock import patch
+from accounts.models import UserProfile
+from companies.models import Company
+from orders.models import Order, Stop
+from trips.models import Trip, TripStop
+from trips.services import TripValidationError
+from vehicles.models import Vehicle
+from positions.models import Position
+from positions.services import save_positions
+from positions import geofence as geofence_module
+from .models import Change
+from test_utils import AuthenticatedTestMixin
+
+
+class ChangeFeedTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        geofence_module._geofence_index = None
+        self.company = Company.objects.create(name='Feed Company', address='1 Log St')
+        self.other_company = Company.objects.create(name='Other Company', address='2 Log St')
+        UserProfile.objects.create(user=self.auth_user, company=self.company)
+        self.vehicle = self.create_vehicle(self.company, 'LOG-001')
+        self.other_vehicle = self.create_vehicle(self.other_company, 'LOG-002')
+        self.dispatcher = User.objects.create_user(username='feed-dispatcher', password='pass')
+
+    def create_vehicle(self, company, license_plate):
+        return Vehicle.objects.create(
+            company=company, license_plate=license_plate, make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+
+    def create_trip(self, vehicle, **kwargs):
+        return Trip.objects.create(
+            vehicle=vehicle, dispatcher=self.dispatcher, name='Run', planned_start_date=datetime(2024, 6, 3).date(),
+            planned_start_time=datetime(2024, 6, 3, 8).time(), **kwargs
+        )
+
+    def feed(self, query=''):
+        response = self.authenticated_request('GET', f'/api/changes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_logged_and_scoped_to_company(self):
+        after = self.feed()['cursor']
+        trip = self.create_trip(self.vehicle)
+        self.create_trip(self.other_vehicle)
+        order = Order.objects.create(customer_name='Feed Customer', goods_description='Boxes')
+        stop = Stop.objects.create(order=order, name='Dock', address='1 Dock St', stop_type='pickup')
+        depot = Stop.objects.create(name='Depot', address='2 Dock St', stop_type='pickup')
+        trip_stop = TripStop.objects.create(trip=trip, stop=depot, sequence=1,
+                                            planned_arrival_time=datetime(2024, 6, 3, 9).time())
+        trip.name = 'Renamed run'
+        trip.save()
+        trip_stop_id = trip_stop.id
+        trip_stop.delete()
+
+        body = self.feed(f'after={after}')
+        self.assertEqual(
+            [(change['entity'], change['entity_id'], change['action']) for change in body['results']],
+            [
+                ('trip', trip.id, 'created'),
+                ('order', order.id, 'created'),
+                ('stop', stop.id, 'created'),
+                ('stop', depot.id, 'created'),
+                ('trip_stop', trip_stop_id, 'created'),
+                ('trip', trip.id, 'updated'),
+                ('trip_stop', trip_stop_id, 'deleted'),
+            ],
+        )
+        self.assertEqual(body['results'][5]['data']['name'], 'Renamed run')
+        self.assertEqual(body['results'][4]['data']['trip_id'], trip.id)
+        self.assertIsNone(body['results'][6]['data'])
+        self.assertEqual(body['cursor'], body['results'][-1]['id'])
+        self.assertFalse(body['has_more'])
+        self.assertEqual(self.feed(f"after={body['cursor']}")['results'], [])
+
+    def test_feed_pages(self):
+        after = self.feed()['cursor']
+        trips = [self.create_trip(self.vehicle) for _ in range(3)]
+
+        first = self.feed(f'after={after}&limit=2')
+        self.assertEqual([change['entity_id'] for change in first['results']], [trips[0].id, trips[1].id])
+        self.assertTrue(first['has_more'])
+        second = self.feed(f"after={first['cursor']}&limit=2")
+        self.assertEqual([change['entity_id'] for change in second['results']], [trips[2].id])
+
+        for query in ('after=abc', 'after=-1', 'limit=0', 'limit=5001'):
+            response = self.authenticated_request('GET', f'/api/changes/?{query}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_logged_in_the_transaction_of_the_change(self):
+        count = Change.objects.count()
+        try:
+            with transaction.atomic():
+                self.create_trip(self.vehicle)
+                raise ValueError('rolled back')
+        except ValueError:
+            pass
+        self.assertEqual(Change.objects.count(), count)
+
+        # Through the API, in the transaction of the view
+        response = self.authenticated_request('POST', '/api/vehicles/', data=json.dumps({
+            'company': self.company.id, 'license_plate': 'LOG-003', 'make': 'Iveco', 'model': 'Daily',
+            'year': 2023, 'capacity': 3.5, 'driver_name': 'Jane', 'driver_email': 'jane@example.com',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        change = Change.objects.last()
+        self.assertEqual((change.entity, change.entity_id, change.company_id),
+                         ('vehicle', response.json()['id'], self.company.id))
+
+    def test_reorder_logged_once_per_stop(self):
+        trip = self.create_trip(self.vehicle)
+        trip_stops = [
+            TripStop.objects.create(trip=trip, sequence=sequence, planned_arrival_time=datetime(2024, 6, 3, 9).time(),
+                                    stop=Stop.objects.create(name=name, address='1 Dock St', stop_type='pickup'))
+            for sequence, name in ((1, 'Depot'), (2, 'Annex'))
+        ]
+        after = self.feed()['cursor']
+
+        def reorder(*ordered):
+            return self.authenticated_request('POST', f'/api/trips/{trip.id}/reorder-stops/', data=json.dumps({
+                'sequences': [
+                    {'id': trip_stop.id, 'sequence': sequence} for sequence, trip_stop in enumerate(ordered, start=1)
+                ],
+            }), content_type='application/json')
+
+        self.assertEqual(reorder(trip_stops[1], trip_stops[0]).status_code, 200)
+        body = self.feed(f'after={after}')
+        # The temporary sequences of the reorder are not logged
+        self.assertEqual(
+            sorted((change['entity_id'], change['data']['sequence']) for change in body['results']),
+            [(trip_stops[0].id, 2), (trip_stops[1].id, 1)],
+        )
+
+        # A rejected reorder is rolled back with its entries
+        with patch('trips.views.validate_pickup_before_delivery', side_effect=TripValidationError('Rejected')):
+            self.assertEqual(reorder(trip_stops[0], trip_stops[1]).status_code, 400)
+        self.assertEqual(self.feed(f"after={body['cursor']}")['results'], [])
+        self.assertEqual(TripStop.objects.get(id=trip_stops[1].id).sequence, 1)
+
+    def test_automatic_arrivals_logged(self):
+        trip = self.create_trip(self.vehicle, status='in_progress',
+                                actual_start_datetime=datetime(2024, 6, 3, 8, tzinfo=dt_timezone.utc))
+        trip_stop = TripStop.objects.create(
+            trip=trip, sequence=1, planned_arrival_time=datetime(2024, 6, 3, 9).time(),
+            stop=Stop.objects.create(name='Warehouse', address='1 Dock St', latitude=Decimal('48.850000'),
+                                     longitude=Decimal('2.350000'), stop_type='pickup'),
+        )
+        after = self.feed()['cursor']
+
+        arrival = datetime(2024, 6, 3, 9, 5, tzinfo=dt_timezone.utc)
+        save_positions([Position(vehicle=self.vehicle, latitude=48.85, longitude=2.35, speed=20, heading=0,
+                                 timestamp=arrival)])
+
+        change, = self.feed(f'after={after}')['results']
+        self.assertEqual((change['entity'], change['entity_id'], change['action']),
+                         ('trip_stop', trip_stop.id, 'updated'))
+        self.assertEqual(change['data']['actual_arrival_datetime'], arrival.isoformat().replace('+00:00', 'Z'))
+
+    def test_user_without_company(self):
+        UserProfile.objects.filter(user=self.auth_user).delete()
+        response = self.authenticated_request('GET', '/api/changes/')
+        self.assertEqual(response.status_code, 400)
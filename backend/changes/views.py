@@ -0,0 +1,28 @@
+from django.http import JsonResponse
+from django.views import View
+from .services import change_feed, serialize_change, DEFAULT_CHANGE_LIMIT, MAX_CHANGE_LIMIT
+
+
+class ChangeFeedView(View):
+    def get(self, request):
+        """Get the changes after ?after=<id> that the caller's company may see, oldest first"""
+        profile = getattr(request.user, 'profile', None)
+        if profile is None:
+            return JsonResponse({'error': 'User has no associated company'}, status=400)
+
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = int(request.GET.get('limit', DEFAULT_CHANGE_LIMIT))
+            if after < 0:
+                raise ValueError('after must not be negative')
+            if not 1 <= limit <= MAX_CHANGE_LIMIT:
+                raise ValueError(f'limit must be between 1 and {MAX_CHANGE_LIMIT}')
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        changes = change_feed(profile.company_id, after, limit)
+        return JsonResponse({
+            'results': [serialize_change(change) for change in changes],
+            'cursor': changes[-1].id if changes else after,
+            'has_more': len(changes) == limit,
+        })
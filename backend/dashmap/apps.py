@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 class DashmapConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dashmap'
+
+    def ready(self):
+        from .spatial import ensure_spatial_indexes
+        # Migrations that rebuild a table drop its R*Tree triggers
+        post_migrate.connect(ensure_spatial_indexes, dispatch_uid='dashmap.ensure_spatial_indexes')
+
+        from .realtime import connect_signals
+        # Trip, trip stop and order changes for the live updates WebSocket
+        connect_signals()
@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dashmap.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from .realtime import LIVE_UPDATES_PATH, live_updates  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Django for HTTP, and the live updates WebSocket (see dashmap/realtime.py)"""
+    if scope['type'] == 'websocket':
+        if scope['path'] == LIVE_UPDATES_PATH:
+            return await live_updates(scope, receive, send)
+        await receive()
+        return await send({'type': 'websocket.close'})
+    return await django_application(scope, receive, send)
@@ -0,0 +1,81 @@
+from typing import NamedTuple, Optional
+from django.db.models import Q
+
+BBOX_PARAMETER = 'bbox'
+
+
+class BoundingBox(NamedTuple):
+    """
+    Map viewport, in degrees.
+
+    A box whose west edge is east of its east edge spans the antimeridian.
+    """
+
+    min_longitude: float
+    min_latitude: float
+    max_longitude: float
+    max_latitude: float
+
+    @property
+    def crosses_antimeridian(self) -> bool:
+        return self.min_longitude > self.max_longitude
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        if not self.min_latitude <= latitude <= self.max_latitude:
+            return False
+        if self.crosses_antimeridian:
+            return longitude >= self.min_longitude or longitude <= self.max_longitude
+        return self.min_longitude <= longitude <= self.max_longitude
+
+    def q(self, prefix: str = '') -> Q:
+        """
+        Filter on the ``<prefix>latitude`` and ``<prefix>longitude`` fields.
+
+        Written as ranges, so a (latitude, longitude) index can serve it.
+        """
+        condition = Q(**{
+            f'{prefix}latitude__gte': self.min_latitude,
+            f'{prefix}latitude__lte': self.max_latitude,
+        })
+        if self.crosses_antimeridian:
+            return condition & (
+                Q(**{f'{prefix}longitude__gte': self.min_longitude})
+                | Q(**{f'{prefix}longitude__lte': self.max_longitude})
+            )
+        return condition & Q(**{
+            f'{prefix}longitude__gte': self.min_longitude,
+            f'{prefix}longitude__lte': self.max_longitude,
+        })
+
+
+def parse_bbox(value: str) -> BoundingBox:
+    """
+    Parse a ``minLng,minLat,maxLng,maxLat`` bounding box.
+
+    Raises:
+        ValueError: If the value is not four numbers within coordinate ranges
+    """
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError('bbox must be minLng,minLat,maxLng,maxLat')
+    bbox = BoundingBox(*(float(part) for part in parts))
+    for longitude in (bbox.min_longitude, bbox.max_longitude):
+        if not -180 <= longitude <= 180:
+            raise ValueError(f'bbox longitude {longitude} is out of range')
+    for latitude in (bbox.min_latitude, bbox.max_latitude):
+        if not -90 <= latitude <= 90:
+            raise ValueError(f'bbox latitude {latitude} is out of range')
+    if bbox.min_latitude > bbox.max_latitude:
+        raise ValueError('bbox minLat must not be greater than maxLat')
+    return bbox
+
+
+def request_bbox(request) -> Optional[BoundingBox]:
+    """
+    The ?bbox= viewport of a request, or None when it has none.
+
+    Raises:
+        ValueError: If the parameter is malformed
+    """
+    value = request.GET.get(BBOX_PARAMETER)
+    return parse_bbox(value) if value else None
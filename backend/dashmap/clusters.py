@@ -0,0 +1,249 @@
+import math
+from collections import defaultdict
+from typing import List, Dict, Any, Iterable, NamedTuple, Optional, Tuple
+from django.core.cache import cache
+from django.db.models import Count, Max, QuerySet
+from .bbox import BoundingBox
+from .spatial import filter_bbox
+
+MIN_CLUSTER_ZOOM = 0
+# Above this zoom every point is returned on its own
+MAX_CLUSTER_ZOOM = 16
+
+# Points closer than this many screen pixels (with 256 px tiles) share a cluster
+CLUSTER_RADIUS_PIXELS = 60
+TILE_SIZE = 256
+
+# Entries are also keyed on a fingerprint of their points, so changes never serve stale clusters
+CLUSTER_CACHE_TIMEOUT = 3600
+
+# Viewports are clustered in square blocks of this many grid cells a side (about
+# one 256 px tile), each cached on its own; wider viewports are clustered whole
+CLUSTER_BLOCK_CELLS = 4
+MAX_CLUSTER_BLOCKS = 64
+
+MAX_LATITUDE = 85.05112878
+
+
+class Cluster(NamedTuple):
+    """
+    Points merged at one zoom level.
+
+    ``x`` and ``y`` are the count-weighted centroid in Web Mercator world
+    coordinates, from 0 to 1. A lone point keeps its ``point_id``; merged
+    points have ``expansion_zoom``, the first zoom level at which they split.
+    """
+
+    x: float
+    y: float
+    count: int
+    point_id: Optional[int]
+    expansion_zoom: Optional[int]
+
+
+def project(latitude: float, longitude: float) -> Tuple[float, float]:
+    """WGS84 coordinates to Web Mercator world coordinates, from 0 to 1"""
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    sine = math.sin(math.radians(latitude))
+    return (longitude + 180) / 360, 0.5 - math.log((1 + sine) / (1 - sine)) / (4 * math.pi)
+
+
+def unproject(x: float, y: float) -> Tuple[float, float]:
+    """Web Mercator world coordinates back to (latitude, longitude)"""
+    latitude = math.degrees(2 * math.atan(math.exp((0.5 - y) * 2 * math.pi)) - math.pi / 2)
+    return latitude, x * 360 - 180
+
+
+def build_clusters(
+    points: Iterable[Tuple[int, float, float]], min_zoom: int = MIN_CLUSTER_ZOOM
+) -> Dict[int, List[Cluster]]:
+    """
+    Cluster points at every zoom level from MAX_CLUSTER_ZOOM down to ``min_zoom``.
+
+    Hierarchical grid clustering, in the spirit of supercluster: each level
+    merges the clusters of the level above that fall in the same grid cell,
+    with cells CLUSTER_RADIUS_PIXELS wide on screen. Every level is built
+    from the previous one rather than from the raw points, so the whole
+    hierarchy costs about as much as clustering the points once per level
+    of the already-reduced set.
+
+    Args:
+        points: (id, latitude, longitude) tuples
+        min_zoom: Lowest zoom level to build
+
+    Returns:
+        Dict of zoom level to clusters; MAX_CLUSTER_ZOOM + 1 holds the lone points
+    """
+    level = []
+    for point_id, latitude, longitude in points:
+        x, y = project(float(latitude), float(longitude))
+        level.append(Cluster(x, y, 1, point_id, None))
+
+    levels = {MAX_CLUSTER_ZOOM + 1: level}
+    for zoom in range(MAX_CLUSTER_ZOOM, min_zoom - 1, -1):
+        cell_size = CLUSTER_RADIUS_PIXELS / (TILE_SIZE * 2 ** zoom)
+        cells = defaultdict(list)
+        for cluster in level:
+            cells[(math.floor(cluster.x / cell_size), math.floor(cluster.y / cell_size))].append(cluster)
+
+        level = []
+        for children in cells.values():
+            if len(children) == 1:
+                # Unchanged from the level above
+                level.append(children[0])
+                continue
+            count = sum(child.count for child in children)
+            level.append(Cluster(
+                x=sum(child.x * child.count for child in children) / count,
+                y=sum(child.y * child.count for child in children) / count,
+                count=count,
+                point_id=None,
+                expansion_zoom=zoom + 1,
+            ))
+        levels[zoom] = level
+    return levels
+
+
+def serialize_cluster(cluster: Cluster, latitude: float, longitude: float) -> Dict[str, Any]:
+    return {
+        'latitude': f"{latitude:.7f}",
+        'longitude': f"{longitude:.7f}",
+        'count': cluster.count,
+        'id': cluster.point_id,
+        'expansion_zoom': cluster.expansion_zoom,
+    }
+
+
+def _vehicle_layer():
+    from positions.models import VehicleLatestPosition
+    return VehicleLatestPosition.objects.all(), 'vehicle_id'
+
+
+def _stop_layer():
+    from orders.models import Stop
+    return Stop.objects.filter(latitude__isnull=False, longitude__isnull=False), 'id'
+
+
+# Clustered layers: queryset of rows with coordinates, and the ID reported for lone points
+CLUSTER_LAYERS = {
+    'vehicles': _vehicle_layer,
+    'stops': _stop_layer,
+}
+
+
+def block_size(zoom: int) -> float:
+    """Side of the cluster blocks of a zoom level, in Web Mercator world coordinates"""
+    return CLUSTER_BLOCK_CELLS * CLUSTER_RADIUS_PIXELS / (TILE_SIZE * 2 ** zoom)
+
+
+def viewport_blocks(zoom: int, bbox: BoundingBox) -> Optional[List[Tuple[int, int]]]:
+    """(column, row) of the blocks of a zoom level that a viewport overlaps, or None past MAX_CLUSTER_BLOCKS"""
+    size = block_size(zoom)
+    if bbox.crosses_antimeridian:
+        spans = [(bbox.min_longitude, 180), (-180, bbox.max_longitude)]
+    else:
+        spans = [(bbox.min_longitude, bbox.max_longitude)]
+    north, south = project(bbox.max_latitude, 0)[1], project(bbox.min_latitude, 0)[1]
+    rows = range(math.floor(north / size), math.floor(south / size) + 1)
+    column_ranges = [
+        range(math.floor(project(0, west)[0] / size), math.floor(project(0, east)[0] / size) + 1)
+        for west, east in spans
+    ]
+    if sum(len(columns) for columns in column_ranges) * len(rows) > MAX_CLUSTER_BLOCKS:
+        return None
+    columns = sorted({column for columns in column_ranges for column in columns})
+    return [(column, row) for column in columns for row in rows]
+
+
+def _block_bbox(zoom: int, column: int, row: int) -> BoundingBox:
+    # Widened a little: the exact block is chosen on the projected coordinates
+    size = block_size(zoom)
+    max_latitude, min_longitude = unproject(column * size, row * size)
+    min_latitude, max_longitude = unproject((column + 1) * size, (row + 1) * size)
+    margin = 1e-6
+    return BoundingBox(
+        max(min_longitude - margin, -180),
+        -90 if (row + 1) * size >= 1 else max(min_latitude - margin, -90),
+        min(max_longitude + margin, 180),
+        90 if row == 0 else min(max_latitude + margin, 90),
+    )
+
+
+def _fingerprint(queryset: QuerySet) -> str:
+    version = queryset.order_by().aggregate(count=Count('pk'), updated_at=Max('updated_at'))
+    updated_at = version['updated_at'].timestamp() if version['updated_at'] else 0
+    return f"{version['count']}:{updated_at:.6f}"
+
+
+def _block_clusters(layer: str, zoom: int, column: int, row: int) -> List[Cluster]:
+    """
+    Clusters of one block of a zoom level.
+
+    Blocks are aligned on the zoom level's grid, and the grids of higher
+    levels subdivide it, so clustering a block's points on their own gives
+    the same clusters as clustering the whole layer.
+    """
+    queryset, id_field = CLUSTER_LAYERS[layer]()
+    queryset = filter_bbox(queryset, _block_bbox(zoom, column, row))
+
+    key = f"clusters:{layer}:{zoom}:{column}:{row}:{_fingerprint(queryset)}"
+    clusters = cache.get(key)
+    if clusters is None:
+        size = block_size(zoom)
+        points = []
+        for point_id, latitude, longitude in queryset.values_list(id_field, 'latitude', 'longitude'):
+            x, y = project(float(latitude), float(longitude))
+            if (math.floor(x / size), math.floor(y / size)) == (column, row):
+                points.append((point_id, latitude, longitude))
+        clusters = build_clusters(points, zoom)[zoom]
+        cache.set(key, clusters, CLUSTER_CACHE_TIMEOUT)
+    return clusters
+
+
+def _layer_clusters(layer: str, zoom: int) -> List[Cluster]:
+    """Clusters of a whole layer at a zoom level, cached with a fingerprint of the layer"""
+    queryset, id_field = CLUSTER_LAYERS[layer]()
+
+    key = f"clusters:{layer}:{zoom}:{_fingerprint(queryset)}"
+    clusters = cache.get(key)
+    if clusters is None:
+        points = queryset.values_list(id_field, 'latitude', 'longitude').iterator(chunk_size=2000)
+        clusters = build_clusters(points, zoom)[zoom]
+        cache.set(key, clusters, CLUSTER_CACHE_TIMEOUT)
+    return clusters
+
+
+def layer_clusters(layer: str, zoom: int, bbox: Optional[BoundingBox] = None) -> List[Dict[str, Any]]:
+    """
+    Clusters of a layer at a zoom level, optionally limited to a viewport.
+
+    A viewport is clustered block by block. Each block is cached with the
+    number of its points and their newest ``updated_at``, so a vehicle that
+    moves only rebuilds the blocks it left and entered; the check is one
+    indexed aggregate per block. Without a viewport, or with one spanning
+    more than MAX_CLUSTER_BLOCKS blocks, the layer is clustered as a whole.
+
+    Args:
+        layer: Key of CLUSTER_LAYERS
+        zoom: Map zoom level; above MAX_CLUSTER_ZOOM points are not clustered
+        bbox: Viewport the cluster centroids must fall in
+
+    Raises:
+        KeyError: If the layer is unknown
+    """
+    level_zoom = min(max(zoom, MIN_CLUSTER_ZOOM), MAX_CLUSTER_ZOOM + 1)
+
+    blocks = viewport_blocks(level_zoom, bbox) if bbox is not None else None
+    if blocks is not None:
+        clusters = [
+            cluster for column, row in blocks for cluster in _block_clusters(layer, level_zoom, column, row)
+        ]
+    else:
+        clusters = _layer_clusters(layer, level_zoom)
+
+    results = []
+    for cluster in clusters:
+        latitude, longitude = unproject(cluster.x, cluster.y)
+        if bbox is None or bbox.contains(latitude, longitude):
+            results.append(serialize_cluster(cluster, latitude, longitude))
+    return results
@@ -10,6 +10,7 @@ from trips.models import Trip, TripStop
 from trips.services import get_orders_requiring_both_stops, add_order_to_trip
 from orders.models import Stop, Order
 from positions.models import Position
+from positions.services import save_positions
 from accounts.models import AuthToken, UserProfile
 
 class Command(BaseCommand):
@@ -213,14 +214,14 @@ class Command(BaseCommand):
 
         # Create test positions for active vehicles
         self.stdout.write('Creating test position data...')
-        total_positions = 0
+        positions = []
 
         # Generate positions for half the vehicles
         for vehicle in vehicles[:10]:
             # Create positions for the last 24 hours
             for _ in range(24):
                 coords = fake.local_latlng(country_code='FR')
-                Position.objects.create(
+                positions.append(Position(
                     vehicle=vehicle,
                     latitude=coords[0],
                     longitude=coords[1],
@@ -231,8 +232,10 @@ class Command(BaseCommand):
                     odometer=fake.random_int(min=50000, max=150000),
                     fuel_level=fake.random_int(min=15, max=95),
                     engine_status=fake.random_element(['on', 'idle', 'off'])
-                )
-                total_positions += 1
+                ))
+
+        # Go through the ingest path so derived position data is maintained too
+        total_positions = len(save_positions(positions)['stored'])
 
         self.stdout.write(f'Created {total_positions} position records')
 
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+from typing import List, Dict, Any, Hashable, Iterable, Optional
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+LIVE_UPDATES_PATH = '/ws/live/'
+
+# Orders and their stops belong to no company, so every connection receives them
+ORDERS_TOPIC = 'orders'
+
+# Close codes of refused connections (4000-4999 are free for applications)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NO_COMPANY = 4403
+
+
+def company_topic(company_id: int) -> str:
+    return f'company:{company_id}'
+
+
+class Subscription:
+    """
+    Bounded send queue of one WebSocket connection.
+
+    Events are keyed by the object they describe. An event for an object
+    that is still queued replaces the queued one, so a client that falls
+    behind receives the latest state of each object once rather than every
+    intermediate change. When ``max_size`` distinct objects are queued the
+    oldest event is dropped, and the client is told how many were dropped
+    so it can refetch.
+
+    Events are pushed from any thread and read from the connection's event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_size: int = 256):
+        self.max_size = max_size
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._dropped = 0
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def push(self, key: Hashable, event: Dict[str, Any]) -> None:
+        with self._lock:
+            if key in self._pending:
+                # Keeps its place in the queue, with the newest content
+                self._pending[key] = event
+            else:
+                if len(self._pending) >= self.max_size:
+                    self._pending.popitem(last=False)
+                    self._dropped += 1
+                self._pending[key] = event
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The connection's event loop is closed
+            pass
+
+    async def get(self) -> List[Dict[str, Any]]:
+        """Wait for events and take all of them, oldest first"""
+        while True:
+            await self._ready.wait()
+            with self._lock:
+                self._ready.clear()
+                events = list(self._pending.values())
+                self._pending.clear()
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                events.insert(0, {'type': 'overflow', 'dropped': dropped})
+            if events:
+                return events
+
+
+class EventHub:
+    """Process-local topics of live update subscriptions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = defaultdict(set)
+
+    def subscribe(self, topics: Iterable[str], subscription: Subscription) -> None:
+        with self._lock:
+            for topic in topics:
+                self._topics[topic].add(subscription)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for topic in list(self._topics):
+                self._topics[topic].discard(subscription)
+                if not self._topics[topic]:
+                    del self._topics[topic]
+
+    def has_subscribers(self, topic: Optional[str] = None) -> bool:
+        if topic is None:
+            return bool(self._topics)
+        return topic in self._topics
+
+    def publish(self, topic: str, key: Hashable, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscriptions = list(self._topics.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.push(key, event)
+
+
+event_hub = EventHub()
+
+
+def publish_on_commit(topic: str, key: Hashable, event: Dict[str, Any]) -> None:
+    """Publish an event once the current transaction commits, and not at all if it rolls back"""
+    transaction.on_commit(lambda: event_hub.publish(topic, key, event))
+
+
+def _vehicle_companies(vehicle_ids: Iterable[int]) -> Dict[int, int]:
+    from vehicles.models import Vehicle
+    return dict(Vehicle.objects.filter(id__in=set(vehicle_ids)).values_list('id', 'company_id'))
+
+
+def _change_event(kind: str, instance, created: Optional[bool]) -> Dict[str, Any]:
+    action = 'deleted' if created is None else 'created' if created else 'updated'
+    return {'type': kind, 'action': action, 'id': instance.id}
+
+
+def _trip_company(trip_id: int) -> Optional[int]:
+    from trips.models import Trip
+    return Trip.objects.filter(id=trip_id).values_list('vehicle__company_id', flat=True).first()
+
+
+def _trip_changed(sender, instance, created=None, **kwargs):
+    if not event_hub.has_subscribers():
+        return
+    company_id = _vehicle_companies([instance.vehicle_id]).get(instance.vehicle_id)
+    if company_id is not None:
+        publish_on_commit(company_topic(company_id), ('trip', instance.id), _change_event('trip', instance, created))
+
+
+def _trip_stop_changed(sender, instance, created=None, **kwargs):
+    if not event_hub.has_subscribers():
+        return
+    # Gone already when the whole trip is deleted; the trip's event covers it
+    company_id = _trip_company(instance.trip_id)
+    if company_id is not None:
+        event = _change_event('trip_stop', instance, created)
+        event['trip_id'] = instance.trip_id
+        publish_on_commit(company_topic(company_id), ('trip_stop', instance.id), event)
+
+
+def _order_changed(sender, instance, created=None, **kwargs):
+    if event_hub.has_subscribers(ORDERS_TOPIC):
+        publish_on_commit(ORDERS_TOPIC, ('order', instance.id), _change_event('order', instance, created))
+
+
+def _stop_changed(sender, instance, created=None, **kwargs):
+    if event_hub.has_subscribers(ORDERS_TOPIC):
+        event = _change_event('stop', instance, created)
+        event['order_id'] = instance.order_id
+        publish_on_commit(ORDERS_TOPIC, ('stop', instance.id), event)
+
+
+def publish_trip_stops(trip_stop_ids: Iterable[int]) -> None:
+    """
+    Publish trip stops changed by queryset updates, which send no signals, on commit.
+
+    Used for the arrivals and departures stamped during position ingest.
+    """
+    trip_stop_ids = set(trip_stop_ids)
+    if not trip_stop_ids or not event_hub.has_subscribers():
+        return
+    from trips.models import TripStop
+    rows = TripStop.objects.filter(id__in=trip_stop_ids).values_list('id', 'trip_id', 'trip__vehicle__company_id')
+    for trip_stop_id, trip_id, company_id in rows:
+        publish_on_commit(company_topic(company_id), ('trip_stop', trip_stop_id), {
+            'type': 'trip_stop', 'action': 'updated', 'id': trip_stop_id, 'trip_id': trip_id,
+        })
+
+
+def publish_positions(positions) -> None:
+    """
+    Publish the newest of the committed positions of each vehicle to its company.
+
+    Called once the ingest transaction has committed. Events are keyed by
+    vehicle, so a slow client only receives each vehicle's latest point.
+    """
+    if not positions or not event_hub.has_subscribers():
+        return
+    newest = {}
+    for position in positions:
+        current = newest.get(position.vehicle_id)
+        if current is None or position.timestamp > current.timestamp:
+            newest[position.vehicle_id] = position
+
+    companies = _vehicle_companies(newest)
+    for vehicle_id, position in newest.items():
+        if vehicle_id not in companies:
+            continue
+        event_hub.publish(company_topic(companies[vehicle_id]), ('position', vehicle_id), {
+            'type': 'position',
+            'id': position.id,
+            'vehicle_id': vehicle_id,
+            'latitude': f"{position.latitude:.7f}",
+            'longitude': f"{position.longitude:.7f}",
+            'speed': f"{position.speed:.2f}",
+            'heading': f"{position.heading:.2f}",
+            'timestamp': position.timestamp.isoformat(),
+        })
+
+
+def connect_signals() -> None:
+    """Publish the changes of trips, trip stops, orders and stops; called from DashmapConfig.ready()"""
+    from orders.models import Order, Stop
+    from trips.models import Trip, TripStop
+
+    receivers = ((Trip, _trip_changed), (TripStop, _trip_stop_changed), (Order, _order_changed), (Stop, _stop_changed))
+    for model, receiver in receivers:
+        for name, signal in (('save', post_save), ('delete', post_delete)):
+            signal.connect(receiver, sender=model, dispatch_uid=f'dashmap.realtime.{model.__name__}.{name}')
+
+
+def token_company(key: Optional[str]) -> Dict[str, Any]:
+    """Company of the user owning an auth token, as {'user': bool, 'company_id': int or None}"""
+    from accounts.models import AuthToken
+    token = AuthToken.objects.select_related('user__profile').filter(key=key).first() if key else None
+    if token is None:
+        return {'user': False, 'company_id': None}
+    profile = getattr(token.user, 'profile', None)
+    return {'user': True, 'company_id': profile.company_id if profile else None}
+
+
+async def live_updates(scope, receive, send) -> None:
+    """
+    ASGI WebSocket application pushing the live updates of a company.
+
+    The client authenticates with ``?token=``, as browsers cannot set
+    headers on WebSocket requests. Each connection has a bounded
+    Subscription; events are sent as JSON text frames. Messages from the
+    client are ignored.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    owner = await sync_to_async(token_company)(token)
+    if owner['company_id'] is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NO_COMPANY if owner['user'] else CLOSE_UNAUTHORIZED})
+        return
+    await send({'type': 'websocket.accept'})
+
+    config = getattr(settings, 'LIVE_UPDATES', {})
+    subscription = Subscription(asyncio.get_running_loop(), config.get('QUEUE_SIZE', 256))
+    event_hub.subscribe([company_topic(owner['company_id']), ORDERS_TOPIC], subscription)
+    encoder = DjangoJSONEncoder()
+
+    async def send_events():
+        while True:
+            for event in await subscription.get():
+                await send({'type': 'websocket.send', 'text': encoder.encode(event)})
+
+    sender = asyncio.ensure_future(send_events())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+    finally:
+        event_hub.unsubscribe(subscription)
+        sender.cancel()
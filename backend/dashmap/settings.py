@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'orders',
     'trips',
     'positions',
+    'changes',
 ]
 
 MIDDLEWARE = [
@@ -132,6 +133,81 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Write-behind buffer for position ingest (see positions/buffer.py).
+# When enabled, ingest requests return as soon as positions are validated and a
+# single writer thread group-commits them, which avoids taking SQLite's writer
+# lock once per request.
+POSITION_WRITE_BUFFER = {
+    'ENABLED': False,
+    'MAX_BATCH_SIZE': 500,
+    'MAX_DELAY': 0.2,  # seconds
+    'MAX_QUEUE_SIZE': 50000,
+}
+
+# Process-local fleet state (see positions/fleet_state.py): latest position and
+# a ring buffer of recent points per vehicle, served from memory.
+FLEET_STATE = {
+    'ENABLED': True,
+    'TRACK_LENGTH': 720,  # points kept per vehicle
+    'TRACK_WINDOW': 3600,  # seconds of history loaded at warm-up
+    'SYNC_INTERVAL': 1.0,  # seconds between catch-ups with other processes
+}
+
+# Dwell detection on position ingest (see positions/dwell.py): a vehicle
+# staying within RADIUS meters below MAX_SPEED km/h for MIN_DURATION seconds,
+# within STOP_RADIUS meters of the next stop of its in-progress trip, stamps
+# that stop's actual arrival and departure.
+DWELL_DETECTION = {
+    'ENABLED': True,
+    'MAX_SPEED': 5,
+    'RADIUS': 50,
+    'MIN_DURATION': 180,
+    'STOP_RADIUS': 150,
+}
+
+# Stop geofences checked on position ingest (see positions/geofence.py): a
+# vehicle coming within RADIUS meters of a stop of its in-progress trip stamps
+# the stop's actual arrival; moving more than EXIT_RADIUS meters away stamps
+# its actual departure and completes it. Fences are indexed in a grid of
+# CELL_SIZE degrees, fully reloaded every REFRESH_INTERVAL seconds.
+GEOFENCE = {
+    'ENABLED': True,
+    'RADIUS': 100,
+    'EXIT_RADIUS': 150,
+    'CELL_SIZE': 0.01,
+    'REFRESH_INTERVAL': 30,
+}
+
+# Server-Sent Events stream of new positions (see positions/stream.py). Each
+# stream checks for positions stored by other processes every POLL_INTERVAL
+# seconds, sends a heartbeat after HEARTBEAT_INTERVAL idle seconds, and ends
+# after MAX_DURATION seconds; clients reconnect after RETRY milliseconds.
+POSITION_STREAM = {
+    'HEARTBEAT_INTERVAL': 15,
+    'POLL_INTERVAL': 1.0,
+    'MAX_DURATION': 300,
+    'RETRY': 3000,
+}
+
+# Live updates WebSocket (see dashmap/realtime.py, served by dashmap/asgi.py):
+# each connection queues at most QUEUE_SIZE distinct objects' events.
+LIVE_UPDATES = {
+    'QUEUE_SIZE': 256,
+}
+
+# Cold archive of old positions (see positions/archive.py). The
+# archive_positions command moves positions older than RETENTION_DAYS out of
+# the database into one compressed file per vehicle and day under ROOT.
+# COMPRESSION is 'gzip' or 'zstd' (requires the zstandard package).
+# History queries decode archived days on demand and keep the last
+# CACHE_CHUNKS decoded vehicle-days in memory.
+POSITION_ARCHIVE = {
+    'RETENTION_DAYS': 90,
+    'ROOT': BASE_DIR / 'archive' / 'positions',
+    'COMPRESSION': 'gzip',
+    'CACHE_CHUNKS': 64,
+}
+
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # CORS settings
@@ -0,0 +1,192 @@
+import math
+from typing import List, Dict, NamedTuple, Tuple
+from django.db import connections
+from django.db.models import QuerySet
+from django.db.models.expressions import RawSQL
+from .bbox import BoundingBox
+
+METERS_PER_DEGREE = 111320.0
+
+
+class SpatialIndex(NamedTuple):
+    """
+    SQLite R*Tree mirroring the coordinates of a table's rows.
+
+    Coordinates are kept as integers scaled by 10**decimal_places in an
+    ``rtree_i32`` table, which is exact for the precision the columns store.
+    Columns already stored that way (positions/fields.py) are copied as is.
+    Triggers on the source table keep the R*Tree in sync on insert, update
+    and delete; rows without coordinates are left out. Other databases have
+    no R*Tree and are served by the (latitude, longitude) columns directly.
+    """
+
+    table: str
+    decimal_places: int
+    stored_scaled: bool = False
+
+    @property
+    def rtree_table(self) -> str:
+        return f'{self.table}_rtree'
+
+    def _scaled(self, column: str) -> str:
+        if self.stored_scaled:
+            return column
+        return f'CAST(ROUND({column} * {10 ** self.decimal_places}) AS INTEGER)'
+
+    def _statements(self) -> List[str]:
+        rtree = self.rtree_table
+        latitude, longitude = self._scaled('NEW.latitude'), self._scaled('NEW.longitude')
+        return [
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree_i32('
+            f'id, min_latitude, max_latitude, min_longitude, max_longitude)',
+            f'DELETE FROM {rtree}',
+            f'INSERT INTO {rtree} SELECT id, {self._scaled("latitude")}, {self._scaled("latitude")}, '
+            f'{self._scaled("longitude")}, {self._scaled("longitude")} FROM {self.table} '
+            f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL',
+            f'CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {self.table} '
+            f'WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL BEGIN '
+            f'INSERT INTO {rtree} VALUES (NEW.id, {latitude}, {latitude}, {longitude}, {longitude}); END',
+            f'CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF id, latitude, longitude ON {self.table} BEGIN '
+            f'DELETE FROM {rtree} WHERE id = OLD.id; '
+            f'INSERT INTO {rtree} SELECT NEW.id, {latitude}, {latitude}, {longitude}, {longitude} '
+            f'WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL; END',
+            f'CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {self.table} BEGIN '
+            f'DELETE FROM {rtree} WHERE id = OLD.id; END',
+        ]
+
+    def _triggers(self) -> List[str]:
+        return [f'{self.rtree_table}_{event}' for event in ('insert', 'update', 'delete')]
+
+    def is_installed(self, connection) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s AND name IN (%s, %s, %s)",
+                [self.table, *self._triggers()],
+            )
+            return cursor.fetchone()[0] == 3
+
+    def install(self, connection) -> None:
+        """Create the R*Tree and its triggers, and fill it from the table"""
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            for statement in self._statements():
+                cursor.execute(statement)
+
+    def uninstall(self, connection) -> None:
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            for trigger in self._triggers():
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.rtree_table}')
+
+    def ensure(self, connection) -> bool:
+        """
+        Install the R*Tree again if its triggers are gone.
+
+        SQLite drops a table's triggers when a migration rebuilds the table,
+        after which the R*Tree would silently fall behind.
+
+        Returns:
+            Whether it had to be installed
+        """
+        if connection.vendor != 'sqlite' or self.table not in connection.introspection.table_names():
+            return False
+        if self.is_installed(connection):
+            return False
+        self.install(connection)
+        return True
+
+    def ids_within(self, bbox: BoundingBox) -> RawSQL:
+        """Subquery of the IDs of the rows within a bounding box"""
+        scale = 10 ** self.decimal_places
+        south, north = math.ceil(bbox.min_latitude * scale), math.floor(bbox.max_latitude * scale)
+        if bbox.crosses_antimeridian:
+            ranges = [(bbox.min_longitude, 180), (-180, bbox.max_longitude)]
+        else:
+            ranges = [(bbox.min_longitude, bbox.max_longitude)]
+
+        select = (
+            f'SELECT id FROM {self.rtree_table} WHERE min_latitude >= %s AND max_latitude <= %s '
+            f'AND min_longitude >= %s AND max_longitude <= %s'
+        )
+        params = []
+        for west, east in ranges:
+            params += [south, north, math.ceil(west * scale), math.floor(east * scale)]
+        return RawSQL(' UNION ALL '.join([select] * len(ranges)), params)
+
+
+# Indexed tables, by name
+SPATIAL_INDEXES: Dict[str, SpatialIndex] = {
+    index.table: index
+    for index in (
+        SpatialIndex('orders_stop', decimal_places=6),
+        SpatialIndex('positions_position', decimal_places=7, stored_scaled=True),
+    )
+}
+
+
+def _spatial_index(queryset: QuerySet):
+    index = SPATIAL_INDEXES.get(queryset.model._meta.db_table)
+    if index is not None and connections[queryset.db].vendor == 'sqlite':
+        return index
+    return None
+
+
+def filter_bbox(queryset: QuerySet, bbox: BoundingBox) -> QuerySet:
+    """
+    Restrict a queryset of a model with latitude and longitude fields to a bounding box.
+
+    Uses the model's R*Tree when it has one, and range conditions on the
+    coordinate columns otherwise.
+    """
+    index = _spatial_index(queryset)
+    if index is None:
+        return queryset.filter(bbox.q())
+    return queryset.filter(id__in=index.ids_within(bbox))
+
+
+def radius_bbox(latitude: float, longitude: float, radius: float) -> BoundingBox:
+    """Smallest bounding box around a circle of ``radius`` meters"""
+    latitude_margin = radius / METERS_PER_DEGREE
+    south, north = max(latitude - latitude_margin, -90), min(latitude + latitude_margin, 90)
+    cosine = math.cos(math.radians(max(abs(south), abs(north))))
+    if south == -90 or north == 90 or radius >= cosine * METERS_PER_DEGREE * 180:
+        # Around a pole, every longitude is within reach
+        return BoundingBox(-180, south, 180, north)
+
+    longitude_margin = radius / (METERS_PER_DEGREE * cosine)
+    west, east = longitude - longitude_margin, longitude + longitude_margin
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return BoundingBox(west, south, east, north)
+
+
+def within_radius(queryset: QuerySet, latitude: float, longitude: float, radius: float) -> List[Tuple[object, float]]:
+    """
+    Rows of a queryset within ``radius`` meters of a point, nearest first.
+
+    The R*Tree, or the coordinate columns, narrow the rows down to the
+    circle's bounding box; the exact distance is then computed for those only.
+
+    Returns:
+        List of (instance, distance in meters) pairs
+    """
+    from positions.rollups import haversine
+
+    results = []
+    for instance in filter_bbox(queryset, radius_bbox(latitude, longitude, radius)):
+        distance = haversine(latitude, longitude, float(instance.latitude), float(instance.longitude))
+        if distance <= radius:
+            results.append((instance, distance))
+    results.sort(key=lambda result: result[1])
+    return results
+
+
+def ensure_spatial_indexes(using: str = 'default', **kwargs) -> List[str]:
+    """Reinstall the R*Trees whose triggers were dropped; connected to post_migrate"""
+    connection = connections[using]
+    return [index.table for index in SPATIAL_INDEXES.values() if index.ensure(connection)]
@@ -0,0 +1,319 @@
+from django.test import TestCase, TransactionTestCase
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+import json
+import struct
+from unittest.mock import patch
+from companies.models import Company
+from vehicles.models import Vehicle
+from orders.models import Order, Stop
+from positions.models import Position
+from positions.services import save_positions
+from .bbox import parse_bbox
+from .clusters import MAX_CLUSTER_ZOOM, build_clusters, layer_clusters, project
+from .tiles import MVT_CONTENT_TYPE, TILE_EXTENT
+from test_utils import AuthenticatedTestMixin
+from asgiref.testing import ApplicationCommunicator
+from .asgi import application as asgi_application
+
+
+class ClusterTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        cache.clear()
+        self.company = Company.objects.create(name='Cluster Company', address='1 Grid Sq')
+        self.vehicles = [
+            Vehicle.objects.create(
+                company=self.company, license_plate=f'CLU-{i:03d}', make='Ford', model='Transit', year=2022,
+                capacity=2.5, driver_name=f'Driver {i}', driver_email=f'driver{i}@example.com',
+            )
+            for i in range(4)
+        ]
+        now = timezone.now()
+        # Three vehicles around Lyon, a few hundred meters apart, one in Paris
+        coordinates = [(45.7640, 4.8357), (45.7660, 4.8380), (45.7620, 4.8330), (48.8566, 2.3522)]
+        save_positions([
+            Position(vehicle=vehicle, latitude=latitude, longitude=longitude, speed=0, heading=0, timestamp=now)
+            for vehicle, (latitude, longitude) in zip(self.vehicles, coordinates)
+        ])
+
+    def clusters(self, query):
+        response = self.authenticated_request('GET', f'/api/clusters/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(response.json()['results'], key=lambda cluster: -cluster['count'])
+
+    def test_clusters_merge_with_zoom(self):
+        self.assertEqual([cluster['count'] for cluster in self.clusters('layer=vehicles&zoom=5')], [3, 1])
+        lyon, paris = self.clusters('layer=vehicles&zoom=5')
+        self.assertAlmostEqual(float(lyon['latitude']), 45.764, places=2)
+        self.assertIsNone(lyon['id'])
+        self.assertGreater(lyon['expansion_zoom'], 5)
+        self.assertEqual(paris['id'], self.vehicles[3].id)
+
+        self.assertEqual([cluster['count'] for cluster in self.clusters('layer=vehicles&zoom=0')], [4])
+        self.assertEqual(len(self.clusters(f'layer=vehicles&zoom={MAX_CLUSTER_ZOOM + 1}')), 4)
+        # Viewport around Paris
+        self.assertEqual(self.clusters('layer=vehicles&zoom=5&bbox=2,48,3,49')[0]['id'], self.vehicles[3].id)
+
+    def test_cluster_hierarchy_is_consistent(self):
+        levels = build_clusters((i, 45 + i * 0.001, 4 + i * 0.001) for i in range(50))
+        for zoom, clusters in levels.items():
+            self.assertEqual(sum(cluster.count for cluster in clusters), 50)
+            if zoom > 0:
+                self.assertGreaterEqual(len(clusters), len(levels[zoom - 1]))
+
+    def test_clusters_cached_per_block(self):
+        lyon = 'layer=vehicles&zoom=8&bbox=4.7,45.7,4.9,45.8'
+        self.assertEqual([cluster['count'] for cluster in self.clusters(lyon)], [3])
+
+        with patch('dashmap.clusters.build_clusters', wraps=build_clusters) as build:
+            self.clusters(lyon)
+            # A vehicle moving far away leaves the blocks of the viewport cached
+            save_positions([Position(vehicle=self.vehicles[3], latitude=48.86, longitude=2.35, speed=0, heading=0,
+                                     timestamp=timezone.now())])
+            self.clusters(lyon)
+            self.assertFalse(build.called)
+
+            save_positions([Position(vehicle=self.vehicles[3], latitude=45.765, longitude=4.836, speed=0, heading=0,
+                                     timestamp=timezone.now())])
+            self.assertEqual([cluster['count'] for cluster in self.clusters(lyon)], [4])
+            self.assertTrue(build.called)
+
+    def test_viewport_blocks_match_whole_layer(self):
+        for i in range(60):
+            Stop.objects.create(name=f'Stop {i}', address='1 Rue', stop_type='pickup',
+                                latitude=Decimal(f'{43 + (i * 0.137) % 7:.6f}'),
+                                longitude=Decimal(f'{-1 + (i * 0.311) % 9:.6f}'))
+        bbox = parse_bbox('-2,42,9,51')
+
+        def summary(clusters):
+            return sorted(
+                (cluster['count'], cluster['id'] or 0, cluster['expansion_zoom'] or 0,
+                 round(float(cluster['latitude']), 5), round(float(cluster['longitude']), 5))
+                for cluster in clusters
+            )
+
+        for zoom in range(MAX_CLUSTER_ZOOM + 2):
+            with self.subTest(zoom=zoom):
+                whole = [
+                    cluster for cluster in layer_clusters('stops', zoom)
+                    if bbox.contains(float(cluster['latitude']), float(cluster['longitude']))
+                ]
+                self.assertEqual(summary(layer_clusters('stops', zoom, bbox)), summary(whole))
+                self.assertEqual(sum(cluster['count'] for cluster in whole), 60)
+
+    def test_stop_layer_and_validation(self):
+        Stop.objects.create(name='Depot', address='1 Rue', latitude=Decimal('45.764'), longitude=Decimal('4.8357'),
+                            stop_type='pickup')
+        Stop.objects.create(name='Unlocated', address='?', stop_type='delivery')
+        self.assertEqual([cluster['count'] for cluster in self.clusters('layer=stops&zoom=3')], [1])
+
+        for query in ('layer=roads&zoom=3', 'layer=stops', 'layer=stops&zoom=30', 'layer=stops&zoom=3&bbox=1,2'):
+            response = self.authenticated_request('GET', f'/api/clusters/?{query}')
+            self.assertEqual(response.status_code, 400)
+
+
+def read_varints(data):
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append(value)
+            value, shift = 0, 0
+    return values
+
+
+def read_protobuf(data):
+    """(field, value) pairs of a protobuf message; enough of the format for vector tiles"""
+    fields, offset = [], 0
+    while offset < len(data):
+        start = offset
+        while data[offset] & 0x80:
+            offset += 1
+        offset += 1
+        key, = read_varints(data[start:offset])
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            start = offset
+            while data[offset] & 0x80:
+                offset += 1
+            offset += 1
+            fields.append((field, read_varints(data[start:offset])[0]))
+            continue
+        if wire_type == 2:
+            start = offset
+            while data[offset] & 0x80:
+                offset += 1
+            offset += 1
+            length = read_varints(data[start:offset])[0]
+        else:
+            length = 8
+        fields.append((field, data[offset:offset + length]))
+        offset += length
+    return fields
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_tile(data):
+    """Layers of a Mapbox Vector Tile, as {name: {'extent', 'features'}}"""
+    layers = {}
+    for _, layer_data in read_protobuf(data):
+        layer = read_protobuf(layer_data)
+        keys = [value.decode() for field, value in layer if field == 3]
+        values = []
+        for (value_field, value), in (read_protobuf(value) for field, value in layer if field == 4):
+            if value_field == 1:
+                values.append(value.decode())
+            elif value_field == 3:
+                values.append(struct.unpack('<d', value)[0])
+            else:
+                values.append(unzigzag(value))
+
+        features = []
+        for feature in (dict(read_protobuf(value)) for field, value in layer if field == 2):
+            tags = read_varints(feature[2])
+            command, x, y = read_varints(feature[4])
+            features.append({
+                'id': feature[1],
+                'type': feature[3],
+                'command': command,
+                'x': unzigzag(x),
+                'y': unzigzag(y),
+                'properties': {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)},
+            })
+        name = next(value.decode() for field, value in layer if field == 1)
+        layers[name] = {'extent': next(value for field, value in layer if field == 5), 'features': features}
+    return layers
+
+
+class VectorTileTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        cache.clear()
+        self.company = Company.objects.create(name='Tile Company', address='1 Tile Rd')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company, license_plate='MVT-001', make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+        save_positions([Position(vehicle=self.vehicle, latitude=45.764, longitude=4.8357, speed=42.5, heading=90,
+                                 timestamp=timezone.now())])
+        self.order = Order.objects.create(customer_name='Tile Customer', goods_description='Boxes',
+                                          order_number='ORD-MVT-1')
+        self.pickup = Stop.objects.create(order=self.order, name='Lyon Depot', address='1 Rue',
+                                          latitude=Decimal('45.7600'), longitude=Decimal('4.8400'), stop_type='pickup')
+        Stop.objects.create(order=self.order, name='Paris Drop', address='2 Rue',
+                            latitude=Decimal('48.8566'), longitude=Decimal('2.3522'), stop_type='delivery')
+
+        # Zoom 10 tile holding Lyon
+        self.z = 10
+        world_x, world_y = project(45.764, 4.8357)
+        self.x, self.y = int(world_x * 2 ** self.z), int(world_y * 2 ** self.z)
+
+    def tile(self, layer, z=None, x=None, y=None):
+        z = self.z if z is None else z
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        response = self.authenticated_request('GET', f'/api/tiles/{layer}/{z}/{x}/{y}.mvt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], MVT_CONTENT_TYPE)
+        return decode_tile(response.content)
+
+    def test_vehicle_tile(self):
+        layer = self.tile('vehicles')['vehicles']
+        self.assertEqual(layer['extent'], TILE_EXTENT)
+        feature, = layer['features']
+        self.assertEqual(feature['id'], self.vehicle.id)
+        self.assertEqual((feature['type'], feature['command']), (1, 9))
+        self.assertTrue(0 <= feature['x'] < TILE_EXTENT and 0 <= feature['y'] < TILE_EXTENT)
+        self.assertEqual(feature['properties']['license_plate'], 'MVT-001')
+        self.assertEqual(feature['properties']['speed'], 42.5)
+
+        # Nothing in the tile next door
+        self.assertEqual(self.tile('vehicles', x=self.x + 2), {})
+
+    def test_stop_and_order_tiles(self):
+        stops = self.tile('stops')['stops']['features']
+        self.assertEqual([feature['id'] for feature in stops], [self.pickup.id])
+        self.assertEqual(stops[0]['properties'], {'name': 'Lyon Depot', 'stop_type': 'pickup',
+                                                  'order_id': self.order.id})
+        self.assertEqual(len(self.tile('stops', z=0, x=0, y=0)['stops']['features']), 2)
+
+        pickup, = self.tile('orders')['orders']['features']
+        self.assertEqual(pickup['id'], self.order.id)
+        self.assertEqual(pickup['properties']['order_number'], 'ORD-MVT-1')
+
+    def test_tiles_invalidated_per_tile(self):
+        self.tile('orders')
+        self.tile('stops', z=0, x=0, y=0)
+        with CaptureQueriesContext(connection) as queries:
+            self.tile('orders')
+        # Only the fingerprint of the tile's features
+        self.assertEqual(len([q for q in queries.captured_queries if 'orders_stop' in q['sql']]), 1)
+
+        self.order.status = 'assigned'
+        self.order.save()
+        self.assertEqual(self.tile('orders'), {})
+
+        before, = self.tile('stops')['stops']['features']
+        Stop.objects.filter(id=self.pickup.id).update(latitude=Decimal('45.7700'), updated_at=timezone.now())
+        after, = self.tile('stops')['stops']['features']
+        self.assertLess(after['y'], before['y'])
+        Stop.objects.filter(id=self.pickup.id).delete()
+        self.assertEqual(self.tile('stops'), {})
+        self.assertEqual(len(self.tile('stops', z=0, x=0, y=0)['stops']['features']), 1)
+
+    def test_invalid_tiles(self):
+        for url in ('/api/tiles/roads/3/1/1.mvt', '/api/tiles/stops/3/8/1.mvt', '/api/tiles/stops/23/0/0.mvt'):
+            response = self.authenticated_request('GET', url)
+            self.assertEqual(response.status_code, 400)
+
+
+async def asgi_get(path, query_string, token):
+    """Send a GET request to the ASGI application, returning the communicator and the response start"""
+    communicator = ApplicationCommunicator(asgi_application, {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode(),
+        'headers': [(b'authorization', f'Token {token}'.encode())],
+    })
+    await communicator.send_input({'type': 'http.request', 'body': b''})
+    return communicator, await communicator.receive_output(5)
+
+
+# Streamed parts are produced on a thread of their own, which only sees committed rows
+class AsgiStreamingTestCase(TransactionTestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        company = Company.objects.create(name='Stream Company', address='1 Pipe St')
+        vehicle = Vehicle.objects.create(
+            company=company, license_plate='ASGI-001', make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+        now = timezone.now()
+        self.stored = save_positions([
+            Position(vehicle=vehicle, latitude=45.764, longitude=4.8357, speed=30, heading=90,
+                     timestamp=now - timedelta(minutes=minute))
+            for minute in range(3)
+        ])['stored']
+
+    async def test_streamed_list_sent_in_parts(self):
+        communicator, start = await asgi_get('/api/positions/', 'stream=true', self.token.key)
+        self.assertEqual(start['status'], 200)
+
+        parts = []
+        while True:
+            message = await communicator.receive_output(5)
+            parts.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        # The opening bracket, the rows and the closing bracket rather than one buffered body
+        self.assertGreater(len([part for part in parts if part]), 1)
+        body = json.loads(b''.join(parts))
+        self.assertEqual(sorted(result['id'] for result in body['results']),
+                         sorted(position.id for position in self.stored))
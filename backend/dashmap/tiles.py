@@ -0,0 +1,255 @@
+import struct
+from typing import List, Dict, Any, Callable, NamedTuple, Tuple
+from django.core.cache import cache
+from django.db.models import Count, Max, QuerySet
+from .bbox import BoundingBox
+from .clusters import project, unproject
+from .spatial import filter_bbox
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Tile coordinate space, and the margin of features drawn around each tile so
+# symbols on tile edges are not clipped
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Entries are also keyed on a fingerprint of the tile's features, so changes never serve stale tiles
+TILE_CACHE_TIMEOUT = 24 * 3600
+
+# Mapbox Vector Tile protobuf field numbers (vector_tile.proto, version 2)
+TILE_LAYERS_FIELD = 3
+LAYER_NAME_FIELD = 1
+LAYER_FEATURES_FIELD = 2
+LAYER_KEYS_FIELD = 3
+LAYER_VALUES_FIELD = 4
+LAYER_EXTENT_FIELD = 5
+LAYER_VERSION_FIELD = 15
+FEATURE_ID_FIELD = 1
+FEATURE_TAGS_FIELD = 2
+FEATURE_TYPE_FIELD = 3
+FEATURE_GEOMETRY_FIELD = 4
+VALUE_STRING_FIELD = 1
+VALUE_DOUBLE_FIELD = 3
+VALUE_SINT_FIELD = 6
+VALUE_BOOL_FIELD = 7
+
+GEOMETRY_POINT = 1
+COMMAND_MOVE_TO = 1
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, LENGTH_DELIMITED) + _varint(len(payload)) + payload
+
+
+def _encode_value(value: Any) -> bytes:
+    # bool first: it is also an int
+    if isinstance(value, bool):
+        return _key(VALUE_BOOL_FIELD, VARINT) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(VALUE_SINT_FIELD, VARINT) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(VALUE_DOUBLE_FIELD, FIXED64) + struct.pack('<d', value)
+    return _length_delimited(VALUE_STRING_FIELD, str(value).encode('utf-8'))
+
+
+class TileFeature(NamedTuple):
+    """A point feature, in tile coordinates from 0 to TILE_EXTENT"""
+
+    id: int
+    x: int
+    y: int
+    properties: Dict[str, Any]
+
+
+def encode_layer(name: str, features: List[TileFeature]) -> bytes:
+    """
+    Encode one point layer of a Mapbox Vector Tile.
+
+    Property keys and values are shared across the layer's features, as the
+    format expects; None values are left out.
+    """
+    keys, values = {}, {}
+    encoded_features = []
+    for feature in features:
+        tags = []
+        for key, value in feature.properties.items():
+            if value is None:
+                continue
+            encoded_value = _encode_value(value)
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encoded_value, len(values)))
+
+        geometry = [(1 << 3) | COMMAND_MOVE_TO, _zigzag(feature.x), _zigzag(feature.y)]
+        encoded_features.append(
+            _key(FEATURE_ID_FIELD, VARINT) + _varint(feature.id)
+            + _length_delimited(FEATURE_TAGS_FIELD, b''.join(_varint(tag) for tag in tags))
+            + _key(FEATURE_TYPE_FIELD, VARINT) + _varint(GEOMETRY_POINT)
+            + _length_delimited(FEATURE_GEOMETRY_FIELD, b''.join(_varint(value) for value in geometry))
+        )
+
+    return (
+        _key(LAYER_VERSION_FIELD, VARINT) + _varint(2)
+        + _length_delimited(LAYER_NAME_FIELD, name.encode('utf-8'))
+        + b''.join(_length_delimited(LAYER_FEATURES_FIELD, feature) for feature in encoded_features)
+        + b''.join(_length_delimited(LAYER_KEYS_FIELD, key.encode('utf-8')) for key in keys)
+        + b''.join(_length_delimited(LAYER_VALUES_FIELD, value) for value in values)
+        + _key(LAYER_EXTENT_FIELD, VARINT) + _varint(TILE_EXTENT)
+    )
+
+
+def encode_tile(layers: Dict[str, List[TileFeature]]) -> bytes:
+    """Encode a Mapbox Vector Tile; layers without features are left out"""
+    return b''.join(
+        _length_delimited(TILE_LAYERS_FIELD, encode_layer(name, features))
+        for name, features in layers.items() if features
+    )
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bbox(z: int, x: int, y: int, buffer: int = TILE_BUFFER) -> BoundingBox:
+    """Viewport of a tile, widened by ``buffer`` tile units on each side"""
+    tiles = 2 ** z
+    margin = buffer / TILE_EXTENT
+    west, east = max(x - margin, 0) / tiles, min(x + 1 + margin, tiles) / tiles
+    north, south = max(y - margin, 0) / tiles, min(y + 1 + margin, tiles) / tiles
+    max_latitude, min_longitude = unproject(west, north)
+    min_latitude, max_longitude = unproject(east, south)
+    return BoundingBox(min_longitude, min_latitude, max_longitude, max_latitude)
+
+
+def tile_point(z: int, x: int, y: int, latitude: float, longitude: float) -> Tuple[int, int]:
+    """Coordinates of a point within a tile, from 0 to TILE_EXTENT"""
+    world_x, world_y = project(latitude, longitude)
+    tiles = 2 ** z
+    return round((world_x * tiles - x) * TILE_EXTENT), round((world_y * tiles - y) * TILE_EXTENT)
+
+
+class TileLayer(NamedTuple):
+    """
+    A map layer served as vector tiles.
+
+    ``queryset`` returns the rows of the layer with latitude and longitude
+    fields, ``feature`` turns one row into its (id, properties), and
+    ``updated_fields`` are the timestamps whose maximum, with the row count,
+    fingerprints the features of a tile.
+    """
+
+    queryset: Callable[[], QuerySet]
+    feature: Callable[[Any], Tuple[int, Dict[str, Any]]]
+    updated_fields: Tuple[str, ...] = ('updated_at',)
+
+
+def _stops():
+    from orders.models import Stop
+    return Stop.objects.filter(latitude__isnull=False, longitude__isnull=False)
+
+
+def _stop_feature(stop):
+    return stop.id, {
+        'name': stop.name,
+        'stop_type': stop.stop_type,
+        'order_id': stop.order_id,
+    }
+
+
+def _pending_pickups():
+    return _stops().filter(stop_type='pickup', order__status='pending').select_related('order')
+
+
+def _pickup_feature(stop):
+    order = stop.order
+    return order.id, {
+        'order_number': order.order_number,
+        'customer_name': order.customer_name,
+        'goods_type': order.goods_type,
+        'pickup_name': stop.name,
+        'requested_pickup_date': order.requested_pickup_date.isoformat() if order.requested_pickup_date else None,
+    }
+
+
+def _latest_positions():
+    from positions.models import VehicleLatestPosition
+    return VehicleLatestPosition.objects.select_related('vehicle')
+
+
+def _vehicle_feature(latest):
+    return latest.vehicle_id, {
+        'license_plate': latest.vehicle.license_plate,
+        'speed': float(latest.speed),
+        'heading': float(latest.heading),
+        'engine_status': latest.engine_status,
+        'timestamp': latest.timestamp.isoformat(),
+    }
+
+
+# Layers served as vector tiles, by name; each tile holds the one layer
+TILE_LAYERS = {
+    'stops': TileLayer(_stops, _stop_feature),
+    'orders': TileLayer(_pending_pickups, _pickup_feature, ('updated_at', 'order__updated_at')),
+    'vehicles': TileLayer(_latest_positions, _vehicle_feature, ('updated_at', 'vehicle__updated_at')),
+}
+
+
+def _tile_fingerprint(queryset: QuerySet, updated_fields: Tuple[str, ...]) -> str:
+    aggregates = {f'updated_{i}': Max(field) for i, field in enumerate(updated_fields)}
+    version = queryset.order_by().aggregate(count=Count('pk'), **aggregates)
+    updated_at = max(
+        (version[name].timestamp() for name in aggregates if version[name] is not None),
+        default=0,
+    )
+    return f"{version['count']}:{updated_at:.6f}"
+
+
+def layer_tile(layer: str, z: int, x: int, y: int) -> bytes:
+    """
+    Encoded vector tile of a layer.
+
+    Tiles are cached one by one. The cache key holds the number of features
+    in the tile and their newest update, so a change to a feature rebuilds
+    only the tiles it was or is in; the check is one indexed aggregate over
+    the tile's area.
+
+    Raises:
+        KeyError: If the layer is unknown
+    """
+    tile_layer = TILE_LAYERS[layer]
+    queryset = filter_bbox(tile_layer.queryset(), tile_bbox(z, x, y))
+
+    key = f"tiles:{layer}:{z}:{x}:{y}:{_tile_fingerprint(queryset, tile_layer.updated_fields)}"
+    tile = cache.get(key)
+    if tile is not None:
+        return tile
+
+    features = []
+    for row in queryset.iterator(chunk_size=2000):
+        feature_id, properties = tile_layer.feature(row)
+        tile_x, tile_y = tile_point(z, x, y, float(row.latitude), float(row.longitude))
+        features.append(TileFeature(feature_id, tile_x, tile_y, properties))
+
+    tile = encode_tile({layer: features})
+    cache.set(key, tile, TILE_CACHE_TIMEOUT)
+    return tile
@@ -27,4 +27,7 @@ urlpatterns = [
     path('api/', include('orders.urls')),
     path('api/', include('trips.urls')),
     path('api/', include('positions.urls')),
+    path('api/', include('changes.urls')),
+    path('api/clusters/', views.ClusterView.as_view(), name='clusters'),
+    path('api/tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', views.TileView.as_view(), name='tiles'),
 ]
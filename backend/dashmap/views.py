@@ -1,4 +1,9 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from positions.tracks import MIN_ZOOM, MAX_ZOOM
+from .bbox import request_bbox
+from .clusters import CLUSTER_LAYERS, layer_clusters
+from .tiles import MVT_CONTENT_TYPE, TILE_LAYERS, is_valid_tile, layer_tile
 
 
 def root_view(request):
@@ -7,3 +12,37 @@ def root_view(request):
         "status": "ok",
         "message": "Welcome to Dashmap!"
     })
+
+
+class ClusterView(View):
+    def get(self, request):
+        """Get the clusters of a map layer at a zoom level, optionally within a ?bbox= viewport"""
+        layer = request.GET.get('layer')
+        if layer not in CLUSTER_LAYERS:
+            return JsonResponse(
+                {'error': f"layer parameter must be one of: {', '.join(CLUSTER_LAYERS)}"},
+                status=400
+            )
+        if not request.GET.get('zoom'):
+            return JsonResponse({'error': 'zoom parameter is required'}, status=400)
+
+        try:
+            zoom = int(request.GET['zoom'])
+            bbox = request_bbox(request)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            return JsonResponse({'error': f'zoom must be between {MIN_ZOOM} and {MAX_ZOOM}'}, status=400)
+
+        return JsonResponse({'layer': layer, 'zoom': zoom, 'results': layer_clusters(layer, zoom, bbox)})
+
+
+class TileView(View):
+    def get(self, request, layer, z, x, y):
+        """Get a map layer's features within a tile, as a Mapbox Vector Tile"""
+        if layer not in TILE_LAYERS:
+            return JsonResponse({'error': f"layer must be one of: {', '.join(TILE_LAYERS)}"}, status=400)
+        if not MIN_ZOOM <= z <= MAX_ZOOM or not is_valid_tile(z, x, y):
+            return JsonResponse({'error': f'Invalid data: no tile {z}/{x}/{y}'}, status=400)
+
+        return HttpResponse(layer_tile(layer, z, x, y), content_type=MVT_CONTENT_TYPE)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_update_stop_types'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stop',
+            index=models.Index(fields=['latitude', 'longitude'], name='orders_stop_latitud_7b2d6f_idx'),
+        ),
+    ]
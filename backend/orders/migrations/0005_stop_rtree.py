@@ -0,0 +1,21 @@
+from django.db import migrations
+from dashmap.spatial import SPATIAL_INDEXES
+
+
+def install_rtree(apps, schema_editor):
+    SPATIAL_INDEXES['orders_stop'].install(schema_editor.connection)
+
+
+def uninstall_rtree(apps, schema_editor):
+    SPATIAL_INDEXES['orders_stop'].uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_stop_viewport_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_rtree, uninstall_rtree),
+    ]
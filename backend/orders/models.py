@@ -20,6 +20,12 @@ class Stop(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Viewport (?bbox=) queries
+            models.Index(fields=['latitude', 'longitude']),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.stop_type}) - {self.order.order_number}"
 
@@ -1,8 +1,11 @@
 import json
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.db import connection
 from accounts.models import AuthToken
 from .models import Order, Stop
+from dashmap.bbox import parse_bbox
+from dashmap.spatial import SPATIAL_INDEXES, ensure_spatial_indexes, filter_bbox, within_radius
 
 
 class OrderAPITestCase(TestCase):
@@ -94,6 +97,33 @@ class OrderAPITestCase(TestCase):
         self.assertEqual(delivery['name'], 'Test Delivery Location')
         self.assertEqual(delivery['stop_type'], 'delivery')
 
+    def test_get_orders_list_streamed(self):
+        """Test GET /api/orders/?stream=true returns the same body incrementally"""
+        response = self.authenticated_request('GET', '/api/orders/?stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, self.authenticated_request('GET', '/api/orders/').json())
+
+    def test_get_orders_in_viewport(self):
+        """Test GET /api/orders/?bbox= returns the orders with a stop within the viewport"""
+        other_order = Order.objects.create(customer_name='Other Customer', goods_description='Other goods')
+        Stop.objects.create(order=other_order, name='Chicago Dock', address='1 Lake St',
+                            latitude=41.8781, longitude=-87.6298, stop_type='pickup')
+
+        # New York: only the first order's pickup
+        response = self.authenticated_request('GET', '/api/orders/?bbox=-74.1,40.6,-73.9,40.8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in response.json()['results']], [self.order.id])
+
+        # New York to Chicago
+        response = self.authenticated_request('GET', '/api/orders/?bbox=-88,40,-73,42')
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.authenticated_request('GET', '/api/orders/?bbox=-74.1,40.6')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_order_detail(self):
         """Test GET /api/orders/<id>/ returns properly serialized order data"""
         response = self.authenticated_request('GET', f'/api/orders/{self.order.id}/')
@@ -177,3 +207,58 @@ class OrderAPITestCase(TestCase):
         self.assertIsNone(empty_order_data['pickup_stop'])
         self.assertIsNone(empty_order_data['delivery_stop'])
         self.assertNotIn('stops', empty_order_data)
+
+
+class StopSpatialIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = SPATIAL_INDEXES['orders_stop']
+        self.chicago = Stop.objects.create(name='Chicago', address='1 Lake St', latitude=41.878113,
+                                           longitude=-87.629799, stop_type='pickup')
+        self.evanston = Stop.objects.create(name='Evanston', address='2 Ridge Ave', latitude=42.045072,
+                                            longitude=-87.687697, stop_type='delivery')
+        self.new_york = Stop.objects.create(name='New York', address='3 Broadway', latitude=40.712776,
+                                            longitude=-74.005974, stop_type='delivery')
+
+    def rtree_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id, min_latitude, min_longitude FROM {self.index.rtree_table} ORDER BY id')
+            return cursor.fetchall()
+
+    def test_rtree_follows_inserts_updates_and_deletes(self):
+        self.assertEqual(self.rtree_rows(), [
+            (self.chicago.id, 41878113, -87629799),
+            (self.evanston.id, 42045072, -87687697),
+            (self.new_york.id, 40712776, -74005974),
+        ])
+
+        self.new_york.latitude = 40.758
+        self.new_york.save()
+        self.evanston.latitude = None
+        self.evanston.save()
+        self.chicago.delete()
+        Stop.objects.create(name='Nowhere', address='Unknown', stop_type='pickup')
+
+        self.assertEqual(self.rtree_rows(), [(self.new_york.id, 40758000, -74005974)])
+
+    def test_bbox_and_radius_searches(self):
+        stops = filter_bbox(Stop.objects.all(), parse_bbox('-88,41.5,-87,42'))
+        self.assertIn(self.index.rtree_table, str(stops.query))
+        self.assertEqual(list(stops), [self.chicago])
+
+        # 20 km from downtown Chicago reaches Evanston, 19.2 km north
+        nearby = within_radius(Stop.objects.all(), 41.878113, -87.629799, 20000)
+        self.assertEqual([stop for stop, _ in nearby], [self.chicago, self.evanston])
+        self.assertAlmostEqual(nearby[1][1], 19170, delta=50)
+        self.assertEqual([stop for stop, _ in within_radius(Stop.objects.all(), 41.878113, -87.629799, 10000)],
+                         [self.chicago])
+
+    def test_rtree_reinstalled_after_table_rebuild(self):
+        # As when a migration rebuilds the table
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER {self.index.rtree_table}_{trigger}')
+        Stop.objects.filter(id=self.new_york.id).delete()
+
+        self.assertEqual(ensure_spatial_indexes(), ['orders_stop'])
+        self.assertEqual([row[0] for row in self.rtree_rows()], [self.chicago.id, self.evanston.id])
+        self.assertEqual(ensure_spatial_indexes(), [])
@@ -2,10 +2,62 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.db import transaction
 import json
 import random
 from faker import Faker
 from .models import Stop, Order
+from dashmap.streaming import stream_results, wants_stream
+from dashmap.bbox import request_bbox
+from dashmap.spatial import filter_bbox
+
+
+def serialize_order(order):
+    """Serialize an order with its pickup and delivery stops, as returned by the order list"""
+    stops = list(order.stops.all())
+    pickup_stops = [s for s in stops if s.stop_type == 'pickup']
+    delivery_stops = [s for s in stops if s.stop_type == 'delivery']
+
+    return {
+        'id': order.id,
+        'order_number': order.order_number,
+        'customer_name': order.customer_name,
+        'customer_company': order.customer_company,
+        'customer_email': order.customer_email,
+        'customer_phone': order.customer_phone,
+        'pickup_stop': {
+            'id': pickup_stops[0].id,
+            'name': pickup_stops[0].name,
+            'address': pickup_stops[0].address,
+            'latitude': str(pickup_stops[0].latitude) if pickup_stops[0].latitude else None,
+            'longitude': str(pickup_stops[0].longitude) if pickup_stops[0].longitude else None,
+            'stop_type': pickup_stops[0].stop_type,
+            'contact_name': pickup_stops[0].contact_name,
+            'contact_phone': pickup_stops[0].contact_phone,
+            'notes': pickup_stops[0].notes,
+        } if pickup_stops else None,
+        'delivery_stop': {
+            'id': delivery_stops[0].id,
+            'name': delivery_stops[0].name,
+            'address': delivery_stops[0].address,
+            'latitude': str(delivery_stops[0].latitude) if delivery_stops[0].latitude else None,
+            'longitude': str(delivery_stops[0].longitude) if delivery_stops[0].longitude else None,
+            'stop_type': delivery_stops[0].stop_type,
+            'contact_name': delivery_stops[0].contact_name,
+            'contact_phone': delivery_stops[0].contact_phone,
+            'notes': delivery_stops[0].notes,
+        } if delivery_stops else None,
+        'goods_description': order.goods_description,
+        'goods_weight': str(order.goods_weight) if order.goods_weight else None,
+        'goods_volume': str(order.goods_volume) if order.goods_volume else None,
+        'goods_type': order.goods_type,
+        'special_instructions': order.special_instructions,
+        'status': order.status,
+        'requested_pickup_date': order.requested_pickup_date.isoformat() if order.requested_pickup_date else None,
+        'requested_delivery_date': order.requested_delivery_date.isoformat() if order.requested_delivery_date else None,
+        'created_at': order.created_at.isoformat(),
+        'updated_at': order.updated_at.isoformat()
+    }
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -21,54 +73,22 @@ class OrderListCreateView(View):
             # Exclude orders whose stops are already in trip_stops
             assigned_stop_ids = TripStop.objects.values_list('stop_id', flat=True)
             orders = orders.exclude(stops__id__in=assigned_stop_ids)
-        data = []
-        for order in orders:
-            stops = list(order.stops.all())
-            pickup_stops = [s for s in stops if s.stop_type == 'pickup']
-            delivery_stops = [s for s in stops if s.stop_type == 'delivery']
 
-            data.append({
-                'id': order.id,
-                'order_number': order.order_number,
-                'customer_name': order.customer_name,
-                'customer_company': order.customer_company,
-                'customer_email': order.customer_email,
-                'customer_phone': order.customer_phone,
-                'pickup_stop': {
-                    'id': pickup_stops[0].id,
-                    'name': pickup_stops[0].name,
-                    'address': pickup_stops[0].address,
-                    'latitude': str(pickup_stops[0].latitude) if pickup_stops[0].latitude else None,
-                    'longitude': str(pickup_stops[0].longitude) if pickup_stops[0].longitude else None,
-                    'stop_type': pickup_stops[0].stop_type,
-                    'contact_name': pickup_stops[0].contact_name,
-                    'contact_phone': pickup_stops[0].contact_phone,
-                    'notes': pickup_stops[0].notes,
-                } if pickup_stops else None,
-                'delivery_stop': {
-                    'id': delivery_stops[0].id,
-                    'name': delivery_stops[0].name,
-                    'address': delivery_stops[0].address,
-                    'latitude': str(delivery_stops[0].latitude) if delivery_stops[0].latitude else None,
-                    'longitude': str(delivery_stops[0].longitude) if delivery_stops[0].longitude else None,
-                    'stop_type': delivery_stops[0].stop_type,
-                    'contact_name': delivery_stops[0].contact_name,
-                    'contact_phone': delivery_stops[0].contact_phone,
-                    'notes': delivery_stops[0].notes,
-                } if delivery_stops else None,
-                'goods_description': order.goods_description,
-                'goods_weight': str(order.goods_weight) if order.goods_weight else None,
-                'goods_volume': str(order.goods_volume) if order.goods_volume else None,
-                'goods_type': order.goods_type,
-                'special_instructions': order.special_instructions,
-                'status': order.status,
-                'requested_pickup_date': order.requested_pickup_date.isoformat() if order.requested_pickup_date else None,
-                'requested_delivery_date': order.requested_delivery_date.isoformat() if order.requested_delivery_date else None,
-                'created_at': order.created_at.isoformat(),
-                'updated_at': order.updated_at.isoformat()
-            })
+        # Orders with a stop within the map viewport
+        try:
+            bbox = request_bbox(request)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+        if bbox is not None:
+            orders = orders.filter(id__in=filter_bbox(Stop.objects.all(), bbox).values('order_id'))
+
+        if wants_stream(request):
+            return stream_results(orders, serialize_order)
+
+        data = [serialize_order(order) for order in orders]
         return JsonResponse({'results': data})
 
+    @transaction.atomic
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -231,6 +251,7 @@ class OrderDetailView(View):
             'updated_at': order.updated_at.isoformat()
         })
 
+    @transaction.atomic
     def put(self, request, pk):
         order = self.get_object(pk)
         if not order:
@@ -346,6 +367,7 @@ class OrderDetailView(View):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GenerateFakeOrdersView(View):
+    @transaction.atomic
     def post(self, request):
         """Generate random orders with faker data"""
         try:
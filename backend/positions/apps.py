@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PositionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'positions'
+
+    def ready(self):
+        # Keeps the geofence index in step with trip and stop changes
+        from . import signals  # noqa: F401
@@ -0,0 +1,312 @@
+import gzip
+import os
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from .fields import from_scaled, to_scaled
+from .models import Position, PositionArchive
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed when COMPRESSION is 'zstd'
+    zstandard = None
+
+ARCHIVE_MAGIC = b'DMPA1\n'
+
+# Field order of the rows stored in and decoded from archive files
+ARCHIVE_FIELDS = (
+    'id', 'timestamp', 'latitude', 'longitude', 'speed', 'heading', 'altitude',
+    'odometer', 'fuel_level', 'engine_status', 'created_at',
+)
+
+# Decimal places of the fixed-point columns, stored as scaled integers like in the table
+DECIMAL_PLACES = {
+    'latitude': 7,
+    'longitude': 7,
+    'speed': 2,
+    'heading': 2,
+    'altitude': 2,
+    'odometer': 2,
+    'fuel_level': 2,
+}
+NULLABLE_FIELDS = {'altitude', 'odometer', 'fuel_level'}
+DATETIME_FIELDS = {'timestamp', 'created_at'}
+ENGINE_STATUS_CODES = ('off', 'on', 'idle')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class PositionArchiveError(Exception):
+    """Raised when an archive file is missing, corrupt or cannot be written"""
+
+    pass
+
+
+def get_archive_config() -> Dict[str, Any]:
+    config = getattr(settings, 'POSITION_ARCHIVE', {})
+    return {
+        'RETENTION_DAYS': config.get('RETENTION_DAYS', 90),
+        'ROOT': Path(config.get('ROOT', Path(settings.BASE_DIR) / 'archive' / 'positions')),
+        'COMPRESSION': config.get('COMPRESSION', 'gzip'),
+        'CACHE_CHUNKS': config.get('CACHE_CHUNKS', 64),
+    }
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    # Zigzag first so that small negative deltas stay small
+    value = value << 1 if value >= 0 else (-value << 1) - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+def _to_int(field: str, value) -> Optional[int]:
+    if value is None:
+        return None
+    if field in DATETIME_FIELDS:
+        return (value - EPOCH) // MICROSECOND
+    if field == 'engine_status':
+        return ENGINE_STATUS_CODES.index(value)
+    if field in DECIMAL_PLACES:
+        return to_scaled(value, DECIMAL_PLACES[field])
+    return value
+
+
+def _from_int(field: str, value: Optional[int]):
+    if value is None:
+        return None
+    if field in DATETIME_FIELDS:
+        return EPOCH + value * MICROSECOND
+    if field == 'engine_status':
+        return ENGINE_STATUS_CODES[value]
+    if field in DECIMAL_PLACES:
+        return from_scaled(value, DECIMAL_PLACES[field])
+    return value
+
+
+def encode_positions(rows: List[Tuple]) -> bytes:
+    """
+    Encode rows in ARCHIVE_FIELDS order into the uncompressed archive payload.
+
+    Columns are stored one after the other, each as varints of the delta to
+    the previous value. Consecutive fixes of a vehicle differ little, so most
+    deltas fit in one or two bytes and compress well. In nullable columns a
+    0 marks a missing value and other values are shifted by one.
+    """
+    out = bytearray()
+    _write_varint(out, len(rows))
+    for column, field in enumerate(ARCHIVE_FIELDS):
+        previous = 0
+        for row in rows:
+            value = _to_int(field, row[column])
+            if field in NULLABLE_FIELDS:
+                if value is None:
+                    out.append(0)
+                    continue
+                delta = value - previous
+                _write_varint(out, delta + 1 if delta >= 0 else delta)
+            else:
+                _write_varint(out, value - previous)
+            previous = value
+    return bytes(out)
+
+
+def decode_positions(payload: bytes) -> List[Tuple]:
+    """Decode an archive payload into rows in ARCHIVE_FIELDS order"""
+    count, offset = _read_varint(payload, 0)
+    columns = []
+    for field in ARCHIVE_FIELDS:
+        values = []
+        previous = 0
+        for _ in range(count):
+            encoded, offset = _read_varint(payload, offset)
+            if field in NULLABLE_FIELDS:
+                if encoded == 0:
+                    values.append(None)
+                    continue
+                encoded = encoded - 1 if encoded > 0 else encoded
+            previous += encoded
+            values.append(_from_int(field, previous))
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def compress(payload: bytes, compression: str) -> bytes:
+    if compression == 'gzip':
+        return gzip.compress(payload, compresslevel=9, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise PositionArchiveError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=19).compress(payload)
+    raise PositionArchiveError(f"Unknown compression '{compression}'")
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise PositionArchiveError("zstd compression requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise PositionArchiveError(f"Unknown compression '{compression}'")
+
+
+def archive_path(vehicle_id: int, day: date, compression: str) -> str:
+    # Each write gets a new file: the one in the manifest is never overwritten in place
+    extension = 'gz' if compression == 'gzip' else 'zst'
+    return f"{vehicle_id}/{day:%Y/%m}/{day.isoformat()}.{uuid.uuid4().hex[:12]}.dmpa.{extension}"
+
+
+def read_archive(archive: PositionArchive) -> List[Tuple]:
+    """
+    Read the positions of an archived vehicle-day.
+
+    Returns:
+        Rows in ARCHIVE_FIELDS order, oldest first
+
+    Raises:
+        PositionArchiveError: If the file is missing or corrupt
+    """
+    path = get_archive_config()['ROOT'] / archive.path
+    try:
+        data = decompress(path.read_bytes(), archive.compression)
+    except (OSError, EOFError, ValueError) as e:
+        raise PositionArchiveError(f"Cannot read archive {path}: {e}")
+    if not data.startswith(ARCHIVE_MAGIC):
+        raise PositionArchiveError(f"Not a position archive: {path}")
+    return decode_positions(data[len(ARCHIVE_MAGIC):])
+
+
+def write_file_atomic(path: Path, data: bytes) -> None:
+    # Written next to the target and renamed, so readers never see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def archive_vehicle_day(vehicle_id: int, day: date, compression: Optional[str] = None) -> int:
+    """
+    Move a vehicle's positions of one UTC day from the database to the archive.
+
+    Positions already archived for that day, e.g. before late points
+    arrived, are merged with the new ones into a new file. The file is
+    written and synced before the positions are deleted, and the manifest
+    and deletion are committed together. The file previously in the
+    manifest is removed only once that has committed, and the new one if
+    it fails, so no file is left behind that the manifest does not name.
+
+    Args:
+        vehicle_id: Vehicle whose positions to archive
+        day: UTC day to archive
+        compression: 'gzip' or 'zstd', defaults to the POSITION_ARCHIVE setting
+
+    Returns:
+        Number of positions moved out of the database
+
+    Raises:
+        PositionArchiveError: If the archive cannot be read or written, or
+            the day was archived concurrently
+    """
+    compression = compression or get_archive_config()['COMPRESSION']
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    positions = Position.objects.filter(vehicle_id=vehicle_id, timestamp__gte=start, timestamp__lt=start + timedelta(days=1))
+    rows = list(positions.order_by('timestamp').values_list(*ARCHIVE_FIELDS))
+    if not rows:
+        return 0
+
+    existing = PositionArchive.objects.filter(vehicle_id=vehicle_id, day=day).first()
+    merged = {row[1]: row for row in read_archive(existing)} if existing else {}
+    # Stored positions win over archived ones with the same timestamp
+    merged.update((row[1], row) for row in rows)
+    archived_rows = [merged[timestamp] for timestamp in sorted(merged)]
+
+    relative_path = archive_path(vehicle_id, day, compression)
+    data = compress(ARCHIVE_MAGIC + encode_positions(archived_rows), compression)
+    write_file_atomic(get_archive_config()['ROOT'] / relative_path, data)
+
+    try:
+        with transaction.atomic():
+            current = PositionArchive.objects.select_for_update().filter(vehicle_id=vehicle_id, day=day).first()
+            if (current and current.path) != (existing and existing.path):
+                raise PositionArchiveError(f"Vehicle {vehicle_id} day {day} was archived concurrently")
+            PositionArchive.objects.update_or_create(
+                vehicle_id=vehicle_id,
+                day=day,
+                defaults={
+                    'path': relative_path,
+                    'compression': compression,
+                    'point_count': len(archived_rows),
+                    'first_timestamp': archived_rows[0][1],
+                    'last_timestamp': archived_rows[-1][1],
+                    'size_bytes': len(data),
+                },
+            )
+            # Positions stored while the file was written have higher IDs and stay
+            positions.filter(id__lte=max(row[0] for row in rows)).delete()
+    except Exception:
+        (get_archive_config()['ROOT'] / relative_path).unlink(missing_ok=True)
+        raise
+
+    if existing:
+        (get_archive_config()['ROOT'] / existing.path).unlink(missing_ok=True)
+    return len(rows)
+
+
+def archivable_vehicle_days(before: date, vehicle_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, date]]:
+    """(vehicle_id, day) pairs with positions on UTC days before ``before``"""
+    cutoff = datetime.combine(before, time.min, tzinfo=dt_timezone.utc)
+    positions = Position.objects.filter(timestamp__lt=cutoff)
+    if vehicle_ids:
+        positions = positions.filter(vehicle_id__in=vehicle_ids)
+
+    vehicle_days = (
+        positions.annotate(day=TruncDate('timestamp', tzinfo=dt_timezone.utc))
+        .values_list('vehicle_id', 'day')
+        .order_by('vehicle_id', 'day')
+        .distinct()
+    )
+    return list(vehicle_days)
+
+
+def archive_positions(before: Optional[date] = None, vehicle_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """
+    Archive every position older than the retention period.
+
+    Args:
+        before: Archive days strictly before this UTC day. Defaults to today
+            minus POSITION_ARCHIVE['RETENTION_DAYS']
+        vehicle_ids: Only archive these vehicles
+
+    Returns:
+        Dict with the number of 'vehicle_days' and 'positions' archived
+    """
+    if before is None:
+        before = datetime.now(dt_timezone.utc).date() - timedelta(days=get_archive_config()['RETENTION_DAYS'])
+
+    summary = {'vehicle_days': 0, 'positions': 0}
+    for vehicle_id, day in archivable_vehicle_days(before, vehicle_ids):
+        summary['positions'] += archive_vehicle_day(vehicle_id, day)
+        summary['vehicle_days'] += 1
+    return summary
@@ -0,0 +1,215 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Any
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import Position
+
+logger = logging.getLogger(__name__)
+
+
+class PositionWriteBuffer:
+    """
+    Write-behind buffer that group-commits positions from a single writer thread.
+
+    Ingest requests hand their validated positions to submit() and return
+    immediately. The writer thread commits them in batches of up to
+    ``max_batch_size`` rows, or whatever is pending once the oldest queued
+    position has waited ``max_delay`` seconds, so many small writer
+    transactions become a few large ones.
+    """
+
+    def __init__(self, max_batch_size: int = 500, max_delay: float = 0.2, max_queue_size: int = 50000):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_queue_size = max_queue_size
+        # (enqueued at, position) pairs, oldest first
+        self._queue = deque()
+        self._oldest_enqueued_at = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._counters = {
+            'submitted': 0,
+            'committed': 0,
+            'duplicates': 0,
+            'failed': 0,
+            'rejected_full': 0,
+            'batches': 0,
+        }
+        self._last_batch_size = 0
+        self._last_batch_duration = 0.0
+
+    def submit(self, positions: List[Position]) -> bool:
+        """
+        Queue positions for the writer thread.
+
+        Args:
+            positions: Validated, unsaved Position instances
+
+        Returns:
+            False if the queue is full and the caller must store the positions itself
+        """
+        if not positions:
+            return True
+
+        with self._condition:
+            if len(self._queue) + len(positions) > self.max_queue_size:
+                self._counters['rejected_full'] += len(positions)
+                return False
+
+            enqueued_at = time.monotonic()
+            if not self._queue:
+                self._oldest_enqueued_at = enqueued_at
+            self._queue.extend((enqueued_at, position) for position in positions)
+            self._counters['submitted'] += len(positions)
+            self._ensure_started()
+            self._condition.notify()
+        return True
+
+    def flush(self) -> int:
+        """
+        Commit everything queued so far in the calling thread.
+
+        Returns:
+            Number of positions committed
+        """
+        committed = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return committed
+            committed += self._write(batch)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the writer thread and commit whatever is still queued"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+            thread = self._thread
+
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+
+        with self._condition:
+            self._thread = None
+            self._stopping = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and throughput counters"""
+        with self._condition:
+            oldest_age = time.monotonic() - self._oldest_enqueued_at if self._queue else 0.0
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_size': self.max_queue_size,
+                'oldest_pending_seconds': round(oldest_age, 3),
+                'writer_running': bool(self._thread and self._thread.is_alive()),
+                'last_batch_size': self._last_batch_size,
+                'last_batch_seconds': round(self._last_batch_duration, 4),
+                **self._counters,
+            }
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='position-write-buffer', daemon=True)
+        self._thread.start()
+
+    def _take_batch(self) -> List[Position]:
+        with self._condition:
+            count = min(len(self._queue), self.max_batch_size)
+            batch = [self._queue.popleft()[1] for _ in range(count)]
+            # Rows left behind keep their age, so they still flush within max_delay
+            self._oldest_enqueued_at = self._queue[0][0] if self._queue else None
+            return batch
+
+    def _batch_due(self) -> bool:
+        if len(self._queue) >= self.max_batch_size or self._stopping:
+            return True
+        return bool(self._queue) and time.monotonic() - self._oldest_enqueued_at >= self.max_delay
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    while not self._batch_due():
+                        if self._queue:
+                            remaining = self.max_delay - (time.monotonic() - self._oldest_enqueued_at)
+                            self._condition.wait(max(remaining, 0))
+                        else:
+                            self._condition.wait()
+                    if self._stopping and not self._queue:
+                        return
+
+                batch = self._take_batch()
+                if batch:
+                    self._write(batch)
+                    close_old_connections()
+        finally:
+            connection.close()
+
+    def _write(self, batch: List[Position]) -> int:
+        from .services import save_positions
+
+        started_at = time.monotonic()
+        try:
+            result = save_positions(batch)
+            committed, duplicates, failed = len(result['stored']), len(result['duplicates']), 0
+        except Exception:
+            logger.exception(f"Group commit of {len(batch)} positions failed, retrying one by one")
+            committed, duplicates, failed = self._write_individually(batch)
+
+        with self._condition:
+            self._counters['batches'] += 1
+            self._counters['committed'] += committed
+            self._counters['duplicates'] += duplicates
+            self._counters['failed'] += failed
+            self._last_batch_size = len(batch)
+            self._last_batch_duration = time.monotonic() - started_at
+        return committed
+
+    def _write_individually(self, batch: List[Position]):
+        from .services import save_positions
+
+        committed = duplicates = failed = 0
+        for position in batch:
+            try:
+                result = save_positions([position])
+            except Exception:
+                logger.exception(f"Dropping position for vehicle {position.vehicle_id} at {position.timestamp}")
+                failed += 1
+                continue
+            committed += len(result['stored'])
+            duplicates += len(result['duplicates'])
+        return committed, duplicates, failed
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_position_buffer():
+    """
+    Return the process-wide write-behind buffer, or None when it is disabled.
+
+    Configured by the POSITION_WRITE_BUFFER setting. The buffer is created on
+    first use and flushed when the process exits.
+    """
+    global _buffer
+    config = getattr(settings, 'POSITION_WRITE_BUFFER', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = PositionWriteBuffer(
+                max_batch_size=config.get('MAX_BATCH_SIZE', 500),
+                max_delay=config.get('MAX_DELAY', 0.2),
+                max_queue_size=config.get('MAX_QUEUE_SIZE', 50000),
+            )
+            atexit.register(_buffer.stop)
+        return _buffer
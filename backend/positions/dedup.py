@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Tuple
+
+# Number of (vehicle_id, timestamp) keys remembered per process
+RECENT_KEYS_CAPACITY = 100000
+
+
+class RecentPositionKeys:
+    """
+    Bounded LRU set of recently stored (vehicle_id, timestamp) keys.
+
+    Devices retry on flaky networks and resend points that were already
+    stored. Remembering the most recent keys lets ingest drop those retries
+    before they reach the database. Only keys of committed positions are
+    added, so a hit is always a real duplicate; a miss falls through to the
+    database check.
+    """
+
+    def __init__(self, capacity: int = RECENT_KEYS_CAPACITY):
+        self.capacity = capacity
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Tuple[int, datetime]) -> bool:
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add_many(self, keys: Iterable[Tuple[int, datetime]]) -> None:
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+
+
+recent_position_keys = RecentPositionKeys()
@@ -0,0 +1,125 @@
+import math
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+from django.db.models import Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from trips.models import Trip
+from .archive import ARCHIVE_FIELDS
+from .history import position_rows
+from .models import PositionHourRollup
+from .rollups import EARTH_RADIUS_METERS
+
+LATITUDE, LONGITUDE = ARCHIVE_FIELDS.index('latitude'), ARCHIVE_FIELDS.index('longitude')
+
+
+def segment_distances(latitudes: Sequence[float], longitudes: Sequence[float]) -> List[float]:
+    """
+    Haversine distance in meters between each pair of consecutive points.
+
+    Works column by column instead of point by point: each coordinate is
+    converted to radians and its latitude cosine computed once, where
+    calling haversine() per segment does both twice, and the segments are
+    evaluated in a single pass over the columns.
+    """
+    phis = [math.radians(latitude) for latitude in latitudes]
+    lambdas = [math.radians(longitude) for longitude in longitudes]
+    cosines = [math.cos(phi) for phi in phis]
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    return [
+        2 * EARTH_RADIUS_METERS * asin(sqrt(
+            sin((phi2 - phi1) / 2) ** 2 + cos1 * cos2 * sin((lambda2 - lambda1) / 2) ** 2
+        ))
+        for phi1, phi2, cos1, cos2, lambda1, lambda2
+        in zip(phis, phis[1:], cosines, cosines[1:], lambdas, lambdas[1:])
+    ]
+
+
+def window_distance(vehicle_id: int, start: datetime, end: datetime) -> Dict[str, Any]:
+    """
+    Distance driven by a vehicle between ``start`` and ``end``, from its stored and archived positions.
+
+    Returns:
+        Dict with the 'point_count' and the 'distance' in meters
+    """
+    rows = position_rows(vehicle_id, start, end)
+    latitudes = [row[LATITUDE] for row in rows]
+    longitudes = [row[LONGITUDE] for row in rows]
+    return {'point_count': len(rows), 'distance': math.fsum(segment_distances(latitudes, longitudes))}
+
+
+def daily_distances(vehicle_ids: Iterable[int], since: date, until: date) -> List[Dict[str, Any]]:
+    """
+    Distance driven by each vehicle on each UTC day between ``since`` and ``until``, inclusive.
+
+    Summed in one query from the hourly rollups, which already hold the
+    haversine distance of every segment, so a vehicle-day costs at most 24
+    rows instead of all its points. The odometer span of each day is
+    returned alongside, to compare the device's odometer with the computed
+    distance.
+
+    Returns:
+        List of dicts with the 'vehicle_id', 'day', 'point_count', 'distance'
+        in meters, and 'odometer_distance' in km (None without odometer
+        readings), for the vehicle-days with positions
+    """
+    start, end = _day_range(since, until)
+    days = (
+        PositionHourRollup.objects.filter(vehicle_id__in=list(vehicle_ids), bucket__gte=start, bucket__lt=end)
+        .annotate(day=TruncDate('bucket', tzinfo=dt_timezone.utc))
+        .values('vehicle_id', 'day')
+        .annotate(
+            point_count=Sum('point_count'),
+            distance=Sum('distance'),
+            min_odometer=Min('min_odometer'),
+            max_odometer=Max('max_odometer'),
+        )
+        .order_by('vehicle_id', 'day')
+    )
+    return [
+        {
+            'vehicle_id': day['vehicle_id'],
+            'day': day['day'],
+            'point_count': day['point_count'],
+            'distance': float(day['distance']),
+            'odometer_distance': (
+                float(day['max_odometer'] - day['min_odometer']) if day['min_odometer'] is not None else None
+            ),
+        }
+        for day in days
+    ]
+
+
+def trip_distances(
+    vehicle_ids: Iterable[int], since: date, until: date, now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Distance driven during each trip of the vehicles that started between UTC days ``since`` and ``until``.
+
+    A trip's window runs from its actual start to its actual end, or to now
+    while it is in progress. Trips that have not started are left out.
+
+    Returns:
+        List of dicts with the 'trip', the window 'start' and 'end',
+        'point_count' and 'distance' in meters, ordered by start
+    """
+    now = now or timezone.now()
+    start, end = _day_range(since, until)
+    trips = Trip.objects.filter(
+        vehicle_id__in=list(vehicle_ids), actual_start_datetime__gte=start, actual_start_datetime__lt=end
+    )
+    results = []
+    for trip in trips.order_by('actual_start_datetime', 'id'):
+        trip_end = trip.actual_end_datetime or now
+        results.append({
+            'trip': trip,
+            'start': trip.actual_start_datetime,
+            'end': trip_end,
+            **window_distance(trip.vehicle_id, trip.actual_start_datetime, trip_end),
+        })
+    return results
+
+
+def _day_range(since: date, until: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(since, time.min, tzinfo=dt_timezone.utc)
+    return start, datetime.combine(until + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
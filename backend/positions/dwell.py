@@ -0,0 +1,147 @@
+from collections import defaultdict
+from datetime import timedelta
+from typing import List, Dict, Any, Optional
+from django.conf import settings
+from trips.models import TripStop
+from .models import Position, VehicleDwell
+from .rollups import haversine
+
+
+def get_dwell_config() -> Dict[str, Any]:
+    config = getattr(settings, 'DWELL_DETECTION', {})
+    return {
+        'ENABLED': config.get('ENABLED', True),
+        'MAX_SPEED': config.get('MAX_SPEED', 5),
+        'RADIUS': config.get('RADIUS', 50),
+        'MIN_DURATION': timedelta(seconds=config.get('MIN_DURATION', 180)),
+        'STOP_RADIUS': config.get('STOP_RADIUS', 150),
+    }
+
+
+def next_trip_stop(vehicle_id: int) -> Optional[TripStop]:
+    """First stop not yet left of the vehicle's in-progress trip"""
+    return (
+        TripStop.objects.filter(
+            trip__vehicle_id=vehicle_id,
+            trip__status='in_progress',
+            is_completed=False,
+            actual_departure_datetime__isnull=True,
+        )
+        .select_related('stop')
+        .order_by('trip__actual_start_datetime', 'trip_id', 'sequence')
+        .first()
+    )
+
+
+def _start_dwell(dwell: VehicleDwell, position: Optional[Position]) -> None:
+    dwell.started_at = dwell.last_stationary_at = position.timestamp if position else None
+    dwell.anchor_latitude = position.latitude if position else None
+    dwell.anchor_longitude = position.longitude if position else None
+    dwell.trip_stop = None
+
+
+def _advance(dwell: VehicleDwell, position: Position, config: Dict[str, Any]) -> Optional[int]:
+    """
+    Fold one position, newer than any processed before, into the vehicle's dwell state.
+
+    Returns:
+        ID of the TripStop whose arrival or departure was stamped, if any
+    """
+    dwell.last_timestamp = position.timestamp
+    slow = position.speed <= config['MAX_SPEED']
+
+    if slow and dwell.started_at is not None and haversine(
+        float(dwell.anchor_latitude), float(dwell.anchor_longitude), float(position.latitude), float(position.longitude)
+    ) <= config['RADIUS']:
+        dwell.last_stationary_at = position.timestamp
+        if dwell.trip_stop is None and dwell.last_stationary_at - dwell.started_at >= config['MIN_DURATION']:
+            return _stamp_arrival(dwell, config)
+        return None
+
+    # Moving, or slow but away from where the dwell started: the dwell is over
+    stamped = None
+    if dwell.trip_stop is not None and TripStop.objects.filter(
+        id=dwell.trip_stop.id, actual_departure_datetime__isnull=True
+    ).update(actual_departure_datetime=dwell.last_stationary_at):
+        stamped = dwell.trip_stop.id
+    _start_dwell(dwell, position if slow else None)
+    return stamped
+
+
+def _stamp_arrival(dwell: VehicleDwell, config: Dict[str, Any]) -> Optional[int]:
+    trip_stop = next_trip_stop(dwell.vehicle_id)
+    if trip_stop is None or trip_stop.stop.latitude is None or trip_stop.stop.longitude is None:
+        return None
+    distance = haversine(
+        float(dwell.anchor_latitude), float(dwell.anchor_longitude),
+        float(trip_stop.stop.latitude), float(trip_stop.stop.longitude),
+    )
+    if distance > config['STOP_RADIUS']:
+        return None
+
+    # Keep an arrival already stamped when the vehicle entered the stop's geofence
+    stamped = TripStop.objects.filter(id=trip_stop.id, actual_arrival_datetime__isnull=True).update(
+        actual_arrival_datetime=dwell.started_at
+    )
+    dwell.trip_stop = trip_stop
+    return trip_stop.id if stamped else None
+
+
+def detect_dwells(positions: List[Position]) -> List[int]:
+    """
+    Advance the dwell detection of each vehicle with newly stored positions.
+
+    Runs in the ingest transaction. A vehicle's state holds where and when
+    its current stationary run started, so each position is looked at once
+    and history is never read back. Points older than the last processed
+    one arrive too late to tell when the vehicle stopped and are ignored.
+
+    Stop matching is configured by the DWELL_DETECTION setting: a vehicle
+    dwells when it stays at most RADIUS meters from where it slowed below
+    MAX_SPEED km/h for MIN_DURATION seconds. A dwell within STOP_RADIUS
+    meters of the next stop of the vehicle's in-progress trip stamps that
+    stop's actual arrival with the start of the dwell, and its actual
+    departure with the last stationary point once the vehicle moves on.
+
+    Args:
+        positions: Positions stored by the current transaction
+
+    Returns:
+        IDs of the TripStops whose arrival or departure was stamped
+    """
+    config = get_dwell_config()
+    if not config['ENABLED'] or not positions:
+        return []
+
+    positions_by_vehicle = defaultdict(list)
+    for position in positions:
+        positions_by_vehicle[position.vehicle_id].append(position)
+
+    dwells = {
+        dwell.vehicle_id: dwell
+        for dwell in VehicleDwell.objects.filter(vehicle_id__in=positions_by_vehicle).select_related('trip_stop')
+    }
+    changed = []
+    stamped = []
+    for vehicle_id, vehicle_positions in positions_by_vehicle.items():
+        dwell = dwells.get(vehicle_id)
+        for position in sorted(vehicle_positions, key=lambda position: position.timestamp):
+            if dwell is None:
+                dwell = VehicleDwell(vehicle_id=vehicle_id, last_timestamp=position.timestamp)
+                _start_dwell(dwell, position if position.speed <= config['MAX_SPEED'] else None)
+            elif position.timestamp > dwell.last_timestamp:
+                trip_stop_id = _advance(dwell, position, config)
+                if trip_stop_id is not None:
+                    stamped.append(trip_stop_id)
+            else:
+                continue
+            if not changed or changed[-1] is not dwell:
+                changed.append(dwell)
+
+    VehicleDwell.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=['vehicle'],
+        update_fields=VehicleDwell.STATE_FIELDS,
+    )
+    return stamped
@@ -0,0 +1,163 @@
+import math
+import struct
+import zipfile
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import List, Dict, Iterable, Iterator, Tuple
+from django.db.models.functions import TruncDate
+from .archive import ARCHIVE_FIELDS, ENGINE_STATUS_CODES, EPOCH, MICROSECOND, write_file_atomic
+from .history import position_rows
+from .models import Position, PositionArchive
+
+# Record layout of exported positions, as a NumPy structured dtype description.
+# Missing altitude, odometer and fuel level are NaN.
+EXPORT_DTYPE = [
+    ('id', '<i8'),
+    ('timestamp', '<M8[us]'),
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('speed', '<f4'),
+    ('heading', '<f4'),
+    ('altitude', '<f4'),
+    ('odometer', '<f8'),
+    ('fuel_level', '<f4'),
+    ('engine_status', 'u1'),
+]
+EXPORT_RECORD = struct.Struct('<qqddfffdfB')
+
+# Records packed per write
+EXPORT_CHUNK_SIZE = 4096
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# NumPy aligns the data of .npy files on 64 bytes, which keeps memory-mapped columns aligned
+NPY_ALIGNMENT = 64
+
+_COLUMNS = [ARCHIVE_FIELDS.index(name) for name, _ in EXPORT_DTYPE]
+
+
+def npy_header(count: int) -> bytes:
+    """Header of a version 1.0 .npy file holding ``count`` EXPORT_DTYPE records"""
+    header = f"{{'descr': {EXPORT_DTYPE!r}, 'fortran_order': False, 'shape': ({count},), }}"
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+def _pack(row: Tuple) -> bytes:
+    (position_id, timestamp, latitude, longitude, speed, heading, altitude,
+     odometer, fuel_level, engine_status) = (row[column] for column in _COLUMNS)
+    return EXPORT_RECORD.pack(
+        position_id,
+        (timestamp - EPOCH) // MICROSECOND,
+        latitude,
+        longitude,
+        speed,
+        heading,
+        math.nan if altitude is None else altitude,
+        math.nan if odometer is None else odometer,
+        math.nan if fuel_level is None else fuel_level,
+        ENGINE_STATUS_CODES.index(engine_status),
+    )
+
+
+def iter_npy(rows: List[Tuple], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Encode rows in ARCHIVE_FIELDS order as a .npy file of EXPORT_DTYPE records.
+
+    The file loads with ``numpy.load(path, mmap_mode='r')``, so a scan over
+    millions of points reads the records straight from the page cache.
+    """
+    yield npy_header(len(rows))
+    for start in range(0, len(rows), chunk_size):
+        yield b''.join(_pack(row) for row in rows[start:start + chunk_size])
+
+
+def export_vehicle_days(vehicle_ids: Iterable[int], since: date, until: date) -> List[Tuple[int, date]]:
+    """(vehicle_id, day) pairs with stored or archived positions between UTC days ``since`` and ``until``, inclusive"""
+    vehicle_ids = list(vehicle_ids)
+    start = datetime.combine(since, time.min, tzinfo=dt_timezone.utc)
+    end = datetime.combine(until + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+
+    stored = (
+        Position.objects.filter(vehicle_id__in=vehicle_ids, timestamp__gte=start, timestamp__lt=end)
+        .annotate(day=TruncDate('timestamp', tzinfo=dt_timezone.utc))
+        .values_list('vehicle_id', 'day')
+        .distinct()
+    )
+    archived = (
+        PositionArchive.objects.filter(vehicle_id__in=vehicle_ids, day__gte=since, day__lte=until)
+        .values_list('vehicle_id', 'day')
+    )
+    return sorted(set(stored) | set(archived))
+
+
+def export_path(vehicle_id: int, day: date) -> str:
+    return f"{vehicle_id}/{day.isoformat()}.npy"
+
+
+def export_positions(vehicle_ids: Iterable[int], since: date, until: date, output: Path) -> Dict[str, int]:
+    """
+    Write the positions of the given vehicles to one .npy file per vehicle-day.
+
+    Files are written under ``output`` as ``<vehicle_id>/<YYYY-MM-DD>.npy``
+    and replace earlier exports of the same vehicle-day.
+
+    Args:
+        vehicle_ids: Vehicles whose positions to export
+        since: First UTC day to export
+        until: Last UTC day to export
+        output: Directory to write the files to
+
+    Returns:
+        Dict with the number of 'files' and 'positions' written
+    """
+    summary = {'files': 0, 'positions': 0}
+    for vehicle_id, day in export_vehicle_days(vehicle_ids, since, until):
+        rows = _day_rows(vehicle_id, day)
+        write_file_atomic(Path(output) / export_path(vehicle_id, day), b''.join(iter_npy(rows)))
+        summary['files'] += 1
+        summary['positions'] += len(rows)
+    return summary
+
+
+def _day_rows(vehicle_id: int, day: date) -> List[Tuple]:
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return position_rows(vehicle_id, start, start + timedelta(days=1))
+
+
+class _ZipStream:
+    """Write-only file object collecting what ZipFile writes, drained between members"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_export_zip(vehicle_days: Iterable[Tuple[int, date]]) -> Iterator[bytes]:
+    """
+    Stream a zip archive with one .npy member per vehicle-day.
+
+    Members are stored uncompressed, so the archive is also a valid .npz
+    file, and the extracted members can be memory-mapped. Only one
+    vehicle-day is held in memory at a time.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for vehicle_id, day in vehicle_days:
+            with archive.open(export_path(vehicle_id, day), 'w') as member:
+                for chunk in iter_npy(_day_rows(vehicle_id, day)):
+                    member.write(chunk)
+                    yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()
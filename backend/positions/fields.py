@@ -0,0 +1,107 @@
+from decimal import Decimal, InvalidOperation
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+
+def to_scaled(value, decimal_places: int) -> int:
+    """Convert a number to an integer count of 10**-decimal_places units, rounding half to even"""
+    if isinstance(value, float):
+        return round(value * 10 ** decimal_places)
+    if isinstance(value, int):
+        return value * 10 ** decimal_places
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.scaleb(decimal_places).to_integral_value())
+
+
+def from_scaled(value: int, decimal_places: int) -> float:
+    """
+    Convert a scaled integer back to a float.
+
+    The float is the nearest double to the exact value, so formatting it
+    with ``decimal_places`` digits gives back the stored digits.
+    """
+    return value / 10 ** decimal_places
+
+
+class ScaledIntegerField(models.Field):
+    """
+    Fixed-point number stored as a scaled integer column.
+
+    Declared like a DecimalField, but the column holds the value in units of
+    10**-decimal_places, e.g. 1e-7 degrees for coordinates. Rows are smaller
+    (SQLite stores a coordinate in 4 bytes instead of an 8 byte REAL) and
+    reading a value is an integer division instead of building a Decimal.
+    Python values are floats; Decimals, ints and numeric strings are
+    accepted on assignment.
+
+    The column is the smallest of smallint, integer and bigint that holds
+    max_digits digits, or ``max_magnitude`` when the value has tighter
+    physical bounds (coordinates fit in 32 bits at 1e-7 degrees).
+    """
+
+    description = "Fixed-point number stored as a scaled integer"
+    empty_strings_allowed = False
+    default_error_messages = {
+        'invalid': '“%(value)s” value must be a number.',
+    }
+
+    def __init__(self, *args, max_digits: int, decimal_places: int, max_magnitude=None, **kwargs):
+        self.max_digits = max_digits
+        self.decimal_places = decimal_places
+        self.max_magnitude = max_magnitude
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['max_digits'] = self.max_digits
+        kwargs['decimal_places'] = self.decimal_places
+        if self.max_magnitude is not None:
+            kwargs['max_magnitude'] = self.max_magnitude
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        if self.max_magnitude is not None:
+            largest = to_scaled(self.max_magnitude, self.decimal_places)
+        else:
+            largest = 10 ** self.max_digits - 1
+        if largest <= 2 ** 15 - 1:
+            return 'SmallIntegerField'
+        if largest <= 2 ** 31 - 1:
+            return 'IntegerField'
+        return 'BigIntegerField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_scaled(value, self.decimal_places)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, float):
+            return value
+        try:
+            return from_scaled(to_scaled(value, self.decimal_places), self.decimal_places)
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'],
+                code='invalid',
+                params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        try:
+            return to_scaled(value, self.decimal_places)
+        except (InvalidOperation, TypeError, ValueError) as e:
+            raise e.__class__(f"Field '{self.name}' expected a number but got {value!r}.") from e
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{
+            'form_class': forms.DecimalField,
+            'max_digits': self.max_digits,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
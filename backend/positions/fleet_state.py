@@ -0,0 +1,399 @@
+import math
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Dict, Any, Iterable, Optional
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from .models import Position, VehicleLatestPosition
+from vehicles.models import Vehicle
+from dashmap.bbox import BoundingBox
+
+# Field order of the position rows applied to the fleet state
+ROW_FIELDS = (
+    'id', 'vehicle_id', 'latitude', 'longitude', 'speed', 'heading', 'altitude',
+    'timestamp', 'odometer', 'fuel_level', 'engine_status', 'created_at',
+)
+
+# Size in degrees of the grid cells latest positions are indexed by
+LATEST_CELL_SIZE = 0.5
+
+
+class VehicleTrack:
+    """
+    Fixed-size ring buffer of a vehicle's most recent points.
+
+    Points are kept in typed arrays (8 bytes per coordinate and timestamp,
+    4 bytes per speed and heading) rather than as model instances or dicts.
+    Late points are inserted in timestamp order, so the ring always holds
+    the newest ``capacity`` points; points older than all of those of a full
+    ring only exist in the database.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.latitudes = array('d', bytes(8 * capacity))
+        self.longitudes = array('d', bytes(8 * capacity))
+        self.speeds = array('f', bytes(4 * capacity))
+        self.headings = array('f', bytes(4 * capacity))
+        self.size = 0
+        self._next = 0
+
+    @property
+    def is_full(self) -> bool:
+        return self.size == self.capacity
+
+    @property
+    def oldest_timestamp(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return self.timestamps[(self._next - self.size) % self.capacity]
+
+    @property
+    def newest_timestamp(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return self.timestamps[(self._next - 1) % self.capacity]
+
+    def _index(self, position: int) -> int:
+        """Array index of the point at ``position``, counted from the oldest"""
+        return (self._next - self.size + position) % self.capacity
+
+    def _move(self, source: int, target: int) -> None:
+        for column in (self.timestamps, self.latitudes, self.longitudes, self.speeds, self.headings):
+            column[target] = column[source]
+
+    def append(self, timestamp: float, latitude: float, longitude: float, speed: float, heading: float) -> bool:
+        """
+        Add a point in timestamp order.
+
+        Returns:
+            Whether it was added, rather than already held or older than a full ring
+        """
+        position = self.size
+        while position and self.timestamps[self._index(position - 1)] > timestamp:
+            position -= 1
+        if position and self.timestamps[self._index(position - 1)] == timestamp:
+            return False
+
+        if self.is_full:
+            if not position:
+                return False
+            # The oldest point makes room: the older ones move down a slot
+            for moved in range(1, position):
+                self._move(self._index(moved), self._index(moved - 1))
+            index = self._index(position - 1)
+        else:
+            # The newer points move up a slot, into the free one after the newest
+            for moved in range(self.size - 1, position - 1, -1):
+                self._move(self._index(moved), self._index(moved + 1))
+            index = self._index(position)
+            self._next = (self._next + 1) % self.capacity
+            self.size += 1
+
+        self.timestamps[index] = timestamp
+        self.latitudes[index] = latitude
+        self.longitudes[index] = longitude
+        self.speeds[index] = speed
+        self.headings[index] = heading
+        return True
+
+    def indexes_since(self, since: float) -> List[int]:
+        """Array indexes of the points at or after ``since``, oldest first"""
+        indexes = []
+        for offset in range(1, self.size + 1):
+            index = (self._next - offset) % self.capacity
+            if self.timestamps[index] < since:
+                break
+            indexes.append(index)
+        indexes.reverse()
+        return indexes
+
+
+class FleetState:
+    """
+    Process-local view of the fleet: each vehicle's latest position and the
+    tail of its track.
+
+    The state is warmed from the database on first use and updated by the
+    ingest path once positions are committed. Writes made by other processes
+    are picked up by an incremental catch-up on new position IDs, at most
+    every ``sync_interval`` seconds. The catch-up also drops deleted vehicles
+    and the tracks of vehicles silent for longer than ``track_window``.
+    """
+
+    def __init__(self, track_length: int = 720, track_window: float = 3600, sync_interval: float = 1.0):
+        self.track_length = track_length
+        self.track_window = track_window
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all state; it is warmed again on next use"""
+        with self._lock:
+            self._latest = {}
+            # Grid index of the latest positions, for viewport queries
+            self._cells = {}
+            self._vehicle_cells = {}
+            self._tracks = {}
+            self._vehicles = {}
+            self._high_water_id = None
+            self._vehicles_synced_at = None
+            self._tracks_loaded_since = None
+            self._synced_at = 0.0
+
+    @property
+    def is_warm(self) -> bool:
+        return self._high_water_id is not None
+
+    def warm(self) -> None:
+        """Load latest positions and recent tracks from the database"""
+        with self._lock:
+            self.reset()
+            # Taken first so that positions committed during warm-up are caught up later
+            self._high_water_id = Position.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+            self._sync_vehicles()
+
+            self._tracks_loaded_since = timezone.now() - timedelta(seconds=self.track_window)
+            recent_rows = (
+                Position.objects.filter(timestamp__gte=self._tracks_loaded_since)
+                .order_by('timestamp')
+                .values_list(*ROW_FIELDS)
+            )
+            for row in recent_rows.iterator(chunk_size=2000):
+                self._apply_row(row)
+
+            latest_rows = VehicleLatestPosition.objects.values_list(
+                'position_id', 'vehicle_id', *ROW_FIELDS[2:]
+            )
+            for row in latest_rows.iterator(chunk_size=2000):
+                self._apply_latest(row)
+
+            self._evict()
+            self._synced_at = time.monotonic()
+
+    def sync(self, force: bool = False) -> None:
+        """Catch up with positions and vehicles written by other processes"""
+        with self._lock:
+            if not self.is_warm:
+                self.warm()
+                return
+            if not force and time.monotonic() - self._synced_at < self.sync_interval:
+                return
+
+            new_rows = (
+                Position.objects.filter(id__gt=self._high_water_id)
+                .order_by('id')
+                .values_list(*ROW_FIELDS)
+            )
+            for row in new_rows.iterator(chunk_size=2000):
+                self._apply_row(row)
+                self._high_water_id = max(self._high_water_id, row[0])
+
+            self._sync_vehicles()
+            self._evict()
+            self._synced_at = time.monotonic()
+
+    def apply(self, positions: Iterable[Position]) -> None:
+        """Apply committed positions from the ingest path"""
+        with self._lock:
+            if not self.is_warm:
+                # Picked up by the warm-up on next read
+                return
+            for position in sorted(positions, key=lambda position: position.id):
+                self._apply_row(tuple(getattr(position, field) for field in ROW_FIELDS))
+                # Not past a gap: positions committed by other processes in between are still to be caught up
+                if position.id == self._high_water_id + 1:
+                    self._high_water_id = position.id
+
+    def latest(self, bbox: Optional[BoundingBox] = None) -> List[Dict[str, Any]]:
+        """Latest position of each vehicle, formatted like /api/positions/latest/, optionally within a viewport"""
+        with self._lock:
+            self.sync()
+            missing = [vehicle_id for vehicle_id in self._latest if vehicle_id not in self._vehicles]
+            if missing:
+                # Vehicles created since the last sync
+                self._load_vehicles(Vehicle.objects.filter(id__in=missing))
+
+            vehicle_ids = self._latest if bbox is None else self._vehicles_within(bbox)
+            results = []
+            for vehicle_id in vehicle_ids:
+                _, payload = self._latest[vehicle_id]
+                license_plate, make_model = self._vehicles.get(vehicle_id, (None, None))
+                results.append({
+                    **payload,
+                    'vehicle_license_plate': license_plate,
+                    'vehicle_make_model': make_model,
+                })
+            return results
+
+    def _vehicles_within(self, bbox: BoundingBox) -> List[int]:
+        south, north = _cell_index(bbox.min_latitude), _cell_index(bbox.max_latitude)
+        if bbox.crosses_antimeridian:
+            columns = list(range(_cell_index(bbox.min_longitude), _cell_index(180) + 1))
+            columns += range(_cell_index(-180), _cell_index(bbox.max_longitude) + 1)
+        else:
+            columns = range(_cell_index(bbox.min_longitude), _cell_index(bbox.max_longitude) + 1)
+
+        if (north - south + 1) * len(columns) < len(self._cells):
+            cells = [(row, column) for row in range(south, north + 1) for column in columns]
+        else:
+            # A viewport covering more cells than are occupied
+            cells = [
+                cell for cell in self._cells
+                if south <= cell[0] <= north and cell[1] in columns
+            ]
+
+        vehicle_ids = []
+        for cell in cells:
+            for vehicle_id in self._cells.get(cell, ()):
+                _, payload = self._latest[vehicle_id]
+                if bbox.contains(float(payload['latitude']), float(payload['longitude'])):
+                    vehicle_ids.append(vehicle_id)
+        return sorted(vehicle_ids)
+
+    def covers(self, vehicle_id: int, since: datetime) -> bool:
+        """Whether the in-memory track of a vehicle holds every point since ``since``"""
+        with self._lock:
+            self.sync()
+            if since < self._tracks_loaded_since:
+                return False
+            track = self._tracks.get(vehicle_id)
+            return track is None or not track.is_full or track.oldest_timestamp <= since.timestamp()
+
+    def track(self, vehicle_id: int, since: datetime) -> List[Dict[str, Any]]:
+        """Points of a vehicle's in-memory track at or after ``since``, oldest first"""
+        with self._lock:
+            self.sync()
+            track = self._tracks.get(vehicle_id)
+            if track is None:
+                return []
+
+            return [
+                {
+                    'latitude': f"{track.latitudes[index]:.7f}",
+                    'longitude': f"{track.longitudes[index]:.7f}",
+                    'speed': f"{track.speeds[index]:.2f}",
+                    'heading': f"{track.headings[index]:.2f}",
+                    'timestamp': datetime.fromtimestamp(track.timestamps[index], tz=dt_timezone.utc).isoformat(),
+                }
+                for index in track.indexes_since(since.timestamp())
+            ]
+
+    def _apply_row(self, row) -> None:
+        vehicle_id, latitude, longitude, speed, heading, timestamp = row[1], row[2], row[3], row[4], row[5], row[7]
+        track = self._tracks.get(vehicle_id)
+        if track is None:
+            track = self._tracks[vehicle_id] = VehicleTrack(self.track_length)
+        track.append(timestamp.timestamp(), float(latitude), float(longitude), float(speed), float(heading))
+        self._apply_latest(row)
+
+    def _apply_latest(self, row) -> None:
+        (position_id, vehicle_id, latitude, longitude, speed, heading, altitude,
+         timestamp, odometer, fuel_level, engine_status, created_at) = row
+
+        current = self._latest.get(vehicle_id)
+        if current is not None and current[0] >= timestamp:
+            return
+
+        self._latest[vehicle_id] = (timestamp, {
+            'id': position_id,
+            'vehicle_id': vehicle_id,
+            'latitude': f"{latitude:.7f}",
+            'longitude': f"{longitude:.7f}",
+            'speed': f"{speed:.2f}",
+            'heading': f"{heading:.2f}",
+            'altitude': f"{altitude:.2f}" if altitude else None,
+            'timestamp': timestamp.isoformat(),
+            'odometer': f"{odometer:.2f}" if odometer else None,
+            'fuel_level': f"{fuel_level:.2f}" if fuel_level else None,
+            'engine_status': engine_status,
+            'created_at': created_at.isoformat(),
+        })
+
+        cell = (_cell_index(latitude), _cell_index(longitude))
+        previous_cell = self._vehicle_cells.get(vehicle_id)
+        if previous_cell != cell:
+            if previous_cell is not None:
+                self._remove_from_cell(vehicle_id, previous_cell)
+            self._cells.setdefault(cell, set()).add(vehicle_id)
+            self._vehicle_cells[vehicle_id] = cell
+
+    def _remove_from_cell(self, vehicle_id: int, cell) -> None:
+        self._cells[cell].discard(vehicle_id)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def _evict(self) -> None:
+        """Forget deleted vehicles, and the tracks of vehicles without points in the last track_window"""
+        live_ids = set(Vehicle.objects.filter(deleted_at__isnull=True).values_list('id', flat=True))
+        for vehicle_id in (self._latest.keys() | self._tracks.keys() | self._vehicles.keys()) - live_ids:
+            self._latest.pop(vehicle_id, None)
+            self._tracks.pop(vehicle_id, None)
+            self._vehicles.pop(vehicle_id, None)
+            cell = self._vehicle_cells.pop(vehicle_id, None)
+            if cell is not None:
+                self._remove_from_cell(vehicle_id, cell)
+
+        # Latest positions of silent vehicles are kept: the latest endpoint lists every vehicle
+        cutoff = time.time() - self.track_window
+        silent = [vehicle_id for vehicle_id, track in self._tracks.items() if track.newest_timestamp < cutoff]
+        for vehicle_id in silent:
+            del self._tracks[vehicle_id]
+        if silent:
+            # Their dropped points are older than the cutoff; earlier windows are read from the database
+            self._tracks_loaded_since = max(
+                self._tracks_loaded_since, datetime.fromtimestamp(cutoff, tz=dt_timezone.utc)
+            )
+
+    def _sync_vehicles(self) -> None:
+        vehicles = Vehicle.objects.all()
+        if self._vehicles_synced_at is not None:
+            vehicles = vehicles.filter(updated_at__gt=self._vehicles_synced_at)
+
+        last_updated_at = self._load_vehicles(vehicles)
+        if last_updated_at is not None:
+            self._vehicles_synced_at = last_updated_at
+
+    def _load_vehicles(self, vehicles) -> Optional[datetime]:
+        last_updated_at = None
+        for vehicle_id, license_plate, make, model, updated_at in vehicles.values_list(
+            'id', 'license_plate', 'make', 'model', 'updated_at'
+        ):
+            self._vehicles[vehicle_id] = (license_plate, f"{make} {model}")
+            if last_updated_at is None or updated_at > last_updated_at:
+                last_updated_at = updated_at
+        return last_updated_at
+
+
+def _cell_index(degrees: float) -> int:
+    return math.floor(float(degrees) / LATEST_CELL_SIZE)
+
+
+_fleet_state = None
+_fleet_state_lock = threading.Lock()
+
+
+def get_fleet_state() -> Optional[FleetState]:
+    """
+    Return the process-wide fleet state, or None when it is disabled.
+
+    Configured by the FLEET_STATE setting.
+    """
+    global _fleet_state
+    config = getattr(settings, 'FLEET_STATE', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    with _fleet_state_lock:
+        if _fleet_state is None:
+            _fleet_state = FleetState(
+                track_length=config.get('TRACK_LENGTH', 720),
+                track_window=config.get('TRACK_WINDOW', 3600),
+                sync_interval=config.get('SYNC_INTERVAL', 1.0),
+            )
+        return _fleet_state
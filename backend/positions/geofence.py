@@ -0,0 +1,282 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce
+from trips.models import TripStop
+from .models import Position, VehicleGeofenceState
+from .rollups import haversine
+
+METERS_PER_DEGREE = 111320.0
+
+
+class Geofence(NamedTuple):
+    trip_stop_id: int
+    trip_id: int
+    vehicle_id: int
+    latitude: float
+    longitude: float
+
+
+class GeofenceIndex:
+    """
+    Process-local grid index of the geofences around the stops of active trips.
+
+    Each fence is a circle of ``radius`` meters around a stop that is not
+    completed yet, on an in-progress trip with coordinates. Fences are
+    registered in every grid cell their circle overlaps, so a position only
+    has to be checked against the fences of its own cell.
+
+    Trips and stops changed in this process update the index as soon as
+    they are committed (see positions/apps.py); changes made by other
+    processes are picked up by a full reload every ``refresh_interval``
+    seconds.
+    """
+
+    def __init__(self, radius: float = 100, exit_radius: float = 150, cell_size: float = 0.01,
+                 refresh_interval: float = 30.0):
+        self.radius = radius
+        self.exit_radius = exit_radius
+        self.cell_size = cell_size
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all fences; they are loaded again on next use"""
+        with self._lock:
+            self._fences = {}
+            self._cells = defaultdict(set)
+            # Fences each vehicle has entered and not left yet
+            self._inside = defaultdict(set)
+            self._loaded_at = None
+
+    def __len__(self) -> int:
+        return len(self._fences)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def _fence_cells(self, fence: Geofence) -> Iterable[Tuple[int, int]]:
+        latitude_margin = self.radius / METERS_PER_DEGREE
+        longitude_margin = self.radius / (METERS_PER_DEGREE * max(math.cos(math.radians(fence.latitude)), 0.01))
+        south, west = self._cell(fence.latitude - latitude_margin, fence.longitude - longitude_margin)
+        north, east = self._cell(fence.latitude + latitude_margin, fence.longitude + longitude_margin)
+        for row in range(south, north + 1):
+            for column in range(west, east + 1):
+                yield row, column
+
+    def _add(self, fence: Geofence, arrived: bool) -> None:
+        self._fences[fence.trip_stop_id] = fence
+        for cell in self._fence_cells(fence):
+            self._cells[cell].add(fence.trip_stop_id)
+        if arrived:
+            self._inside[fence.vehicle_id].add(fence.trip_stop_id)
+
+    def _remove(self, trip_stop_id: int) -> None:
+        fence = self._fences.pop(trip_stop_id, None)
+        if fence is None:
+            return
+        for cell in self._fence_cells(fence):
+            self._cells[cell].discard(trip_stop_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+        self._inside[fence.vehicle_id].discard(trip_stop_id)
+
+    def _load(self, trip_ids: Optional[Iterable[int]] = None) -> None:
+        trip_stops = TripStop.objects.filter(
+            trip__status='in_progress',
+            is_completed=False,
+            stop__latitude__isnull=False,
+            stop__longitude__isnull=False,
+        )
+        if trip_ids is not None:
+            trip_stops = trip_stops.filter(trip_id__in=trip_ids)
+        rows = trip_stops.values_list(
+            'id', 'trip_id', 'trip__vehicle_id', 'stop__latitude', 'stop__longitude',
+            'actual_arrival_datetime', 'actual_departure_datetime',
+        )
+        for trip_stop_id, trip_id, vehicle_id, latitude, longitude, arrival, departure in rows:
+            fence = Geofence(trip_stop_id, trip_id, vehicle_id, float(latitude), float(longitude))
+            self._add(fence, arrived=arrival is not None and departure is None)
+
+    def refresh(self, force: bool = False) -> None:
+        """Reload every fence, at most every ``refresh_interval`` seconds unless forced"""
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+                return
+            self.reset()
+            self._load()
+            self._loaded_at = time.monotonic()
+
+    def update_trips(self, trip_ids: Iterable[int]) -> None:
+        """Reload the fences of the given trips after they or their stops changed"""
+        trip_ids = set(trip_ids)
+        with self._lock:
+            if self._loaded_at is None:
+                # Loaded in full on next use
+                return
+            for fence in [fence for fence in self._fences.values() if fence.trip_id in trip_ids]:
+                self._remove(fence.trip_stop_id)
+            self._load(trip_ids)
+
+    def nearby(self, latitude: float, longitude: float) -> List[Geofence]:
+        """Fences registered in the grid cell of a point"""
+        with self._lock:
+            return [self._fences[trip_stop_id] for trip_stop_id in self._cells.get(self._cell(latitude, longitude), ())]
+
+    def get(self, trip_stop_id: int) -> Optional[Geofence]:
+        return self._fences.get(trip_stop_id)
+
+    def inside(self, vehicle_id: int) -> Set[int]:
+        """IDs of the fences a vehicle has entered and not left yet"""
+        with self._lock:
+            return set(self._inside.get(vehicle_id, ()))
+
+    def apply_events(self, arrived: Set[int], completed: Set[int]) -> None:
+        """Record committed arrivals and departures"""
+        with self._lock:
+            for trip_stop_id in arrived:
+                fence = self._fences.get(trip_stop_id)
+                if fence is not None:
+                    self._inside[fence.vehicle_id].add(trip_stop_id)
+            for trip_stop_id in completed:
+                self._remove(trip_stop_id)
+
+
+def process_geofences(positions: List[Position]) -> Dict[str, List[int]]:
+    """
+    Stamp the stops whose geofence the newly stored positions entered or left.
+
+    Runs in the ingest transaction. A position inside the fence of a stop on
+    its vehicle's in-progress trip stamps the stop's actual arrival, unless
+    an earlier one was recorded. The first later position more than
+    ``exit_radius`` meters away stamps the actual departure, if none was
+    recorded yet, and completes the stop. Positions older than the last one
+    processed for their vehicle, e.g. backfilled by a device that was
+    offline, are skipped: the fences were already entered and left in
+    order without them. Each position is only checked
+    against the fences of its grid cell and those its vehicle is inside.
+    The index is updated once the transaction commits.
+
+    Args:
+        positions: Positions stored by the current transaction
+
+    Returns:
+        Dict with the 'arrived' and 'completed' TripStop IDs
+    """
+    index = get_geofence_index()
+    if index is None or not positions:
+        return {'arrived': [], 'completed': []}
+    index.refresh()
+
+    last_timestamps = dict(
+        VehicleGeofenceState.objects.filter(vehicle_id__in={position.vehicle_id for position in positions})
+        .values_list('vehicle_id', 'last_timestamp')
+    )
+    processed = {}
+    arrived, completed = set(), set()
+    inside = {}
+    for position in sorted(positions, key=lambda position: position.timestamp):
+        last_timestamp = last_timestamps.get(position.vehicle_id)
+        if last_timestamp is not None and position.timestamp <= last_timestamp:
+            continue
+        last_timestamps[position.vehicle_id] = processed[position.vehicle_id] = position.timestamp
+
+        latitude, longitude = float(position.latitude), float(position.longitude)
+        if position.vehicle_id not in inside:
+            inside[position.vehicle_id] = index.inside(position.vehicle_id)
+        vehicle_inside = inside[position.vehicle_id]
+
+        for trip_stop_id in list(vehicle_inside):
+            fence = index.get(trip_stop_id)
+            if fence is None:
+                vehicle_inside.discard(trip_stop_id)
+            elif (haversine(fence.latitude, fence.longitude, latitude, longitude) > index.exit_radius
+                    and _stamp_departure(trip_stop_id, position.timestamp)):
+                vehicle_inside.discard(trip_stop_id)
+                completed.add(trip_stop_id)
+
+        for fence in index.nearby(latitude, longitude):
+            if (fence.vehicle_id != position.vehicle_id or fence.trip_stop_id in vehicle_inside
+                    or fence.trip_stop_id in completed):
+                continue
+            if haversine(fence.latitude, fence.longitude, latitude, longitude) <= index.radius:
+                _stamp_arrival(fence.trip_stop_id, position.timestamp)
+                vehicle_inside.add(fence.trip_stop_id)
+                arrived.add(fence.trip_stop_id)
+
+    VehicleGeofenceState.objects.bulk_create(
+        [
+            VehicleGeofenceState(vehicle_id=vehicle_id, last_timestamp=timestamp)
+            for vehicle_id, timestamp in processed.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['vehicle'],
+        update_fields=['last_timestamp'],
+    )
+    if arrived or completed:
+        transaction.on_commit(lambda: index.apply_events(arrived, completed))
+    return {'arrived': sorted(arrived), 'completed': sorted(completed)}
+
+
+def _stamp_arrival(trip_stop_id: int, timestamp: datetime) -> None:
+    # Entering the fence comes before a dwell at the stop, which may have stamped a later arrival
+    TripStop.objects.filter(
+        Q(actual_arrival_datetime__isnull=True) | Q(actual_arrival_datetime__gt=timestamp), id=trip_stop_id
+    ).update(actual_arrival_datetime=timestamp)
+
+
+def _stamp_departure(trip_stop_id: int, timestamp: datetime) -> bool:
+    """
+    Stamp the departure from a stop and complete it, unless it was arrived at after ``timestamp``.
+
+    Returns:
+        Whether the stop was completed
+    """
+    # A departure already recorded, e.g. by dwell detection, is kept
+    return TripStop.objects.filter(
+        Q(actual_arrival_datetime__isnull=True) | Q(actual_arrival_datetime__lte=timestamp), id=trip_stop_id
+    ).update(
+        actual_departure_datetime=Coalesce(F('actual_departure_datetime'), Value(timestamp, output_field=DateTimeField())),
+        is_completed=True,
+    ) > 0
+
+
+_geofence_index = None
+_geofence_index_lock = threading.Lock()
+
+
+def get_geofence_index() -> Optional[GeofenceIndex]:
+    """
+    Return the process-wide geofence index, or None when it is disabled.
+
+    Configured by the GEOFENCE setting.
+    """
+    global _geofence_index
+    config = getattr(settings, 'GEOFENCE', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    with _geofence_index_lock:
+        if _geofence_index is None:
+            _geofence_index = GeofenceIndex(
+                radius=config.get('RADIUS', 100),
+                exit_radius=config.get('EXIT_RADIUS', 150),
+                cell_size=config.get('CELL_SIZE', 0.01),
+                refresh_interval=config.get('REFRESH_INTERVAL', 30.0),
+            )
+        return _geofence_index
+
+
+def trips_changed(trip_ids: Iterable[int]) -> None:
+    """Update the geofence index once the current transaction commits"""
+    index = get_geofence_index()
+    if index is not None:
+        trip_ids = set(trip_ids)
+        transaction.on_commit(lambda: index.update_trips(trip_ids))
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Iterable, Iterator, Optional, Tuple
+from .archive import ARCHIVE_FIELDS, get_archive_config, read_archive
+from .models import Position, PositionArchive
+from vehicles.models import Vehicle
+from dashmap.bbox import BoundingBox
+
+# Number of decoded vehicle-days kept in memory per process
+ARCHIVE_CACHE_CHUNKS = 64
+
+
+class ArchiveChunkCache:
+    """
+    Bounded LRU cache of decoded archive files.
+
+    Replaying a day of history pages through the same archived vehicle-day
+    many times; decoding it once and serving the following pages from memory
+    keeps paging through archived days as cheap as paging through the table.
+    Entries are keyed on the manifest row and its update time, so a file
+    rewritten with late points is decoded again.
+    """
+
+    def __init__(self, capacity: int = ARCHIVE_CACHE_CHUNKS):
+        self.capacity = capacity
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, archive: PositionArchive) -> List[Tuple]:
+        """Decoded rows of an archive file, in ARCHIVE_FIELDS order, oldest first"""
+        key = (archive.id, archive.updated_at)
+        with self._lock:
+            rows = self._chunks.get(key)
+            if rows is not None:
+                self._chunks.move_to_end(key)
+                self.hits += 1
+                return rows
+            self.misses += 1
+
+        rows = read_archive(archive)
+        with self._lock:
+            self._chunks[key] = rows
+            while len(self._chunks) > self.capacity:
+                self._chunks.popitem(last=False)
+        return rows
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._chunks.clear()
+            self.hits = self.misses = 0
+
+
+archive_chunk_cache = ArchiveChunkCache(get_archive_config()['CACHE_CHUNKS'])
+
+
+def overlapping_archives(vehicle_id: Optional[int], since: Optional[datetime], until: Optional[datetime]):
+    """Manifest entries of the archived vehicle-days that overlap [since, until)"""
+    archives = PositionArchive.objects.all()
+    if vehicle_id is not None:
+        archives = archives.filter(vehicle_id=vehicle_id)
+    if since is not None:
+        archives = archives.filter(last_timestamp__gte=since)
+    if until is not None:
+        archives = archives.filter(first_timestamp__lt=until)
+    return archives
+
+
+def position_rows(vehicle_id: int, since: datetime, until: datetime) -> List[Tuple]:
+    """
+    A vehicle's positions in [since, until) from the table and the archive.
+
+    Returns:
+        Rows in ARCHIVE_FIELDS order, oldest first
+    """
+    rows = list(
+        Position.objects.filter(vehicle_id=vehicle_id, timestamp__gte=since, timestamp__lt=until)
+        .values_list(*ARCHIVE_FIELDS)
+    )
+    for archive in overlapping_archives(vehicle_id, since, until):
+        rows.extend(row for row in archive_chunk_cache.get(archive) if since <= row[1] < until)
+    rows.sort(key=lambda row: (row[1], row[0]))
+    return rows
+
+
+def previous_position_row(vehicle_id: int, before: datetime) -> Optional[Tuple]:
+    """A vehicle's last position before ``before``, from the table or the archive"""
+    row = (
+        Position.objects.filter(vehicle_id=vehicle_id, timestamp__lt=before)
+        .order_by('-timestamp')
+        .values_list(*ARCHIVE_FIELDS)
+        .first()
+    )
+    archive = (
+        PositionArchive.objects.filter(vehicle_id=vehicle_id, first_timestamp__lt=before)
+        .order_by('-day')
+        .first()
+    )
+    if archive is not None and (row is None or archive.last_timestamp > row[1]):
+        archived = [archived for archived in archive_chunk_cache.get(archive) if archived[1] < before]
+        if archived and (row is None or archived[-1][1] > row[1]):
+            return archived[-1]
+    return row
+
+
+def iter_archived_positions(
+    vehicle_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+    bbox: Optional[BoundingBox] = None,
+) -> Iterator[Position]:
+    """
+    Archived positions newest first, ordered by (timestamp, id) like the table.
+
+    Archive files are decoded one day at a time, and only for the days that
+    overlap the window, so a page deep into the past reads a single file.
+
+    Args:
+        vehicle_id: Only return positions of this vehicle
+        since: Only return positions at or after this time
+        until: Only return positions strictly before this time
+        before: Only return positions strictly before this (timestamp, id) key
+        bbox: Only return positions within this area
+    """
+    archives = overlapping_archives(vehicle_id, since, until)
+    if before is not None:
+        archives = archives.filter(first_timestamp__lte=before[0])
+    archives = archives.order_by('-day', 'vehicle_id')
+
+    vehicles = {}
+    for _, day_archives in itertools.groupby(archives.iterator(), key=lambda archive: archive.day):
+        day_archives = list(day_archives)
+        missing = {archive.vehicle_id for archive in day_archives} - vehicles.keys()
+        if missing:
+            vehicles.update(Vehicle.objects.in_bulk(missing))
+
+        day_rows = [
+            [(row, archive.vehicle_id) for row in reversed(archive_chunk_cache.get(archive))]
+            for archive in day_archives
+        ]
+        for row, row_vehicle_id in heapq.merge(*day_rows, key=lambda item: (item[0][1], item[0][0]), reverse=True):
+            if until is not None and row[1] >= until:
+                continue
+            if before is not None and (row[1], row[0]) >= before:
+                continue
+            if since is not None and row[1] < since:
+                break
+            if bbox is not None and not bbox.contains(float(row[2]), float(row[3])):
+                continue
+            yield _position_from_row(row, vehicles[row_vehicle_id])
+
+
+def _position_from_row(row: Tuple, vehicle: Vehicle) -> Position:
+    position = Position(**dict(zip(ARCHIVE_FIELDS, row)))
+    position.vehicle = vehicle
+    return position
+
+
+def merge_newest_first(*sources: Iterable[Position]) -> Iterator[Position]:
+    """Merge position iterables that are each ordered newest first by (timestamp, id)"""
+    return heapq.merge(*sources, key=lambda position: (position.timestamp, position.id), reverse=True)
@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from positions.archive import archive_positions, archivable_vehicle_days, get_archive_config, PositionArchiveError
+
+
+class Command(BaseCommand):
+    help = 'Move positions older than the retention period to the compressed cold archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            help='Retention period in days (default: POSITION_ARCHIVE["RETENTION_DAYS"])',
+        )
+        parser.add_argument('--before', type=date.fromisoformat, help='Archive UTC days before this one (YYYY-MM-DD)')
+        parser.add_argument(
+            '--vehicle',
+            type=int,
+            action='append',
+            help='Only archive this vehicle (can be repeated)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List how many vehicle-days would be archived without moving anything',
+        )
+
+    def handle(self, *args, **options):
+        before = options['before']
+        if before is None:
+            retention_days = options['older_than_days']
+            if retention_days is None:
+                retention_days = get_archive_config()['RETENTION_DAYS']
+            if retention_days < 1:
+                raise CommandError('--older-than-days must be at least 1')
+            before = timezone.now().date() - timedelta(days=retention_days)
+
+        if options['dry_run']:
+            vehicle_days = archivable_vehicle_days(before, options['vehicle'])
+            self.stdout.write(f'{len(vehicle_days)} vehicle-days before {before} would be archived')
+            return
+
+        self.stdout.write(f'Archiving positions before {before}...')
+        try:
+            summary = archive_positions(before, options['vehicle'])
+        except PositionArchiveError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {summary['positions']} positions from {summary['vehicle_days']} vehicle-days"
+        ))
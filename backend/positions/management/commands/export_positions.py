@@ -0,0 +1,37 @@
+from datetime import date
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from companies.models import Company
+from positions.export import export_positions
+from vehicles.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = 'Export positions as one NumPy .npy file of structured records per vehicle-day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, required=True, help='Company whose vehicles to export')
+        parser.add_argument('--since', type=date.fromisoformat, required=True, help='First UTC day to export (YYYY-MM-DD)')
+        parser.add_argument('--until', type=date.fromisoformat, required=True, help='Last UTC day to export (YYYY-MM-DD)')
+        parser.add_argument(
+            '--vehicle',
+            type=int,
+            action='append',
+            help='Only export this vehicle of the company (can be repeated)',
+        )
+        parser.add_argument('--output', type=Path, required=True, help='Directory to write the files to')
+
+    def handle(self, *args, **options):
+        if not Company.objects.filter(id=options['company']).exists():
+            raise CommandError(f"Company {options['company']} not found")
+        if options['since'] > options['until']:
+            raise CommandError('--since must not be after --until')
+
+        vehicles = Vehicle.objects.filter(company_id=options['company'])
+        if options['vehicle']:
+            vehicles = vehicles.filter(id__in=options['vehicle'])
+        vehicle_ids = list(vehicles.values_list('id', flat=True))
+
+        self.stdout.write(f"Exporting positions of {len(vehicle_ids)} vehicle(s) to {options['output']}...")
+        summary = export_positions(vehicle_ids, options['since'], options['until'], options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {summary['positions']} positions to {summary['files']} files"))
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Min, Max
+
+
+# Models are imported inside the functions: with the spawn start method,
+# worker processes import this module before Django is set up.
+def setup_worker():
+    django.setup()
+
+
+def rebuild_vehicle_day(vehicle_id, day):
+    """Rebuild one vehicle-day of rollups, written in its own short transaction"""
+    from positions.rollups import rebuild_rollups
+
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return rebuild_rollups(vehicle_id, start, start + timedelta(days=1))
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-minute and per-hour position rollups from the position history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--vehicle',
+            type=int,
+            action='append',
+            help='Only rebuild this vehicle (can be repeated)',
+        )
+        parser.add_argument('--since', type=date.fromisoformat, help='First UTC day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last UTC day to rebuild (YYYY-MM-DD)')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(4, os.cpu_count() or 1),
+            help='Number of worker processes (1 rebuilds in this process)',
+        )
+
+    def handle(self, *args, **options):
+        from positions.models import Position, PositionArchive
+
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        positions = Position.objects.all()
+        archives = PositionArchive.objects.all()
+        if options['vehicle']:
+            positions = positions.filter(vehicle_id__in=options['vehicle'])
+            archives = archives.filter(vehicle_id__in=options['vehicle'])
+
+        # First and last UTC day of each vehicle, over the table and the archive
+        day_ranges = {}
+        for row in positions.values('vehicle_id').annotate(first=Min('timestamp'), last=Max('timestamp')):
+            day_ranges[row['vehicle_id']] = (
+                row['first'].astimezone(dt_timezone.utc).date(),
+                row['last'].astimezone(dt_timezone.utc).date(),
+            )
+        for row in archives.values('vehicle_id').annotate(first=Min('day'), last=Max('day')):
+            first, last = day_ranges.get(row['vehicle_id'], (row['first'], row['last']))
+            day_ranges[row['vehicle_id']] = (min(first, row['first']), max(last, row['last']))
+
+        # One task per vehicle-day: rebuilding a vehicle-day only reads that
+        # vehicle's positions, so tasks are independent and transactions short
+        tasks = []
+        for vehicle_id, (day, last_day) in sorted(day_ranges.items()):
+            if options['since']:
+                day = max(day, options['since'])
+            if options['until']:
+                last_day = min(last_day, options['until'])
+            while day <= last_day:
+                tasks.append((vehicle_id, day))
+                day += timedelta(days=1)
+
+        self.stdout.write(f'Rebuilding rollups for {len(tasks)} vehicle-days with {options["workers"]} worker(s)...')
+
+        total = 0
+        if options['workers'] == 1:
+            for vehicle_id, day in tasks:
+                total += rebuild_vehicle_day(vehicle_id, day)
+        else:
+            # Workers open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=setup_worker) as executor:
+                futures = [executor.submit(rebuild_vehicle_day, vehicle_id, day) for vehicle_id, day in tasks]
+                for future in as_completed(futures):
+                    total += future.result()
+
+        self.stdout.write(self.style.SUCCESS(f'Aggregated {total} positions into rollups'))
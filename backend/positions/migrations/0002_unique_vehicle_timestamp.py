@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:34
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_positions(apps, schema_editor):
+    """Keep only the first stored position for each (vehicle, timestamp)"""
+    Position = apps.get_model('positions', 'Position')
+
+    duplicated_keys = (
+        Position.objects.values('vehicle_id', 'timestamp')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for key in duplicated_keys.iterator():
+        Position.objects.filter(
+            vehicle_id=key['vehicle_id'], timestamp=key['timestamp']
+        ).exclude(id=key['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0001_initial'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        # Removed duplicates cannot be restored
+        migrations.RunPython(remove_duplicate_positions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='position',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'timestamp'), name='unique_position_per_vehicle_timestamp'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_latest_positions(apps, schema_editor):
+    """Snapshot the current latest position of every vehicle"""
+    Position = apps.get_model('positions', 'Position')
+    VehicleLatestPosition = apps.get_model('positions', 'VehicleLatestPosition')
+
+    latest_positions_subquery = Position.objects.filter(
+        vehicle=OuterRef('vehicle')
+    ).order_by('-timestamp').values('id')[:1]
+    latest_positions = Position.objects.filter(id__in=Subquery(latest_positions_subquery))
+
+    VehicleLatestPosition.objects.bulk_create([
+        VehicleLatestPosition(
+            vehicle_id=position.vehicle_id,
+            position_id=position.id,
+            latitude=position.latitude,
+            longitude=position.longitude,
+            speed=position.speed,
+            heading=position.heading,
+            altitude=position.altitude,
+            timestamp=position.timestamp,
+            odometer=position.odometer,
+            fuel_level=position.fuel_level,
+            engine_status=position.engine_status,
+            created_at=position.created_at,
+        )
+        for position in latest_positions.iterator()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0002_unique_vehicle_timestamp'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleLatestPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('speed', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('heading', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('altitude', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('odometer', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('engine_status', models.CharField(default='off', max_length=20)),
+                ('created_at', models.DateTimeField(help_text='When the position was received')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('position', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='positions.position')),
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='latest_position', to='vehicles.vehicle')),
+            ],
+        ),
+        migrations.RunPython(populate_latest_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0003_vehicle_latest_position'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionHourRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Start of the time bucket')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('first_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('first_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('speed_total', models.DecimalField(decimal_places=2, default=0, help_text='Sum of speeds, for the average', max_digits=12)),
+                ('max_speed', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('distance', models.DecimalField(decimal_places=2, default=0, help_text='Distance travelled in meters', max_digits=12)),
+                ('min_fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('max_fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('min_odometer', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_odometer', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'bucket'), name='unique_hour_rollup_per_vehicle_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PositionMinuteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Start of the time bucket')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('first_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('first_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('speed_total', models.DecimalField(decimal_places=2, default=0, help_text='Sum of speeds, for the average', max_digits=12)),
+                ('max_speed', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('distance', models.DecimalField(decimal_places=2, default=0, help_text='Distance travelled in meters', max_digits=12)),
+                ('min_fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('max_fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('min_odometer', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_odometer', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'bucket'), name='unique_minute_rollup_per_vehicle_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0004_position_rollups'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='UTC day covered by the file')),
+                ('path', models.CharField(help_text='File path relative to the archive root', max_length=255)),
+                ('compression', models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'zstd')], max_length=10)),
+                ('point_count', models.PositiveIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('size_bytes', models.PositiveIntegerField(help_text='Compressed file size')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='position_archives', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['vehicle', 'day'],
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'day'), name='unique_position_archive_per_vehicle_day')],
+            },
+        ),
+    ]
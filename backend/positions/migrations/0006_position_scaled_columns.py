@@ -0,0 +1,155 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:12
+
+import positions.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0005_position_archive'),
+    ]
+
+    operations = [
+        # The decimal columns become nullable so that reversing the last step can add them back
+        migrations.AlterField(
+            model_name='position',
+            name='latitude',
+            field=models.DecimalField(decimal_places=7, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='longitude',
+            field=models.DecimalField(decimal_places=7, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='speed',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='heading',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='altitude',
+            field=models.DecimalField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='odometer',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='fuel_level',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='latitude',
+            field=models.DecimalField(decimal_places=7, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='longitude',
+            field=models.DecimalField(decimal_places=7, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='speed',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='heading',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='altitude',
+            field=models.DecimalField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='odometer',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='fuel_level',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='latitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='longitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=180, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='speed_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='heading_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='altitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='odometer_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='fuel_level_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='latitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='longitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=180, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='speed_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='heading_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='altitude_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='odometer_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='fuel_level_scaled',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:12
+
+from django.db import migrations
+
+# Decimal places of the columns moved to scaled integers
+FIELDS = [
+    ('latitude', 7),
+    ('longitude', 7),
+    ('speed', 2),
+    ('heading', 2),
+    ('altitude', 2),
+    ('odometer', 2),
+    ('fuel_level', 2),
+]
+
+
+def copy_sql(table, source, target, scaled):
+    """UPDATE copying every column of FIELDS from its source to its target name"""
+    if scaled:
+        expressions = [f"CAST(ROUND({name}{source} * {10 ** places}) AS BIGINT)" for name, places in FIELDS]
+    else:
+        expressions = [f"{name}{source} / {10 ** places}.0" for name, places in FIELDS]
+    assignments = ', '.join(f"{name}{target} = {expression}" for (name, _), expression in zip(FIELDS, expressions))
+    return f"UPDATE {table} SET {assignments}"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0006_position_scaled_columns'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            copy_sql('positions_position', '', '_scaled', scaled=True),
+            reverse_sql=copy_sql('positions_position', '_scaled', '', scaled=False),
+        ),
+        migrations.RunSQL(
+            copy_sql('positions_vehiclelatestposition', '', '_scaled', scaled=True),
+            reverse_sql=copy_sql('positions_vehiclelatestposition', '_scaled', '', scaled=False),
+        ),
+    ]
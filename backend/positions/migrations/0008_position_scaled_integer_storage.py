@@ -0,0 +1,210 @@
+# Generated by Django 5.2.5 on 2026-10-17 09:12
+
+import positions.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0007_fill_position_scaled_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='position',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='longitude',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='speed',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='heading',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='altitude',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='odometer',
+        ),
+        migrations.RemoveField(
+            model_name='position',
+            name='fuel_level',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='latitude_scaled',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='longitude_scaled',
+            new_name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='speed_scaled',
+            new_name='speed',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='heading_scaled',
+            new_name='heading',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='altitude_scaled',
+            new_name='altitude',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='odometer_scaled',
+            new_name='odometer',
+        ),
+        migrations.RenameField(
+            model_name='position',
+            old_name='fuel_level_scaled',
+            new_name='fuel_level',
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='latitude',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=90),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='longitude',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=180),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='speed',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, help_text='Speed in km/h', max_digits=5),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='heading',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, help_text='Heading in degrees (0-360)', max_digits=5),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='altitude',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, help_text='Altitude in meters', max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='odometer',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, help_text='Odometer reading in km', max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='fuel_level',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, help_text='Fuel level percentage (0-100)', max_digits=5, null=True),
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='longitude',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='speed',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='heading',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='altitude',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='odometer',
+        ),
+        migrations.RemoveField(
+            model_name='vehiclelatestposition',
+            name='fuel_level',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='latitude_scaled',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='longitude_scaled',
+            new_name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='speed_scaled',
+            new_name='speed',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='heading_scaled',
+            new_name='heading',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='altitude_scaled',
+            new_name='altitude',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='odometer_scaled',
+            new_name='odometer',
+        ),
+        migrations.RenameField(
+            model_name='vehiclelatestposition',
+            old_name='fuel_level_scaled',
+            new_name='fuel_level',
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='latitude',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=90),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='longitude',
+            field=positions.fields.ScaledIntegerField(decimal_places=7, max_digits=10, max_magnitude=180),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='speed',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='heading',
+            field=positions.fields.ScaledIntegerField(decimal_places=2, max_digits=5),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='altitude',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='odometer',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vehiclelatestposition',
+            name='fuel_level',
+            field=positions.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=5, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:11
+
+import django.db.models.deletion
+import positions.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0008_position_scaled_integer_storage'),
+        ('trips', '0004_alter_tripstop_options_and_more'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleDwell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_timestamp', models.DateTimeField(help_text='Timestamp of the last position processed')),
+                ('started_at', models.DateTimeField(blank=True, help_text='First point of the current dwell', null=True)),
+                ('last_stationary_at', models.DateTimeField(blank=True, help_text='Last point of the current dwell', null=True)),
+                ('anchor_latitude', positions.fields.ScaledIntegerField(blank=True, decimal_places=7, max_digits=10, max_magnitude=90, null=True)),
+                ('anchor_longitude', positions.fields.ScaledIntegerField(blank=True, decimal_places=7, max_digits=10, max_magnitude=180, null=True)),
+                ('trip_stop', models.ForeignKey(blank=True, help_text='Stop whose arrival was stamped by the current dwell', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='trips.tripstop')),
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dwell', to='vehicles.vehicle')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0009_vehicle_dwell'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehiclelatestposition',
+            index=models.Index(fields=['latitude', 'longitude'], name='positions_v_latitud_fcb6e1_idx'),
+        ),
+    ]
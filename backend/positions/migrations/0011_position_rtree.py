@@ -0,0 +1,21 @@
+from django.db import migrations
+from dashmap.spatial import SPATIAL_INDEXES
+
+
+def install_rtree(apps, schema_editor):
+    SPATIAL_INDEXES['positions_position'].install(schema_editor.connection)
+
+
+def uninstall_rtree(apps, schema_editor):
+    SPATIAL_INDEXES['positions_position'].uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0010_latest_position_viewport_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_rtree, uninstall_rtree),
+    ]
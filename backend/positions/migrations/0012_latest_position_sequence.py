@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:51
+
+from django.db import migrations, models
+
+# Counter of the latest-position snapshots (positions/services.py)
+LATEST_POSITION_SEQUENCE = 'latest_positions'
+
+
+def number_snapshots(apps, schema_editor):
+    """Give the existing snapshots sequence numbers in the order they were last updated"""
+    VehicleLatestPosition = apps.get_model('positions', 'VehicleLatestPosition')
+    IngestSequence = apps.get_model('positions', 'IngestSequence')
+
+    snapshots = list(VehicleLatestPosition.objects.order_by('updated_at', 'id').only('id'))
+    for sequence, snapshot in enumerate(snapshots, start=1):
+        snapshot.sequence = sequence
+    VehicleLatestPosition.objects.bulk_update(snapshots, ['sequence'], batch_size=500)
+    IngestSequence.objects.create(name=LATEST_POSITION_SEQUENCE, value=len(snapshots))
+
+
+def drop_counter(apps, schema_editor):
+    IngestSequence = apps.get_model('positions', 'IngestSequence')
+    IngestSequence.objects.filter(name=LATEST_POSITION_SEQUENCE).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('positions', '0011_position_rtree'),
+        ('vehicles', '0002_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vehiclelatestposition',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(number_snapshots, drop_counter),
+        migrations.AddIndex(
+            model_name='vehiclelatestposition',
+            index=models.Index(fields=['sequence'], name='positions_v_sequenc_869a82_idx'),
+        ),
+    ]
@@ -1,16 +1,17 @@
 from django.db import models
 from vehicles.models import Vehicle
+from .fields import ScaledIntegerField
 
 class Position(models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='positions')
-    latitude = models.DecimalField(max_digits=10, decimal_places=7)
-    longitude = models.DecimalField(max_digits=10, decimal_places=7)
-    speed = models.DecimalField(max_digits=5, decimal_places=2, help_text="Speed in km/h")
-    heading = models.DecimalField(max_digits=5, decimal_places=2, help_text="Heading in degrees (0-360)")
-    altitude = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, help_text="Altitude in meters")
+    latitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=90)
+    longitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=180)
+    speed = ScaledIntegerField(max_digits=5, decimal_places=2, help_text="Speed in km/h")
+    heading = ScaledIntegerField(max_digits=5, decimal_places=2, help_text="Heading in degrees (0-360)")
+    altitude = ScaledIntegerField(max_digits=8, decimal_places=2, null=True, blank=True, help_text="Altitude in meters")
     timestamp = models.DateTimeField(help_text="Timestamp when position was recorded")
-    odometer = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Odometer reading in km")
-    fuel_level = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, help_text="Fuel level percentage (0-100)")
+    odometer = ScaledIntegerField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Odometer reading in km")
+    fuel_level = ScaledIntegerField(max_digits=5, decimal_places=2, null=True, blank=True, help_text="Fuel level percentage (0-100)")
     engine_status = models.CharField(
         max_length=20,
         choices=[
@@ -28,6 +29,195 @@ class Position(models.Model):
             models.Index(fields=['vehicle', '-timestamp']),
             models.Index(fields=['timestamp']),
         ]
+        constraints = [
+            # Devices resend points on flaky networks; a point is stored once
+            models.UniqueConstraint(fields=['vehicle', 'timestamp'], name='unique_position_per_vehicle_timestamp'),
+        ]
 
     def __str__(self):
         return f"{self.vehicle.license_plate} - {self.timestamp}"
+
+
+class VehicleLatestPosition(models.Model):
+    """Snapshot of each vehicle's most recent position, maintained on ingest"""
+
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, related_name='latest_position')
+    # Not a constraint: the snapshot outlives the history row once it is archived
+    position = models.ForeignKey(Position, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    latitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=90)
+    longitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=180)
+    speed = ScaledIntegerField(max_digits=5, decimal_places=2)
+    heading = ScaledIntegerField(max_digits=5, decimal_places=2)
+    altitude = ScaledIntegerField(max_digits=8, decimal_places=2, null=True, blank=True)
+    timestamp = models.DateTimeField()
+    odometer = ScaledIntegerField(max_digits=10, decimal_places=2, null=True, blank=True)
+    fuel_level = ScaledIntegerField(max_digits=5, decimal_places=2, null=True, blank=True)
+    engine_status = models.CharField(max_length=20, default='off')
+    created_at = models.DateTimeField(help_text="When the position was received")
+    updated_at = models.DateTimeField(auto_now=True)
+    # Ingest sequence number of the last change, for delta sync (?since=)
+    sequence = models.BigIntegerField(default=0)
+
+    SNAPSHOT_FIELDS = [
+        'latitude', 'longitude', 'speed', 'heading', 'altitude', 'timestamp',
+        'odometer', 'fuel_level', 'engine_status', 'created_at',
+    ]
+
+    @classmethod
+    def from_position(cls, position):
+        return cls(
+            vehicle_id=position.vehicle_id,
+            position_id=position.id,
+            **{field: getattr(position, field) for field in cls.SNAPSHOT_FIELDS}
+        )
+
+    class Meta:
+        indexes = [
+            # Viewport (?bbox=) queries
+            models.Index(fields=['latitude', 'longitude']),
+            # Delta sync (?since=) queries
+            models.Index(fields=['sequence']),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle.license_plate} - {self.timestamp}"
+
+
+class IngestSequence(models.Model):
+    """
+    Named counter handing out monotonically increasing sequence numbers.
+
+    Numbers are taken with the row locked until the transaction commits, so
+    they become visible in the order they were handed out.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class VehicleDwell(models.Model):
+    """
+    Dwell-detection state of a vehicle, advanced by each ingested batch.
+
+    A dwell is a run of slow points within a small radius of its first
+    point. Once it has lasted long enough near the next stop of the
+    vehicle's trip, that stop's arrival is stamped; its departure is
+    stamped when the vehicle moves away.
+    """
+
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, related_name='dwell')
+    last_timestamp = models.DateTimeField(help_text="Timestamp of the last position processed")
+    started_at = models.DateTimeField(null=True, blank=True, help_text="First point of the current dwell")
+    last_stationary_at = models.DateTimeField(null=True, blank=True, help_text="Last point of the current dwell")
+    anchor_latitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=90, null=True, blank=True)
+    anchor_longitude = ScaledIntegerField(max_digits=10, decimal_places=7, max_magnitude=180, null=True, blank=True)
+    trip_stop = models.ForeignKey(
+        'trips.TripStop',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Stop whose arrival was stamped by the current dwell",
+    )
+
+    STATE_FIELDS = [
+        'last_timestamp', 'started_at', 'last_stationary_at', 'anchor_latitude', 'anchor_longitude', 'trip_stop',
+    ]
+
+    def __str__(self):
+        return f"{self.vehicle.license_plate} - {self.started_at}"
+
+
+class VehicleGeofenceState(models.Model):
+    """Geofence-processing state of a vehicle: the positions up to last_timestamp were checked"""
+
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, related_name='geofence_state')
+    last_timestamp = models.DateTimeField(help_text="Timestamp of the last position processed")
+
+    def __str__(self):
+        return f"{self.vehicle.license_plate} - {self.last_timestamp}"
+
+
+class PositionArchive(models.Model):
+    """Manifest entry for one vehicle-day of positions moved to the cold archive"""
+
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='position_archives')
+    day = models.DateField(help_text="UTC day covered by the file")
+    path = models.CharField(max_length=255, help_text="File path relative to the archive root")
+    compression = models.CharField(max_length=10, choices=[('gzip', 'gzip'), ('zstd', 'zstd')])
+    point_count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    size_bytes = models.PositiveIntegerField(help_text="Compressed file size")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['vehicle', 'day']
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'day'], name='unique_position_archive_per_vehicle_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle.license_plate} - {self.day}"
+
+
+class PositionRollup(models.Model):
+    """
+    Aggregate of a vehicle's positions over one time bucket.
+
+    Maintained on ingest and rebuilt by the rebuild_position_rollups command.
+    A point's distance is counted in the bucket of the point that ends the
+    segment, so summing the buckets of a range gives the distance driven.
+    """
+
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='+')
+    bucket = models.DateTimeField(help_text="Start of the time bucket")
+    point_count = models.PositiveIntegerField(default=0)
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    first_latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    first_longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    last_latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    last_longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    speed_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Sum of speeds, for the average")
+    max_speed = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    distance = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Distance travelled in meters")
+    min_fuel_level = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    max_fuel_level = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    min_odometer = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_odometer = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    AGGREGATE_FIELDS = [
+        'point_count', 'first_timestamp', 'last_timestamp', 'first_latitude', 'first_longitude',
+        'last_latitude', 'last_longitude', 'speed_total', 'max_speed', 'distance',
+        'min_fuel_level', 'max_fuel_level', 'min_odometer', 'max_odometer',
+    ]
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket']
+
+    @property
+    def average_speed(self):
+        return self.speed_total / self.point_count if self.point_count else 0
+
+    def __str__(self):
+        return f"{self.vehicle.license_plate} - {self.bucket}"
+
+
+class PositionMinuteRollup(PositionRollup):
+    class Meta(PositionRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'bucket'], name='unique_minute_rollup_per_vehicle_bucket'),
+        ]
+
+
+class PositionHourRollup(PositionRollup):
+    class Meta(PositionRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'bucket'], name='unique_hour_rollup_per_vehicle_bucket'),
+        ]
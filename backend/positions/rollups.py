@@ -0,0 +1,195 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import List, Dict, Iterable, Optional, Tuple
+from django.db import transaction
+from .archive import ARCHIVE_FIELDS
+from .history import position_rows, previous_position_row
+from .models import Position, VehicleLatestPosition, PositionMinuteRollup, PositionHourRollup
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Bucket size of each rollup table
+ROLLUP_MODELS = (
+    (PositionMinuteRollup, timedelta(minutes=1)),
+    (PositionHourRollup, timedelta(hours=1)),
+)
+
+POINT_FIELDS = ('timestamp', 'latitude', 'longitude', 'speed', 'fuel_level', 'odometer')
+
+
+def haversine(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """Great-circle distance in meters between two WGS84 coordinates"""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def bucket_start(timestamp: datetime, size: timedelta) -> datetime:
+    """Start of the UTC minute or hour bucket containing ``timestamp``"""
+    timestamp = timestamp.astimezone(dt_timezone.utc)
+    if size >= timedelta(hours=1):
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def _decimal(value) -> Optional[Decimal]:
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _add_point(rollup, point: Tuple, previous: Optional[Tuple]) -> None:
+    timestamp, latitude, longitude, speed, fuel_level, odometer = point
+    latitude, longitude, speed = _decimal(latitude), _decimal(longitude), _decimal(speed)
+    fuel_level, odometer = _decimal(fuel_level), _decimal(odometer)
+
+    if not rollup.point_count:
+        rollup.first_timestamp = timestamp
+        rollup.first_latitude, rollup.first_longitude = latitude, longitude
+    rollup.point_count += 1
+    rollup.last_timestamp = timestamp
+    rollup.last_latitude, rollup.last_longitude = latitude, longitude
+    rollup.speed_total = _decimal(rollup.speed_total) + speed
+    rollup.max_speed = max(_decimal(rollup.max_speed), speed)
+
+    if previous is not None:
+        meters = haversine(float(previous[1]), float(previous[2]), float(latitude), float(longitude))
+        rollup.distance = _decimal(rollup.distance) + Decimal(f"{meters:.2f}")
+
+    if fuel_level is not None:
+        rollup.min_fuel_level = fuel_level if rollup.min_fuel_level is None else min(rollup.min_fuel_level, fuel_level)
+        rollup.max_fuel_level = fuel_level if rollup.max_fuel_level is None else max(rollup.max_fuel_level, fuel_level)
+    if odometer is not None:
+        rollup.min_odometer = odometer if rollup.min_odometer is None else min(rollup.min_odometer, odometer)
+        rollup.max_odometer = odometer if rollup.max_odometer is None else max(rollup.max_odometer, odometer)
+
+
+def _accumulate(model, size: timedelta, vehicle_id: int, points: List[Tuple], previous: Optional[Tuple],
+                rollups: Dict[Tuple[int, datetime], object]) -> None:
+    """Fold time-ordered points into ``rollups``, creating missing buckets"""
+    for point in points:
+        key = (vehicle_id, bucket_start(point[0], size))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = model(vehicle_id=vehicle_id, bucket=key[1], point_count=0)
+        _add_point(rollup, point, previous)
+        previous = point
+
+
+def _save_rollups(model, rollups: Iterable) -> None:
+    model.objects.bulk_create(
+        list(rollups),
+        update_conflicts=True,
+        unique_fields=['vehicle', 'bucket'],
+        update_fields=model.AGGREGATE_FIELDS,
+    )
+
+
+def update_rollups(positions: List[Position]) -> None:
+    """
+    Fold newly stored positions into the minute and hour rollups.
+
+    Must run in the ingest transaction before the latest-position snapshots
+    are updated: a vehicle's snapshot is the point preceding the new ones.
+    When every new point of a vehicle is newer than its snapshot, which is
+    how devices normally report, the points are merged into the vehicle's
+    current buckets. Late points change the distance of the buckets after
+    them, so the buckets they touch are rebuilt from the positions instead.
+
+    Args:
+        positions: Positions stored by this transaction
+    """
+    points_by_vehicle = defaultdict(list)
+    for position in positions:
+        points_by_vehicle[position.vehicle_id].append(tuple(getattr(position, field) for field in POINT_FIELDS))
+    if not points_by_vehicle:
+        return
+
+    previous_points = {
+        vehicle_id: (timestamp, latitude, longitude)
+        for vehicle_id, timestamp, latitude, longitude in VehicleLatestPosition.objects.filter(
+            vehicle_id__in=points_by_vehicle
+        ).values_list('vehicle_id', 'timestamp', 'latitude', 'longitude')
+    }
+
+    in_order = {}
+    for vehicle_id, points in points_by_vehicle.items():
+        points.sort(key=lambda point: point[0])
+        previous = previous_points.get(vehicle_id)
+        if previous is None or points[0][0] > previous[0]:
+            in_order[vehicle_id] = points
+        else:
+            rebuild_late_rollups(vehicle_id, points[0][0], points[-1][0])
+
+    if not in_order:
+        return
+
+    for model, size in ROLLUP_MODELS:
+        # Only each vehicle's most recent bucket can already hold some of these points
+        current_buckets = {
+            (vehicle_id, bucket_start(points[0][0], size)) for vehicle_id, points in in_order.items()
+        }
+        rollups = {
+            (rollup.vehicle_id, rollup.bucket): rollup
+            for rollup in model.objects.filter(
+                vehicle_id__in=in_order, bucket__gte=min(bucket for _, bucket in current_buckets)
+            )
+            if (rollup.vehicle_id, rollup.bucket) in current_buckets
+        }
+        for vehicle_id, points in in_order.items():
+            _accumulate(model, size, vehicle_id, points, previous_points.get(vehicle_id), rollups)
+        _save_rollups(model, rollups.values())
+
+
+def rebuild_late_rollups(vehicle_id: int, first_timestamp: datetime, last_timestamp: datetime) -> None:
+    """Rebuild the buckets touched by late points, up to the point that follows them"""
+    following = (
+        Position.objects.filter(vehicle_id=vehicle_id, timestamp__gt=last_timestamp)
+        .order_by('timestamp')
+        .values_list('timestamp', flat=True)
+        .first()
+    )
+    end = following or last_timestamp
+    rebuild_rollups(
+        vehicle_id,
+        bucket_start(first_timestamp, timedelta(hours=1)),
+        bucket_start(end, timedelta(hours=1)) + timedelta(hours=1),
+    )
+
+
+def rebuild_rollups(vehicle_id: int, start: datetime, end: datetime) -> int:
+    """
+    Recompute a vehicle's minute and hour rollups from its positions.
+
+    Args:
+        vehicle_id: Vehicle whose rollups to rebuild
+        start: Start of the range, aligned on an hour
+        end: End of the range (exclusive), aligned on an hour
+
+    Returns:
+        Number of positions aggregated
+    """
+    # Archived days are read back from their files, so rebuilding old ranges keeps their rollups
+    previous = previous_position_row(vehicle_id, start)
+    if previous is not None:
+        previous = tuple(previous[ARCHIVE_FIELDS.index(field)] for field in ('timestamp', 'latitude', 'longitude'))
+    columns = [ARCHIVE_FIELDS.index(field) for field in POINT_FIELDS]
+    points = [tuple(row[column] for column in columns) for row in position_rows(vehicle_id, start, end)]
+
+    rebuilt = []
+    for model, size in ROLLUP_MODELS:
+        rollups = {}
+        _accumulate(model, size, vehicle_id, points, previous, rollups)
+        rebuilt.append((model, rollups.values()))
+
+    # Reads first, then a short write transaction: SQLite cannot upgrade a
+    # read transaction while another process holds the write lock
+    with transaction.atomic():
+        for model, rollups in rebuilt:
+            model.objects.filter(vehicle_id=vehicle_id, bucket__gte=start, bucket__lt=end).delete()
+            model.objects.bulk_create(list(rollups))
+    return len(points)
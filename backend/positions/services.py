@@ -0,0 +1,631 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from datetime import datetime
+import base64
+import binascii
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+from .fields import from_scaled, to_scaled
+from .models import IngestSequence, Position, PositionArchive, VehicleLatestPosition
+from .buffer import get_position_buffer
+from .dedup import recent_position_keys
+from .fleet_state import get_fleet_state
+from .rollups import update_rollups
+from .dwell import detect_dwells
+from .geofence import process_geofences
+from .stream import positions_committed
+from .history import archive_chunk_cache, iter_archived_positions, merge_newest_first
+from vehicles.models import Vehicle
+from trips.models import TripStop
+from dashmap.bbox import BoundingBox
+from dashmap.realtime import publish_positions, publish_trip_stops
+from dashmap.spatial import filter_bbox
+
+
+REQUIRED_DECIMAL_FIELDS = ('latitude', 'longitude', 'speed', 'heading')
+OPTIONAL_DECIMAL_FIELDS = ('altitude', 'odometer', 'fuel_level')
+
+# Physical bounds checked on top of the model field precision
+FIELD_BOUNDS = {
+    'latitude': (-90, 90),
+    'longitude': (-180, 180),
+    'heading': (0, 360),
+    'fuel_level': (0, 100),
+}
+
+# Number of NDJSON lines validated and stored per transaction
+NDJSON_CHUNK_SIZE = 500
+
+# Maximum number of line errors echoed back for an NDJSON upload
+MAX_REPORTED_ERRORS = 100
+
+# Page size of the position history, and the largest one a client may ask for
+DEFAULT_HISTORY_LIMIT = 500
+MAX_HISTORY_LIMIT = 5000
+
+# IngestSequence numbering the changes of latest-position snapshots
+LATEST_POSITION_SEQUENCE = 'latest_positions'
+
+ENGINE_STATUSES = {choice for choice, _ in Position._meta.get_field('engine_status').choices}
+
+
+class PositionValidationError(ValidationError):
+    """Validation error for a single incoming position payload"""
+
+    pass
+
+
+def parse_timestamp(value) -> datetime:
+    """
+    Parse an ISO 8601 timestamp, defaulting to the current time.
+
+    Args:
+        value: ISO 8601 string (a trailing 'Z' is accepted) or None
+
+    Returns:
+        Timezone-aware datetime
+
+    Raises:
+        PositionValidationError: If the value is not a valid ISO 8601 timestamp
+    """
+    if not value:
+        return timezone.now()
+
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise PositionValidationError(f"Invalid timestamp '{value}'")
+
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def clean_number(data: Dict[str, Any], name: str, required: bool = True) -> Optional[float]:
+    """
+    Convert a payload value to a number matching the Position field precision.
+
+    The value is rounded to the field's decimal places, so that what is
+    validated is exactly what the scaled integer column stores.
+
+    Args:
+        data: The position payload
+        name: Name of the Position field to clean
+        required: Whether a missing value is an error
+
+    Returns:
+        Float value, or None for a missing optional value
+
+    Raises:
+        PositionValidationError: If the value is missing, not numeric or out of range
+    """
+    value = data.get(name)
+    if value is None:
+        if required:
+            raise PositionValidationError(f"Missing required field '{name}'")
+        return None
+
+    field = Position._meta.get_field(name)
+    try:
+        # JSON numbers arrive as int or float; anything else must parse as a decimal string
+        number = value if isinstance(value, (int, float)) and not isinstance(value, bool) else Decimal(str(value))
+        scaled = to_scaled(number, field.decimal_places)
+    except (InvalidOperation, OverflowError, ValueError, TypeError):
+        raise PositionValidationError(f"Invalid value for '{name}': {value!r}")
+
+    value = from_scaled(scaled, field.decimal_places)
+    if abs(scaled) >= 10 ** field.max_digits:
+        raise PositionValidationError(f"Value out of range for '{name}': {value}")
+
+    bounds = FIELD_BOUNDS.get(name)
+    if bounds and not bounds[0] <= value <= bounds[1]:
+        raise PositionValidationError(
+            f"Value out of range for '{name}': {value} (expected {bounds[0]} to {bounds[1]})"
+        )
+    return value
+
+
+def build_position(data: Dict[str, Any], known_vehicle_ids: Set[int]) -> Position:
+    """
+    Validate a position payload and build an unsaved Position instance.
+
+    Args:
+        data: The position payload, as documented for POST /api/positions/
+        known_vehicle_ids: IDs of the vehicles that exist
+
+    Returns:
+        Unsaved Position instance
+
+    Raises:
+        PositionValidationError: If the payload is invalid or the vehicle does not exist
+    """
+    if not isinstance(data, dict):
+        raise PositionValidationError('Position must be a JSON object')
+
+    if data.get('vehicle_id') is None:
+        raise PositionValidationError("Missing required field 'vehicle_id'")
+    # bool first: it is also an int, and True would be vehicle 1
+    if isinstance(data['vehicle_id'], bool):
+        raise PositionValidationError(f"Invalid vehicle_id {data['vehicle_id']!r}")
+    try:
+        vehicle_id = int(data['vehicle_id'])
+    except (TypeError, ValueError):
+        raise PositionValidationError(f"Invalid vehicle_id {data['vehicle_id']!r}")
+    if vehicle_id not in known_vehicle_ids:
+        raise PositionValidationError('Vehicle not found')
+
+    values = {name: clean_number(data, name) for name in REQUIRED_DECIMAL_FIELDS}
+    values.update({name: clean_number(data, name, required=False) for name in OPTIONAL_DECIMAL_FIELDS})
+
+    engine_status = data.get('engine_status', 'off')
+    if engine_status not in ENGINE_STATUSES:
+        raise PositionValidationError(f"Invalid engine_status '{engine_status}'")
+
+    return Position(
+        vehicle_id=vehicle_id,
+        timestamp=parse_timestamp(data.get('timestamp')),
+        engine_status=engine_status,
+        **values
+    )
+
+
+def resolve_vehicle_ids(vehicle_ids: Iterable[Any]) -> Set[int]:
+    """
+    Resolve which of the given vehicle IDs exist, in a single query.
+
+    Args:
+        vehicle_ids: Raw vehicle IDs taken from position payloads
+
+    Returns:
+        Set of the IDs that belong to an existing vehicle
+    """
+    candidate_ids = set()
+    for vehicle_id in vehicle_ids:
+        try:
+            candidate_ids.add(int(vehicle_id))
+        except (TypeError, ValueError):
+            continue
+
+    if not candidate_ids:
+        return set()
+    return set(Vehicle.objects.filter(id__in=candidate_ids).values_list('id', flat=True))
+
+
+def position_key(position: Position) -> Tuple[int, datetime]:
+    """Return the (vehicle_id, timestamp) key that identifies a position"""
+    return (position.vehicle_id, position.timestamp)
+
+
+def exclude_stored_positions(positions: List[Position]) -> Tuple[List[Position], List[Position]]:
+    """
+    Split positions into new ones and duplicates of already stored positions.
+
+    Duplicates within the list itself are detected too. The database is
+    checked with one query over the (vehicle, timestamp) range of the batch,
+    and the archived vehicle-days overlapping that range with another.
+
+    Args:
+        positions: Unsaved Position instances
+
+    Returns:
+        Tuple of (new positions, duplicate positions)
+    """
+    if not positions:
+        return [], []
+
+    timestamps = [position.timestamp for position in positions]
+    vehicle_ids = {position.vehicle_id for position in positions}
+    stored_keys = set(
+        Position.objects.filter(
+            vehicle_id__in=vehicle_ids,
+            timestamp__gte=min(timestamps),
+            timestamp__lte=max(timestamps),
+        ).order_by().values_list('vehicle_id', 'timestamp')
+    )
+    # Archived points are no longer in the table, so its unique constraint cannot catch them
+    archives = PositionArchive.objects.filter(
+        vehicle_id__in=vehicle_ids,
+        last_timestamp__gte=min(timestamps),
+        first_timestamp__lte=max(timestamps),
+    )
+    for archive in archives:
+        stored_keys.update((archive.vehicle_id, row[1]) for row in archive_chunk_cache.get(archive))
+
+    fresh = []
+    duplicates = []
+    for position in positions:
+        key = position_key(position)
+        if key in stored_keys:
+            duplicates.append(position)
+        else:
+            stored_keys.add(key)
+            fresh.append(position)
+    return fresh, duplicates
+
+
+def assign_stored_ids(positions: List[Position]) -> None:
+    """Set the primary keys of positions inserted without them, in one query"""
+    if not positions:
+        return
+
+    timestamps = [position.timestamp for position in positions]
+    stored_ids = {
+        (vehicle_id, timestamp): position_id
+        for vehicle_id, timestamp, position_id in Position.objects.filter(
+            vehicle_id__in={position.vehicle_id for position in positions},
+            timestamp__gte=min(timestamps),
+            timestamp__lte=max(timestamps),
+        ).order_by().values_list('vehicle_id', 'timestamp', 'id')
+    }
+    for position in positions:
+        position.id = stored_ids.get(position_key(position))
+
+
+def next_sequence(name: str, count: int = 1) -> int:
+    """
+    Take ``count`` numbers from a named IngestSequence.
+
+    The counter row stays locked until the current transaction commits, so
+    concurrent writers take and publish their numbers one after the other
+    and a reader never sees a number before all lower ones are visible.
+
+    Returns:
+        The last number taken; the numbers are the ``count`` up to and including it
+    """
+    with transaction.atomic():
+        counter, _ = IngestSequence.objects.select_for_update().get_or_create(name=name)
+        counter.value += count
+        counter.save(update_fields=['value'])
+        return counter.value
+
+
+def update_latest_positions(positions: List[Position]) -> List[VehicleLatestPosition]:
+    """
+    Upsert the latest-position snapshot of each vehicle from newly stored positions.
+
+    A vehicle's snapshot is only replaced when the incoming position is newer,
+    so late-arriving points from buffered devices never move a vehicle back.
+    Each written snapshot gets a new number from the LATEST_POSITION_SEQUENCE
+    counter, which delta sync (/api/positions/latest/?since=) reads from.
+
+    Args:
+        positions: Stored Position instances (with primary keys)
+
+    Returns:
+        The snapshots that were written
+    """
+    newest = {}
+    for position in positions:
+        current = newest.get(position.vehicle_id)
+        if current is None or position.timestamp > current.timestamp:
+            newest[position.vehicle_id] = position
+
+    if not newest:
+        return []
+
+    stored_timestamps = dict(
+        VehicleLatestPosition.objects.filter(vehicle_id__in=newest.keys()).values_list('vehicle_id', 'timestamp')
+    )
+    snapshots = [
+        VehicleLatestPosition.from_position(position)
+        for vehicle_id, position in newest.items()
+        if vehicle_id not in stored_timestamps or position.timestamp > stored_timestamps[vehicle_id]
+    ]
+    if not snapshots:
+        return []
+
+    last_sequence = next_sequence(LATEST_POSITION_SEQUENCE, len(snapshots))
+    for sequence, snapshot in enumerate(snapshots, start=last_sequence - len(snapshots) + 1):
+        snapshot.sequence = sequence
+
+    return VehicleLatestPosition.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['vehicle'],
+        update_fields=['position', 'updated_at', 'sequence', *VehicleLatestPosition.SNAPSHOT_FIELDS],
+    )
+
+
+def save_positions(positions: List[Position]) -> Dict[str, List[Position]]:
+    """
+    Store validated positions in a single transaction, skipping duplicates.
+
+    This is the single write path for position ingest: every endpoint that
+    accepts positions goes through it, directly or via the write-behind buffer.
+    Positions whose (vehicle, timestamp) is already stored are skipped, which
+    makes ingest idempotent for devices that retry. The minute and hour
+    rollups, the latest-position snapshots and the dwell detection are
+    updated in the same transaction.
+
+    Args:
+        positions: Unsaved Position instances, e.g. from build_position()
+
+    Returns:
+        Dict with 'stored' and 'duplicates' lists of Position instances
+    """
+    if not positions:
+        return {'stored': [], 'duplicates': []}
+
+    with transaction.atomic():
+        fresh, duplicates = exclude_stored_positions(positions)
+        try:
+            with transaction.atomic():
+                Position.objects.bulk_create(fresh)
+        except IntegrityError:
+            # A concurrent writer stored some of these points after the check
+            # above. SQLite serializes writers, so only other databases get here.
+            fresh, raced = exclude_stored_positions(fresh)
+            duplicates += raced
+            Position.objects.bulk_create(fresh, ignore_conflicts=True)
+            assign_stored_ids(fresh)
+
+        # Reads the snapshots as they were before this batch
+        update_rollups(fresh)
+        update_latest_positions(fresh)
+        stamped = detect_dwells(fresh)
+        # After dwells, whose departures are more precise than geofence exits
+        fenced = process_geofences(fresh)
+        stamped_trip_stops = {*stamped, *fenced['arrived'], *fenced['completed']}
+        if stamped_trip_stops:
+            # Imported here: the change log takes its IDs from next_sequence() above
+            from changes.services import record_updates
+            record_updates(TripStop, stamped_trip_stops)
+            publish_trip_stops(stamped_trip_stops)
+
+        keys = [position_key(position) for position in positions]
+        transaction.on_commit(lambda: recent_position_keys.add_many(keys))
+
+        fleet_state = get_fleet_state()
+        if fleet_state is not None:
+            transaction.on_commit(lambda: fleet_state.apply(fresh))
+        transaction.on_commit(lambda: positions_committed(fresh))
+        transaction.on_commit(lambda: publish_positions(fresh))
+
+    return {'stored': fresh, 'duplicates': duplicates}
+
+
+def store_positions(positions: List[Position]) -> Dict[str, Any]:
+    """
+    Store positions, through the write-behind buffer when it is enabled.
+
+    Retries of recently stored positions are dropped in memory first. When
+    the positions are committed before returning, duplicates found in the
+    database are reported as well.
+
+    Args:
+        positions: Unsaved Position instances, e.g. from build_position()
+
+    Returns:
+        Dict with 'queued' (True if the positions were handed to the
+        write-behind buffer), 'stored' and 'duplicates' lists of Position
+        instances. 'stored' is empty when the positions were queued.
+    """
+    fresh = []
+    duplicates = []
+    for position in positions:
+        if position_key(position) in recent_position_keys:
+            duplicates.append(position)
+        else:
+            fresh.append(position)
+
+    buffer = get_position_buffer()
+    if buffer is not None and buffer.submit(fresh):
+        return {'queued': True, 'stored': [], 'duplicates': duplicates}
+
+    result = save_positions(fresh)
+    return {'queued': False, 'stored': result['stored'], 'duplicates': duplicates + result['duplicates']}
+
+
+def ingest_positions(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Validate and store a batch of position payloads for any number of vehicles.
+
+    Vehicles are resolved with one query and all valid positions are inserted
+    in one transaction. Invalid items are rejected without affecting the others.
+
+    Args:
+        items: Position payloads
+
+    Returns:
+        One result dict per item, in input order, with 'index', 'status'
+        ('accepted', 'duplicate' or 'rejected') and 'error' for rejected items
+    """
+    known_vehicle_ids = resolve_vehicle_ids(
+        item.get('vehicle_id') for item in items if isinstance(item, dict)
+    )
+
+    results = []
+    positions = []
+    for index, item in enumerate(items):
+        try:
+            position = build_position(item, known_vehicle_ids)
+        except PositionValidationError as e:
+            results.append({'index': index, 'status': 'rejected', 'error': e.message})
+            continue
+        positions.append(position)
+        results.append({'index': index, 'status': 'accepted', 'position': position})
+
+    duplicates = {id(position) for position in store_positions(positions)['duplicates']}
+    for result in results:
+        position = result.pop('position', None)
+        if id(position) in duplicates:
+            result['status'] = 'duplicate'
+    return results
+
+
+def ingest_position_stream(lines: Iterable[bytes], chunk_size: int = NDJSON_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Validate and store newline-delimited JSON positions with bounded memory.
+
+    Lines are consumed lazily and stored in chunks of ``chunk_size``, each in
+    its own transaction, so memory use does not depend on the upload size.
+    Malformed or invalid lines are reported and skipped.
+
+    Args:
+        lines: Iterable of raw lines, one JSON position object per line
+        chunk_size: Number of positions stored per transaction
+
+    Returns:
+        Dict with 'accepted', 'duplicates' and 'rejected' counts and 'errors',
+        a list of at most MAX_REPORTED_ERRORS dicts with 'line' and 'error'
+    """
+    summary = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line_number, error):
+        summary['rejected'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': error})
+
+    def flush(pending):
+        results = ingest_positions([item for _, item in pending])
+        for (line_number, _), result in zip(pending, results):
+            if result['status'] == 'accepted':
+                summary['accepted'] += 1
+            elif result['status'] == 'duplicate':
+                summary['duplicates'] += 1
+            else:
+                reject(line_number, result['error'])
+
+    pending = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            pending.append((line_number, json.loads(line)))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            reject(line_number, f'Invalid JSON: {str(e)}')
+            continue
+
+        if len(pending) >= chunk_size:
+            flush(pending)
+            pending = []
+
+    if pending:
+        flush(pending)
+    return summary
+
+
+def encode_history_cursor(position: Position) -> str:
+    """Opaque cursor pointing just past ``position`` in the history order"""
+    raw = f"{position.timestamp.isoformat()}|{position.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor returned by encode_history_cursor().
+
+    Returns:
+        (timestamp, id) of the last position of the previous page
+
+    Raises:
+        PositionValidationError: If the cursor is malformed
+    """
+    try:
+        timestamp, position_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(position_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise PositionValidationError(f"Invalid cursor '{cursor}'")
+
+
+def position_history_queryset(
+    vehicle_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    bbox: Optional[BoundingBox] = None,
+):
+    """
+    Positions in a time range, newest first, ordered by (timestamp, id).
+
+    Args:
+        vehicle_id: Only return positions of this vehicle
+        since: Only return positions at or after this time
+        until: Only return positions strictly before this time
+        bbox: Only return positions within this area, looked up in the R*Tree
+
+    Returns:
+        Position queryset with the vehicle selected
+    """
+    positions = Position.objects.select_related('vehicle').order_by('-timestamp', '-id')
+    if vehicle_id is not None:
+        positions = positions.filter(vehicle_id=vehicle_id)
+    if since is not None:
+        positions = positions.filter(timestamp__gte=since)
+    if until is not None:
+        positions = positions.filter(timestamp__lt=until)
+    if bbox is not None:
+        positions = filter_bbox(positions, bbox)
+    return positions
+
+
+def position_history(
+    vehicle_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_HISTORY_LIMIT,
+    bbox: Optional[BoundingBox] = None,
+) -> Tuple[List[Position], Optional[str]]:
+    """
+    Return one page of position history, newest first.
+
+    Pages are keyed on (timestamp, id) instead of an offset: each page starts
+    with an index range scan right after the previous page's last row, so
+    its cost does not grow with how deep into the history the client is.
+    Archived positions are merged in transparently.
+
+    Args:
+        vehicle_id: Only return positions of this vehicle
+        since: Only return positions at or after this time
+        until: Only return positions strictly before this time
+        cursor: next_cursor of the previous page
+        limit: Page size, capped to MAX_HISTORY_LIMIT
+        bbox: Only return positions within this area
+
+    Returns:
+        (positions, next_cursor); next_cursor is None on the last page
+
+    Raises:
+        PositionValidationError: If the cursor is malformed
+    """
+    limit = min(limit, MAX_HISTORY_LIMIT)
+    positions = position_history_queryset(vehicle_id, since, until, bbox)
+    before = None
+    if cursor:
+        before = decode_history_cursor(cursor)
+        timestamp, position_id = before
+        # The plain bound lets the database seek the timestamp index; the
+        # id tie-break only applies to positions sharing the boundary timestamp
+        positions = positions.filter(timestamp__lte=timestamp).filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=position_id)
+        )
+
+    # Older ranges live in the archive; only the days overlapping the page are decoded
+    archived = iter_archived_positions(vehicle_id, since, until, before, bbox)
+    page = list(itertools.islice(merge_newest_first(positions[:limit + 1], archived), limit + 1))
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_history_cursor(page[-1])
+
+
+def iter_position_history(
+    vehicle_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk_size: int = DEFAULT_HISTORY_LIMIT,
+    bbox: Optional[BoundingBox] = None,
+) -> Iterator[Position]:
+    """
+    Iterate over all positions in a time range, newest first, including archived ones.
+
+    Rows are read from the table in chunks of ``chunk_size`` and archive
+    files one vehicle-day at a time, so memory use does not depend on the
+    size of the range.
+    """
+    positions = position_history_queryset(vehicle_id, since, until, bbox).iterator(chunk_size=chunk_size)
+    return merge_newest_first(positions, iter_archived_positions(vehicle_id, since, until, bbox=bbox))
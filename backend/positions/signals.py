@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from orders.models import Stop
+from trips.models import Trip, TripStop
+from .geofence import trips_changed
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def trip_changed(sender, instance, **kwargs):
+    trips_changed([instance.id])
+
+
+@receiver([post_save, post_delete], sender=TripStop)
+def trip_stop_changed(sender, instance, **kwargs):
+    trips_changed([instance.trip_id])
+
+
+@receiver(post_save, sender=Stop)
+def stop_changed(sender, instance, **kwargs):
+    # Moving a stop moves the fences of the trips visiting it
+    trips_changed(TripStop.objects.filter(stop=instance).values_list('trip_id', flat=True))
@@ -0,0 +1,126 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from .models import Position
+
+# Positions sent per query when a client resumes far behind
+STREAM_BATCH_SIZE = 500
+
+
+class PositionNotifier:
+    """
+    Wakes the position streams of this process when positions are committed.
+
+    Streams wait on the notifier instead of polling the database in a tight
+    loop. Positions committed by other processes do not notify it; streams
+    pick those up when their wait times out, every ``poll_interval`` seconds.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Number of commits published so far
+        self.generation = 0
+
+    def publish(self) -> None:
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation: int, timeout: float) -> bool:
+        """
+        Block until a commit is published after ``generation`` was read.
+
+        Returns:
+            Whether one was, rather than the timeout expiring
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.generation > generation, timeout=max(timeout, 0))
+
+
+position_notifier = PositionNotifier()
+
+
+def positions_committed(positions) -> None:
+    """Wake the streams waiting for new positions; called once the ingest transaction commits"""
+    if positions:
+        position_notifier.publish()
+
+
+def stream_settings() -> Dict[str, float]:
+    config = getattr(settings, 'POSITION_STREAM', {})
+    return {
+        'heartbeat_interval': config.get('HEARTBEAT_INTERVAL', 15),
+        'poll_interval': config.get('POLL_INTERVAL', 1.0),
+        'max_duration': config.get('MAX_DURATION', 300),
+        'retry': config.get('RETRY', 3000),
+    }
+
+
+def latest_position_id() -> int:
+    return Position.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+
+def iter_position_events(
+    company_id: int,
+    last_id: Optional[int],
+    serialize: Callable[[Position], Dict[str, Any]],
+    heartbeat_interval: float = 15,
+    poll_interval: float = 1.0,
+    max_duration: float = 300,
+    retry: int = 3000,
+) -> Iterator[str]:
+    """
+    Server-Sent Events of the positions stored for a company's vehicles.
+
+    Each event carries one position, with its ID as the event ID, so a
+    client reconnecting with ``Last-Event-ID`` receives exactly the positions
+    it missed. Without one, only positions stored from now on are sent. A
+    comment line is sent after ``heartbeat_interval`` seconds without
+    events, so proxies keep the connection open. The stream ends after
+    ``max_duration`` seconds, freeing the worker; clients reconnect after
+    ``retry`` milliseconds and resume where they left off.
+
+    Args:
+        company_id: Company whose vehicles' positions are sent
+        last_id: ID of the last position the client received, if resuming
+        serialize: Function turning a position into its event data
+    """
+    encoder = DjangoJSONEncoder()
+    if last_id is None:
+        last_id = latest_position_id()
+    started_at = last_event_at = time.monotonic()
+
+    yield f'retry: {retry}\n\n'
+    while True:
+        # Taken before the query, so positions committed while it runs wake the wait below
+        generation = position_notifier.generation
+        positions = list(
+            Position.objects.select_related('vehicle')
+            .filter(id__gt=last_id, vehicle__company_id=company_id)
+            .order_by('id')[:STREAM_BATCH_SIZE]
+        )
+        if positions:
+            yield ''.join(
+                f'id: {position.id}\nevent: position\ndata: {encoder.encode(serialize(position))}\n\n'
+                for position in positions
+            )
+            last_id = positions[-1].id
+            last_event_at = time.monotonic()
+            if len(positions) == STREAM_BATCH_SIZE:
+                continue
+
+        now = time.monotonic()
+        if now - started_at >= max_duration:
+            return
+        if now - last_event_at >= heartbeat_interval:
+            yield ': heartbeat\n\n'
+            last_event_at = now
+
+        # Positions of other companies wake the stream too; the query skips them
+        position_notifier.wait(
+            generation,
+            min(poll_interval, max_duration - (now - started_at), heartbeat_interval - (now - last_event_at)),
+        )
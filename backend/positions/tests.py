@@ -1,12 +1,53 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, IntegrityError
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+import ast
+import asyncio
 import json
+import math
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+import tempfile
+import threading
+import time
+from accounts.models import UserProfile
 from companies.models import Company
 from vehicles.models import Vehicle
-from .models import Position
+from orders.models import Order, Stop
+from trips.models import Trip, TripStop
+from unittest.mock import patch
+from .models import (
+    Position, VehicleLatestPosition, PositionMinuteRollup, PositionHourRollup, PositionArchive, VehicleDwell,
+)
+from .services import ingest_position_stream, save_positions
+from . import buffer as buffer_module
+from .dedup import RecentPositionKeys, recent_position_keys
+from .buffer import PositionWriteBuffer, get_position_buffer
+from . import fleet_state as fleet_state_module
+from .fleet_state import FleetState, VehicleTrack
+from .tracks import douglas_peucker, zoom_tolerance
+from .rollups import haversine
+from .archive import archive_positions, encode_positions, decode_positions, read_archive, ARCHIVE_FIELDS
+from .history import ArchiveChunkCache, archive_chunk_cache
+from .export import EXPORT_DTYPE, EXPORT_RECORD
+from .distance import segment_distances
+from . import geofence as geofence_module
+from .stream import PositionNotifier, position_notifier
+from .geofence import GeofenceIndex, get_geofence_index
+from dashmap.streaming import iter_json_results
+from dashmap.bbox import parse_bbox
+from dashmap.spatial import SPATIAL_INDEXES, filter_bbox, within_radius
+from dashmap.realtime import CLOSE_NO_COMPANY, CLOSE_UNAUTHORIZED, Subscription, company_topic, event_hub
 from test_utils import AuthenticatedTestMixin
+from asgiref.testing import ApplicationCommunicator
+from dashmap.asgi import application as asgi_application
 
 class PositionAPITestCase(TestCase, AuthenticatedTestMixin):
     def setUp(self):
@@ -263,6 +304,106 @@ class PositionAPITestCase(TestCase, AuthenticatedTestMixin):
         for i in range(len(timestamps) - 1):
             self.assertGreaterEqual(timestamps[i], timestamps[i + 1])
 
+    def test_positions_history_paginates_with_cursor(self):
+        start = datetime(2024, 1, 15, 14, 0, tzinfo=dt_timezone.utc)
+        save_positions([
+            Position(vehicle=self.vehicle, latitude=40.0, longitude=-73.0, speed=10.0, heading=0.0,
+                     timestamp=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+
+        timestamps = []
+        url = f'/api/positions/?vehicle={self.vehicle.id}&until=2024-01-15T15:00:00Z&limit=2'
+        while url:
+            data = self.authenticated_request('GET', url).json()
+            self.assertLessEqual(len(data['results']), 2)
+            timestamps += [position['timestamp'] for position in data['results']]
+            cursor = data['next_cursor']
+            url = f'/api/positions/?vehicle={self.vehicle.id}&until=2024-01-15T15:00:00Z&limit=2&cursor={cursor}' if cursor else None
+
+        self.assertEqual(timestamps, [(start + timedelta(minutes=i)).isoformat() for i in range(4, -1, -1)])
+
+    def test_positions_history_time_range(self):
+        start = datetime(2024, 1, 15, 14, 0, tzinfo=dt_timezone.utc)
+        save_positions([
+            Position(vehicle=self.vehicle, latitude=40.0, longitude=-73.0, speed=10.0, heading=0.0,
+                     timestamp=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+
+        response = self.authenticated_request(
+            'GET', '/api/positions/?since=2024-01-15T14:01:00Z&until=2024-01-15T14:03:00Z'
+        )
+        data = response.json()
+        self.assertEqual([p['timestamp'] for p in data['results']], [
+            '2024-01-15T14:02:00+00:00',
+            '2024-01-15T14:01:00+00:00',
+        ])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_positions_history_ties_on_timestamp(self):
+        other_vehicle = Vehicle.objects.create(
+            company=self.company, license_plate='TIE-001', make='Iveco', model='Daily',
+            year=2020, capacity=3.0, driver_name='Tie Driver', driver_email='tie@example.com'
+        )
+        timestamp = datetime(2024, 1, 15, 14, 0, tzinfo=dt_timezone.utc)
+        for vehicle in (self.vehicle, other_vehicle):
+            Position.objects.create(vehicle=vehicle, latitude=40.0, longitude=-73.0, speed=0.0,
+                                    heading=0.0, timestamp=timestamp)
+
+        first = self.authenticated_request('GET', '/api/positions/?until=2024-01-16T00:00:00Z&limit=1').json()
+        second = self.authenticated_request(
+            'GET', f"/api/positions/?until=2024-01-16T00:00:00Z&limit=1&cursor={first['next_cursor']}"
+        ).json()
+
+        ids = {first['results'][0]['id'], second['results'][0]['id']}
+        self.assertEqual(len(ids), 2)
+        self.assertIsNone(second['next_cursor'])
+
+    def test_positions_history_invalid_parameters(self):
+        for query in ('cursor=not-a-cursor', 'limit=0', 'limit=abc', 'since=yesterday'):
+            response = self.authenticated_request('GET', f'/api/positions/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_positions_history_limit_is_capped(self):
+        with patch('positions.services.MAX_HISTORY_LIMIT', 2):
+            save_positions([
+                Position(vehicle=self.vehicle, latitude=40.0, longitude=-73.0, speed=10.0, heading=0.0,
+                         timestamp=timezone.now() - timedelta(minutes=i + 1))
+                for i in range(3)
+            ])
+            data = self.authenticated_request('GET', '/api/positions/?limit=1000').json()
+
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_positions_history_streamed(self):
+        start = datetime(2024, 1, 15, 14, 0, tzinfo=dt_timezone.utc)
+        save_positions([
+            Position(vehicle=self.vehicle, latitude=40.0, longitude=-73.0, speed=10.0, heading=0.0,
+                     timestamp=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+
+        response = self.authenticated_request(
+            'GET', f'/api/positions/?vehicle={self.vehicle.id}&until=2024-01-16T00:00:00Z&stream=true'
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(
+            [p['timestamp'] for p in data['results']],
+            [(start + timedelta(minutes=i)).isoformat() for i in range(4, -1, -1)]
+        )
+
+    def test_iter_json_results_writes_in_chunks(self):
+        chunks = list(iter_json_results(range(5), lambda n: {'n': n}, chunk_size=2))
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(''.join(chunks)), {'results': [{'n': n} for n in range(5)]})
+        self.assertEqual(json.loads(''.join(iter_json_results([], lambda n: n))), {'results': []})
+
     def test_position_model_str_method(self):
         self.assertEqual(str(self.position), f"TEST-123 - {self.position.timestamp}")
 
@@ -277,3 +418,1726 @@ class PositionAPITestCase(TestCase, AuthenticatedTestMixin):
 
             # Should have indexes (exact names may vary by Django version)
             self.assertTrue(len(indexes) > 2)  # At least primary key + our custom indexes
+
+    def test_position_stored_as_scaled_integers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT latitude, longitude, speed, altitude, typeof(latitude) FROM positions_position WHERE id = %s",
+                [self.position.id],
+            )
+            self.assertEqual(cursor.fetchone(), (407589000, -739851000, 6000, 10000, 'integer'))
+
+        position = Position.objects.get(id=self.position.id)
+        self.assertEqual((position.latitude, position.longitude), (40.7589, -73.9851))
+        self.assertIsNone(Position.objects.filter(id=self.position.id, altitude=None).first())
+        self.assertTrue(Position.objects.filter(latitude__gte=Decimal('40.7589'), latitude__lt=40.759).exists())
+
+    def test_create_position_rounds_to_stored_precision(self):
+        payload = dict(self.position_data, latitude='48.85661236', speed=87.456, heading=True)
+        response = self.authenticated_request(
+            'POST', '/api/positions/', data=json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid value for 'heading'", response.json()['error'])
+
+        payload['heading'] = 360.006
+        response = self.authenticated_request(
+            'POST', '/api/positions/', data=json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Value out of range for 'heading'", response.json()['error'])
+
+        payload['heading'] = '359.99'
+        response = self.authenticated_request(
+            'POST', '/api/positions/', data=json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        position = Position.objects.get(vehicle=self.vehicle, timestamp='2024-01-15T14:30:00Z')
+        self.assertEqual((position.latitude, position.speed, position.heading), (48.8566124, 87.46, 359.99))
+
+    def test_bulk_create_positions(self):
+        other_vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='BULK-789',
+            make='Iveco',
+            model='Daily',
+            year=2021,
+            capacity=3.5,
+            driver_name='Bulk Driver',
+            driver_email='bulk@example.com',
+            is_active=True
+        )
+        positions = [
+            self.position_data,
+            {**self.position_data, 'vehicle_id': other_vehicle.id, 'timestamp': '2024-01-15T14:31:00Z'},
+            {**self.position_data, 'timestamp': '2024-01-15T14:32:00Z', 'engine_status': 'idle'},
+        ]
+
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data=json.dumps(positions),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['accepted'], 3)
+        self.assertEqual(data['rejected'], 0)
+        self.assertEqual([r['status'] for r in data['results']], ['accepted'] * 3)
+        self.assertEqual(Position.objects.count(), 4)
+        self.assertEqual(Position.objects.filter(vehicle=other_vehicle).count(), 1)
+
+    def test_bulk_create_positions_rejects_invalid_items(self):
+        positions = [
+            self.position_data,
+            {**self.position_data, 'vehicle_id': 99999},
+            {'vehicle_id': self.vehicle.id, 'latitude': 40.7589},
+            {**self.position_data, 'latitude': 123.0},
+            {**self.position_data, 'timestamp': 'yesterday'},
+            'not a position',
+            {**self.position_data, 'vehicle_id': True},
+        ]
+
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data=json.dumps({'positions': positions}),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(data['rejected'], 6)
+        self.assertEqual(data['results'][0], {'index': 0, 'status': 'accepted'})
+        self.assertEqual(data['results'][1]['error'], 'Vehicle not found')
+        self.assertEqual(data['results'][6]['error'], 'Invalid vehicle_id True')
+        self.assertTrue(all(r['status'] == 'rejected' for r in data['results'][1:]))
+        self.assertEqual(Position.objects.count(), 2)
+
+    def test_bulk_create_positions_uses_constant_queries(self):
+        positions = [
+            {**self.position_data, 'timestamp': f'2024-01-15T14:{minute:02d}:00Z'}
+            for minute in range(50)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                                data=json.dumps(positions),
+                                                content_type='application/json')
+
+        # One query resolves the vehicles and one statement inserts every position
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in statements if 'FROM "vehicles_vehicle"' in sql]), 1)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('INSERT INTO "positions_position"')]), 1)
+        self.assertEqual(response.json()['accepted'], 50)
+
+    def test_bulk_create_positions_invalid_payload(self):
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data=json.dumps({'vehicle_id': self.vehicle.id}),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_positions_ndjson(self):
+        lines = [
+            json.dumps({**self.position_data, 'timestamp': f'2024-01-15T15:{minute:02d}:00Z'})
+            for minute in range(7)
+        ]
+        lines.insert(2, '{"vehicle_id": ')
+        lines.insert(4, '')
+        lines.append(json.dumps({**self.position_data, 'vehicle_id': 99999}))
+
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data='\n'.join(lines) + '\n',
+                                            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['accepted'], 7)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [3, 10])
+        self.assertIn('Invalid JSON', data['errors'][0]['error'])
+        self.assertEqual(data['errors'][1]['error'], 'Vehicle not found')
+        self.assertEqual(Position.objects.count(), 8)
+
+    def test_ingest_position_stream_flushes_in_chunks(self):
+        lines = [
+            json.dumps({**self.position_data, 'timestamp': f'2024-01-15T16:{minute:02d}:00Z'}).encode()
+            for minute in range(10)
+        ]
+
+        with patch('positions.services.save_positions', wraps=save_positions) as save:
+            summary = ingest_position_stream(iter(lines), chunk_size=4)
+
+        self.assertEqual(summary, {'accepted': 10, 'duplicates': 0, 'rejected': 0, 'errors': []})
+        self.assertEqual([len(call.args[0]) for call in save.call_args_list], [4, 4, 2])
+
+
+    def test_bulk_create_positions_skips_duplicates(self):
+        Position.objects.create(
+            vehicle=self.vehicle,
+            latitude=40.7589,
+            longitude=-73.9851,
+            speed=60.0,
+            heading=90.0,
+            timestamp=datetime(2024, 1, 15, 14, 30, tzinfo=dt_timezone.utc),
+        )
+        positions = [
+            self.position_data,
+            {**self.position_data, 'timestamp': '2024-01-15T14:31:00Z'},
+            {**self.position_data, 'timestamp': '2024-01-15T14:31:00+00:00'},
+        ]
+
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data=json.dumps(positions),
+                                            content_type='application/json')
+
+        data = response.json()
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(data['duplicates'], 2)
+        self.assertEqual([r['status'] for r in data['results']], ['duplicate', 'accepted', 'duplicate'])
+        self.assertEqual(Position.objects.filter(vehicle=self.vehicle).count(), 3)
+
+    def test_create_position_is_idempotent(self):
+        self.addCleanup(recent_position_keys.clear)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.authenticated_request('POST', '/api/positions/',
+                                                data=json.dumps(self.position_data),
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+        # The retry is recognised in memory, without touching the positions table
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authenticated_request('POST', '/api/positions/',
+                                                data=json.dumps(self.position_data),
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'duplicate')
+        self.assertFalse(any('positions_position' in query['sql'] for query in queries.captured_queries))
+
+        # Without the in-memory filter the database check catches it
+        recent_position_keys.clear()
+        response = self.authenticated_request('POST', '/api/positions/',
+                                            data=json.dumps(self.position_data),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Position.objects.count(), 2)
+
+    def test_recent_position_keys_evicts_least_recently_used(self):
+        keys = RecentPositionKeys(capacity=2)
+        now = timezone.now()
+        keys.add_many([(1, now), (2, now)])
+
+        self.assertIn((1, now), keys)
+        keys.add_many([(3, now)])
+
+        self.assertIn((1, now), keys)
+        self.assertNotIn((2, now), keys)
+        self.assertIn((3, now), keys)
+        self.assertEqual(len(keys), 2)
+
+    @override_settings(FLEET_STATE={'ENABLED': False})
+    def test_latest_positions_updated_on_ingest(self):
+        positions = [
+            {**self.position_data, 'timestamp': '2024-01-15T14:30:00Z', 'latitude': 40.1},
+            {**self.position_data, 'timestamp': '2024-01-15T14:35:00Z', 'latitude': 40.2},
+            {**self.position_data, 'timestamp': '2024-01-15T14:32:00Z', 'latitude': 40.3},
+        ]
+        self.authenticated_request('POST', '/api/positions/bulk/',
+                                 data=json.dumps(positions),
+                                 content_type='application/json')
+
+        response = self.authenticated_request('GET', '/api/positions/latest/')
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        latest = results[0]
+        self.assertEqual(latest['vehicle_id'], self.vehicle.id)
+        self.assertEqual(latest['vehicle_make_model'], 'Ford Transit')
+        self.assertEqual(latest['latitude'], '40.2000000')
+        self.assertEqual(latest['id'], Position.objects.get(vehicle=self.vehicle, latitude=40.2).id)
+
+        # A late point from a buffering device does not move the vehicle back
+        self.authenticated_request('POST', '/api/positions/',
+                                 data=json.dumps({**self.position_data, 'timestamp': '2024-01-15T14:20:00Z'}),
+                                 content_type='application/json')
+        latest = self.authenticated_request('GET', '/api/positions/latest/').json()['results'][0]
+        self.assertEqual(latest['timestamp'], '2024-01-15T14:35:00+00:00')
+
+        self.authenticated_request('POST', '/api/positions/',
+                                 data=json.dumps({**self.position_data, 'timestamp': '2024-01-15T14:40:00Z'}),
+                                 content_type='application/json')
+        latest = self.authenticated_request('GET', '/api/positions/latest/').json()['results'][0]
+        self.assertEqual(latest['timestamp'], '2024-01-15T14:40:00+00:00')
+        self.assertEqual(VehicleLatestPosition.objects.count(), 1)
+
+    @override_settings(FLEET_STATE={'ENABLED': False})
+    def test_latest_positions_cost_does_not_depend_on_history(self):
+        positions = [
+            {**self.position_data, 'timestamp': f'2024-01-15T14:{minute:02d}:00Z'}
+            for minute in range(30)
+        ]
+        self.authenticated_request('POST', '/api/positions/bulk/',
+                                 data=json.dumps(positions),
+                                 content_type='application/json')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticated_request('GET', '/api/positions/latest/')
+        self.assertFalse(any('"positions_position"' in query['sql'] for query in queries.captured_queries))
+
+    def test_latest_positions_delta_sync(self):
+        other_vehicle = Vehicle.objects.create(
+            company=self.company, license_plate='TEST-456', make='Iveco', model='Daily', year=2022,
+            capacity=3.5, driver_name='Jane Doe', driver_email='jane@example.com',
+        )
+
+        def post(positions):
+            self.authenticated_request('POST', '/api/positions/bulk/', data=json.dumps(positions),
+                                       content_type='application/json')
+
+        def delta(query):
+            response = self.authenticated_request('GET', f'/api/positions/latest/?{query}')
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            return [latest['vehicle_id'] for latest in body['results']], body['cursor']
+
+        self.assertEqual(delta('since=0'), ([], 0))
+        post([
+            {**self.position_data, 'timestamp': '2024-01-15T14:30:00Z'},
+            {**self.position_data, 'vehicle_id': other_vehicle.id, 'timestamp': '2024-01-15T14:30:00Z',
+             'latitude': 48.85, 'longitude': 2.35},
+        ])
+        vehicle_ids, cursor = delta('since=0')
+        self.assertEqual(sorted(vehicle_ids), [self.vehicle.id, other_vehicle.id])
+        self.assertEqual(delta(f'since={cursor}'), ([], cursor))
+
+        post([{**self.position_data, 'timestamp': '2024-01-15T14:31:00Z'}])
+        vehicle_ids, next_cursor = delta(f'since={cursor}')
+        self.assertEqual(vehicle_ids, [self.vehicle.id])
+        self.assertGreater(next_cursor, cursor)
+
+        # Late points leave the snapshot, and the sequence, alone
+        post([{**self.position_data, 'vehicle_id': other_vehicle.id, 'timestamp': '2024-01-15T14:00:00Z'}])
+        self.assertEqual(delta(f'since={next_cursor}'), ([], next_cursor))
+
+        post([{**self.position_data, 'timestamp': '2024-01-15T14:32:00Z'},
+              {**self.position_data, 'vehicle_id': other_vehicle.id, 'timestamp': '2024-01-15T14:32:00Z',
+               'latitude': 48.86, 'longitude': 2.35}])
+        self.assertEqual(delta(f'since={next_cursor}&bbox=2,48,3,49')[0], [other_vehicle.id])
+
+        for since in ('abc', '-1'):
+            response = self.authenticated_request('GET', f'/api/positions/latest/?since={since}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_spatial_index_mirrors_positions(self):
+        positions = [
+            {**self.position_data, 'timestamp': '2024-01-15T14:31:00Z', 'latitude': 40.7, 'longitude': -74.05},
+            {**self.position_data, 'timestamp': '2024-01-15T14:32:00Z', 'latitude': 40.7004, 'longitude': -74.05},
+        ]
+        self.authenticated_request('POST', '/api/positions/bulk/',
+                                 data=json.dumps(positions),
+                                 content_type='application/json')
+
+        nearby = within_radius(Position.objects.all(), 40.7, -74.05, 100)
+        self.assertEqual([position.latitude for position, _ in nearby], [40.7, 40.7004])
+        self.assertEqual([position.latitude for position, _ in within_radius(Position.objects.all(), 40.7, -74.05, 30)],
+                         [40.7])
+        self.assertEqual(filter_bbox(Position.objects.all(), parse_bbox('-74.1,40.6,-74,40.7001')).count(), 1)
+
+        # Archiving deletes the rows, and their index entries with them
+        Position.objects.filter(latitude=40.7).delete()
+        self.assertEqual(filter_bbox(Position.objects.all(), parse_bbox('-74.1,40.6,-74,40.8')).count(), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {SPATIAL_INDEXES['positions_position'].rtree_table}")
+            self.assertEqual(cursor.fetchone()[0], Position.objects.count())
+
+
+class FleetStateTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Fleet Company', address='1 Memory Lane')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='MEM-001',
+            make='Renault',
+            model='Master',
+            year=2021,
+            capacity=3.5,
+            driver_name='Memory Driver',
+            driver_email='memory@example.com',
+        )
+        self.now = timezone.now().replace(microsecond=0)
+        # Rolled back rows would otherwise survive in the process-wide state
+        fleet_state_module._fleet_state = None
+        self.addCleanup(setattr, fleet_state_module, '_fleet_state', None)
+
+    def make_position(self, seconds_ago, **fields):
+        return Position(
+            vehicle=self.vehicle,
+            latitude=fields.get('latitude', 45.764),
+            longitude=fields.get('longitude', 4.8357),
+            speed=fields.get('speed', 30.0),
+            heading=fields.get('heading', 270.0),
+            timestamp=self.now - timedelta(seconds=seconds_ago),
+            engine_status='on',
+        )
+
+    def test_vehicle_track_keeps_newest_points(self):
+        track = VehicleTrack(capacity=3)
+        for timestamp in range(1, 6):
+            self.assertTrue(track.append(float(timestamp), 1.0, 2.0, 3.0, 4.0))
+        # Already held, or older than every point of the full ring
+        self.assertFalse(track.append(4.0, 1.0, 2.0, 3.0, 4.0))
+        self.assertFalse(track.append(2.0, 1.0, 2.0, 3.0, 4.0))
+
+        self.assertTrue(track.is_full)
+        self.assertEqual(track.oldest_timestamp, 3.0)
+        self.assertEqual(track.newest_timestamp, 5.0)
+        self.assertEqual([track.timestamps[i] for i in track.indexes_since(4.0)], [4.0, 5.0])
+
+        # Late points are inserted in order, dropping the oldest of a full ring
+        self.assertTrue(track.append(4.5, 1.0, 2.0, 3.0, 4.5))
+        self.assertEqual([track.timestamps[i] for i in track.indexes_since(0.0)], [4.0, 4.5, 5.0])
+        self.assertEqual([track.headings[i] for i in track.indexes_since(0.0)], [4.0, 4.5, 4.0])
+
+        track = VehicleTrack(capacity=4)
+        for timestamp in (1.0, 3.0, 2.0, 0.5):
+            self.assertTrue(track.append(timestamp, 1.0, 2.0, 3.0, timestamp))
+        self.assertEqual([track.timestamps[i] for i in track.indexes_since(0.0)], [0.5, 1.0, 2.0, 3.0])
+        self.assertEqual([track.headings[i] for i in track.indexes_since(0.0)], [0.5, 1.0, 2.0, 3.0])
+
+    def test_warm_loads_latest_and_recent_track(self):
+        save_positions([self.make_position(120), self.make_position(60, latitude=45.8)])
+
+        state = FleetState()
+        results = state.latest()
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['vehicle_id'], self.vehicle.id)
+        self.assertEqual(results[0]['latitude'], '45.8000000')
+        self.assertEqual(results[0]['vehicle_license_plate'], 'MEM-001')
+        self.assertEqual(results[0]['vehicle_make_model'], 'Renault Master')
+        self.assertEqual(len(state.track(self.vehicle.id, self.now - timedelta(minutes=5))), 2)
+
+    def test_committed_positions_applied_without_queries(self):
+        state = fleet_state_module.get_fleet_state()
+        state.warm()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_positions([self.make_position(30, latitude=46.0)])
+
+        with self.assertNumQueries(0):
+            results = state.latest()
+        self.assertEqual(results[0]['latitude'], '46.0000000')
+        self.assertEqual(results[0]['id'], Position.objects.get().id)
+
+    def test_sync_picks_up_positions_from_other_processes(self):
+        state = FleetState(sync_interval=3600)
+        state.warm()
+
+        # Stored without going through this process's on-commit hook
+        save_positions([self.make_position(10)])
+        self.assertEqual(state.latest(), [])
+
+        state.sync(force=True)
+        self.assertEqual(len(state.latest()), 1)
+
+    def test_applied_positions_advance_high_water_mark(self):
+        state = FleetState(sync_interval=3600)
+        state.warm()
+
+        first = save_positions([self.make_position(30)])['stored']
+        state.apply(first)
+        self.assertEqual(state._high_water_id, first[0].id)
+
+        # Committed by another process in between: not skipped by the next catch-up
+        save_positions([self.make_position(20)])
+        third = save_positions([self.make_position(10)])['stored']
+        state.apply(third)
+        self.assertEqual(state._high_water_id, first[0].id)
+
+        state.sync(force=True)
+        self.assertEqual(state._high_water_id, third[0].id)
+
+    def test_sync_evicts_deleted_and_silent_vehicles(self):
+        other = Vehicle.objects.create(
+            company=self.company, license_plate='MEM-002', make='Renault', model='Master', year=2021,
+            capacity=3.5, driver_name='Other Driver', driver_email='other@example.com',
+        )
+        state = FleetState(track_window=3600, sync_interval=3600)
+        state.warm()
+
+        save_positions([
+            self.make_position(60),
+            Position(vehicle=other, latitude=45.0, longitude=4.0, speed=0, heading=0,
+                     timestamp=self.now - timedelta(hours=2), engine_status='off'),
+        ])
+        state.sync(force=True)
+
+        # Silent for longer than the track window: the track is dropped, the latest position kept
+        self.assertEqual(set(state._tracks), {self.vehicle.id})
+        self.assertEqual({result['vehicle_id'] for result in state.latest()}, {self.vehicle.id, other.id})
+        self.assertFalse(state.covers(other.id, self.now - timedelta(hours=3)))
+
+        self.vehicle.delete()
+        other.hard_delete()
+        state.sync(force=True)
+        self.assertEqual(state.latest(), [])
+        self.assertEqual((state._tracks, state._cells, state._vehicles), ({}, {}, {}))
+
+    def test_latest_endpoint_served_from_memory(self):
+        save_positions([self.make_position(60)])
+        self.authenticated_request('GET', '/api/positions/latest/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authenticated_request('GET', '/api/positions/latest/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertFalse(any('positions_' in query['sql'] for query in queries.captured_queries))
+
+    def test_latest_endpoint_filters_viewport(self):
+        other = Vehicle.objects.create(
+            company=self.company, license_plate='MEM-002', make='Renault', model='Master', year=2021,
+            capacity=3.5, driver_name='Other Driver', driver_email='other@example.com',
+        )
+        save_positions([
+            self.make_position(60),
+            Position(vehicle=other, latitude=-33.87, longitude=151.21, speed=0, heading=0,
+                     timestamp=self.now, engine_status='off'),
+        ])
+
+        for enabled in (True, False):
+            with self.subTest(fleet_state=enabled), override_settings(FLEET_STATE={'ENABLED': enabled}):
+                response = self.authenticated_request('GET', '/api/positions/latest/?bbox=4.7,45.7,4.9,45.8')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([result['vehicle_id'] for result in response.json()['results']], [self.vehicle.id])
+
+                # Spanning the antimeridian
+                response = self.authenticated_request('GET', '/api/positions/latest/?bbox=150,-40,-170,-30')
+                self.assertEqual([result['vehicle_id'] for result in response.json()['results']], [other.id])
+
+                response = self.authenticated_request('GET', '/api/positions/latest/?bbox=-180,-90,180,90')
+                self.assertEqual(len(response.json()['results']), 2)
+
+        for bbox in ('4.7,45.7,4.9', '4.7,45.8,4.9,45.7', '4.7,45.7,190,45.8', 'a,b,c,d'):
+            response = self.authenticated_request('GET', f'/api/positions/latest/?bbox={bbox}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_recent_track_endpoint(self):
+        save_positions([self.make_position(seconds) for seconds in (600, 300, 60)])
+
+        response = self.authenticated_request('GET', f'/api/positions/recent/?vehicle={self.vehicle.id}&minutes=6')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['vehicle_id'], self.vehicle.id)
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(data['results'][0]['timestamp'], (self.now - timedelta(seconds=300)).isoformat())
+
+        response = self.authenticated_request('GET', f'/api/positions/recent/?vehicle={self.vehicle.id}&minutes=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_recent_track_includes_late_points(self):
+        fleet_state_module.get_fleet_state().warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            save_positions([self.make_position(60)])
+        # Sent late by a device that was offline
+        with self.captureOnCommitCallbacks(execute=True):
+            save_positions([self.make_position(600)])
+
+        response = self.authenticated_request('GET', f'/api/positions/recent/?vehicle={self.vehicle.id}&minutes=30')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [point['timestamp'] for point in response.json()['results']],
+            [(self.now - timedelta(seconds=seconds)).isoformat() for seconds in (600, 60)],
+        )
+
+    @override_settings(FLEET_STATE={'ENABLED': True, 'TRACK_LENGTH': 2})
+    def test_recent_track_falls_back_to_database(self):
+        save_positions([self.make_position(seconds) for seconds in (600, 300, 60)])
+
+        # Only the last two points are kept in memory
+        response = self.authenticated_request('GET', f'/api/positions/recent/?vehicle={self.vehicle.id}&minutes=15')
+        self.assertEqual(len(response.json()['results']), 3)
+
+
+class SimplifiedTrackTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Track Company', address='1 Polyline Rd')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='TRK-001',
+            make='Mercedes',
+            model='Sprinter',
+            year=2023,
+            capacity=3.5,
+            driver_name='Track Driver',
+            driver_email='track@example.com',
+        )
+        self.start = datetime(2024, 3, 1, 8, 0, tzinfo=dt_timezone.utc)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def store_straight_drive(self, count, day_offset=0):
+        # Due north along a meridian, then one turn east at the end
+        positions = [
+            Position(vehicle=self.vehicle, latitude=48.0 + i * 0.001, longitude=2.0, speed=50.0, heading=0.0,
+                     timestamp=self.start + timedelta(days=day_offset, seconds=10 * i))
+            for i in range(count)
+        ]
+        positions.append(Position(
+            vehicle=self.vehicle, latitude=48.0 + (count - 1) * 0.001, longitude=2.1, speed=50.0, heading=90.0,
+            timestamp=self.start + timedelta(days=day_offset, seconds=10 * count)
+        ))
+        save_positions(positions)
+
+    def test_douglas_peucker_keeps_corners(self):
+        points = [(0.0, 0.0), (1.0, 0.1), (2.0, -0.1), (3.0, 0.0), (3.0, 1.0), (3.0, 2.0)]
+
+        self.assertEqual(douglas_peucker(points, 0.5), [0, 3, 5])
+        self.assertEqual(douglas_peucker(points, 0.01), [0, 1, 2, 3, 5])
+        self.assertEqual(douglas_peucker(points[:2], 10), [0, 1])
+
+    def test_zoom_tolerance_halves_per_level(self):
+        self.assertAlmostEqual(zoom_tolerance(0), 156543.03, places=1)
+        self.assertAlmostEqual(zoom_tolerance(10), zoom_tolerance(11) * 2)
+
+    def test_track_endpoint_simplifies(self):
+        self.store_straight_drive(200)
+
+        response = self.authenticated_request(
+            'GET', f'/api/positions/track/?vehicle={self.vehicle.id}&zoom=14'
+                   f'&since=2024-03-01T00:00:00Z&until=2024-03-02T00:00:00Z'
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+
+        self.assertEqual([point['timestamp'] for point in results], [
+            self.start.isoformat(),
+            (self.start + timedelta(seconds=1990)).isoformat(),
+            (self.start + timedelta(seconds=2000)).isoformat(),
+        ])
+        self.assertEqual(results[0]['latitude'], '48.0000000')
+
+    def test_track_keeps_first_and_last_points_of_partial_range(self):
+        self.store_straight_drive(200)
+
+        # Inside the straight stretch, where the whole day's track has no point
+        response = self.authenticated_request(
+            'GET', f'/api/positions/track/?vehicle={self.vehicle.id}&zoom=14'
+                   f'&since=2024-03-01T08:10:00Z&until=2024-03-01T08:20:00Z'
+        )
+        results = response.json()['results']
+        self.assertEqual([point['timestamp'] for point in results], [
+            (self.start + timedelta(seconds=600)).isoformat(),
+            (self.start + timedelta(seconds=1190)).isoformat(),
+        ])
+        self.assertEqual(results[0]['latitude'], '48.0600000')
+
+        # A single point in range is returned once
+        response = self.authenticated_request(
+            'GET', f'/api/positions/track/?vehicle={self.vehicle.id}&zoom=14'
+                   f'&since=2024-03-01T08:10:00Z&until=2024-03-01T08:10:05Z'
+        )
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_track_cached_per_day_and_refreshed_by_new_points(self):
+        self.store_straight_drive(50)
+        self.store_straight_drive(50, day_offset=1)
+        url = (f'/api/positions/track/?vehicle={self.vehicle.id}&zoom=14'
+               f'&since=2024-03-01T00:00:00Z&until=2024-03-03T00:00:00Z')
+
+        self.assertEqual(len(self.authenticated_request('GET', url).json()['results']), 6)
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticated_request('GET', url)
+        # Only the per-day cache version lookups
+        track_queries = [query for query in queries.captured_queries if '"positions_position"' in query['sql']]
+        self.assertEqual(len(track_queries), 2)
+
+        save_positions([Position(vehicle=self.vehicle, latitude=47.0, longitude=2.1, speed=0.0, heading=0.0,
+                                 timestamp=self.start + timedelta(hours=1))])
+        self.assertEqual(len(self.authenticated_request('GET', url).json()['results']), 7)
+
+    def test_track_endpoint_invalid_parameters(self):
+        base = f'/api/positions/track/?vehicle={self.vehicle.id}'
+        for query in ('&zoom=23', '&zoom=abc', '&since=2024-03-01T00:00:00Z&until=2024-03-20T00:00:00Z',
+                      '&since=2024-03-02T00:00:00Z&until=2024-03-01T00:00:00Z'):
+            self.assertEqual(self.authenticated_request('GET', base + query).status_code, 400, query)
+        self.assertEqual(self.authenticated_request('GET', '/api/positions/track/').status_code, 400)
+
+
+class PositionRollupTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Rollup Company', address='1 Aggregate Ave')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='ROL-001',
+            make='Scania',
+            model='R450',
+            year=2020,
+            capacity=24.0,
+            driver_name='Rollup Driver',
+            driver_email='rollup@example.com',
+        )
+        self.start = datetime(2024, 5, 6, 9, 58, tzinfo=dt_timezone.utc)
+
+    def make_positions(self, offsets, latitude_step=0.001):
+        # One point every 20 seconds, heading north
+        return [
+            Position(vehicle=self.vehicle, latitude=Decimal('45.0') + Decimal(str(latitude_step)) * i,
+                     longitude=Decimal('5.0'), speed=Decimal(str(40 + i)), heading=Decimal('0'),
+                     fuel_level=Decimal(str(80 - i)), odometer=Decimal(str(1000 + i)),
+                     timestamp=self.start + timedelta(seconds=20 * i))
+            for i in offsets
+        ]
+
+    def rollup_rows(self, model):
+        return list(model.objects.filter(vehicle=self.vehicle).order_by('bucket').values(
+            'bucket', *model.AGGREGATE_FIELDS
+        ))
+
+    def test_rollups_maintained_incrementally(self):
+        save_positions(self.make_positions(range(0, 4)))
+        save_positions(self.make_positions(range(4, 9)))
+
+        minutes = PositionMinuteRollup.objects.filter(vehicle=self.vehicle).order_by('bucket')
+        self.assertEqual([rollup.point_count for rollup in minutes], [3, 3, 3])
+        first = minutes[0]
+        self.assertEqual(first.bucket, self.start)
+        self.assertEqual(first.first_latitude, Decimal('45.0000000'))
+        self.assertEqual(first.last_latitude, Decimal('45.0020000'))
+        self.assertEqual(first.average_speed, Decimal('41'))
+        self.assertEqual(first.max_speed, Decimal('42.00'))
+        self.assertEqual((first.min_fuel_level, first.max_fuel_level), (Decimal('78.00'), Decimal('80.00')))
+        self.assertEqual((first.min_odometer, first.max_odometer), (Decimal('1000.00'), Decimal('1002.00')))
+
+        step = haversine(45.0, 5.0, 45.001, 5.0)
+        self.assertAlmostEqual(float(first.distance), 2 * step, delta=0.05)
+        # The segment from 09:58:40 to 09:59:00 counts in the second minute
+        self.assertAlmostEqual(float(minutes[1].distance), 3 * step, delta=0.05)
+
+        hours = PositionHourRollup.objects.filter(vehicle=self.vehicle).order_by('bucket')
+        self.assertEqual([rollup.point_count for rollup in hours], [6, 3])
+        self.assertAlmostEqual(float(sum(rollup.distance for rollup in hours)), 8 * step, delta=0.1)
+
+    def test_late_points_rebuild_affected_buckets(self):
+        positions = self.make_positions(range(9))
+        late = [positions.pop(4), positions.pop(0)]
+        save_positions(positions)
+        save_positions(late)
+        incremental = self.rollup_rows(PositionMinuteRollup), self.rollup_rows(PositionHourRollup)
+
+        PositionMinuteRollup.objects.all().delete()
+        PositionHourRollup.objects.all().delete()
+        call_command('rebuild_position_rollups', workers=1, stdout=StringIO())
+
+        self.assertEqual(incremental, (self.rollup_rows(PositionMinuteRollup), self.rollup_rows(PositionHourRollup)))
+        self.assertEqual(sum(row['point_count'] for row in incremental[1]), 9)
+
+    def test_rebuild_command_matches_incremental(self):
+        save_positions(self.make_positions(range(0, 5)))
+        save_positions(self.make_positions(range(5, 9)))
+        expected = self.rollup_rows(PositionMinuteRollup), self.rollup_rows(PositionHourRollup)
+
+        PositionMinuteRollup.objects.all().delete()
+        PositionHourRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_position_rollups', vehicle=[self.vehicle.id], workers=1, stdout=out)
+
+        self.assertIn('Aggregated 9 positions', out.getvalue())
+        self.assertEqual(expected, (self.rollup_rows(PositionMinuteRollup), self.rollup_rows(PositionHourRollup)))
+
+    def test_rollups_endpoint(self):
+        save_positions(self.make_positions(range(9)))
+
+        response = self.authenticated_request(
+            'GET', f'/api/positions/rollups/?vehicle={self.vehicle.id}&resolution=minute'
+                   f'&since=2024-05-06T00:00:00Z&until=2024-05-07T00:00:00Z'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['resolution'], 'minute')
+        self.assertEqual([row['point_count'] for row in data['results']], [3, 3, 3])
+        self.assertEqual(data['results'][0]['average_speed'], '41.00')
+        self.assertEqual(data['results'][0]['bucket'], '2024-05-06T09:58:00+00:00')
+
+        response = self.authenticated_request(
+            'GET', f'/api/positions/rollups/?vehicle={self.vehicle.id}&resolution=day'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.authenticated_request(
+            'GET', f'/api/positions/rollups/?vehicle={self.vehicle.id}&resolution=minute'
+                   f'&since=2024-05-01T00:00:00Z&until=2024-05-30T00:00:00Z'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_segment_distances_match_haversine(self):
+        latitudes, longitudes = [45.0, 45.001, 45.0015, 44.9], [5.0, 5.0, 5.002, 5.1]
+        expected = [haversine(latitudes[i], longitudes[i], latitudes[i + 1], longitudes[i + 1]) for i in range(3)]
+
+        for distance, reference in zip(segment_distances(latitudes, longitudes), expected):
+            self.assertAlmostEqual(distance, reference, places=6)
+        self.assertEqual(segment_distances([45.0], [5.0]), [])
+
+    def test_distance_endpoint_per_day_and_trip(self):
+        save_positions(self.make_positions(range(9)))
+        dispatcher = User.objects.create_user(username='dispatcher', password='dispatch123')
+        trip = Trip.objects.create(
+            vehicle=self.vehicle, dispatcher=dispatcher, name='Morning run', status='completed',
+            planned_start_date=self.start.date(), planned_start_time=self.start.time(),
+            actual_start_datetime=self.start + timedelta(seconds=40),
+            actual_end_datetime=self.start + timedelta(minutes=2),
+        )
+        step = haversine(45.0, 5.0, 45.001, 5.0)
+
+        response = self.authenticated_request(
+            'GET', f'/api/positions/distance/?company={self.company.id}&since=2024-05-06&until=2024-05-06'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'], [{
+            'vehicle_id': self.vehicle.id,
+            'day': '2024-05-06',
+            'point_count': 9,
+            'distance_km': f'{8 * step / 1000:.3f}',
+            'odometer_km': '8.00',
+        }])
+        self.assertEqual(len(data['trips']), 1)
+        self.assertEqual(data['trips'][0]['trip_id'], trip.id)
+        # Points at 09:58:40 up to 09:59:40; the window end is exclusive
+        self.assertEqual(data['trips'][0]['point_count'], 4)
+        self.assertEqual(data['trips'][0]['distance_km'], f'{3 * step / 1000:.3f}')
+
+    def test_distance_endpoint_invalid_parameters(self):
+        base = '/api/positions/distance/'
+        self.assertEqual(self.authenticated_request('GET', base + '?since=2024-05-06&until=2024-05-06').status_code, 400)
+        self.assertEqual(self.authenticated_request('GET', base + f'?vehicle={self.vehicle.id}&since=2024-05-06').status_code, 400)
+        self.assertEqual(
+            self.authenticated_request('GET', base + f'?vehicle={self.vehicle.id}&since=2024-05-06&until=2024-07-06').status_code,
+            400
+        )
+
+
+class PositionArchiveTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Archive Company', address='1 Cold Storage Rd')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='ARC-001',
+            make='DAF',
+            model='XF',
+            year=2019,
+            capacity=25.0,
+            driver_name='Archive Driver',
+            driver_email='archive@example.com',
+        )
+        archive_root = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_root.cleanup)
+        settings_override = override_settings(POSITION_ARCHIVE={'ROOT': archive_root.name, 'COMPRESSION': 'gzip'})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.archive_root = archive_root.name
+        archive_chunk_cache.clear()
+        self.addCleanup(archive_chunk_cache.clear)
+        cache.clear()
+
+    def make_positions(self, day, count, start_index=0):
+        start = datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc) + timedelta(hours=8)
+        return [
+            Position(vehicle=self.vehicle, latitude=Decimal('50.8503000') + Decimal('0.0001') * i,
+                     longitude=Decimal('4.3517000') - Decimal('0.0002') * i, speed=Decimal('42.50'),
+                     heading=Decimal('270.00'), altitude=Decimal('56.00') if i % 3 else None,
+                     odometer=Decimal('120000.00') + i, fuel_level=None, engine_status='on',
+                     timestamp=start + timedelta(seconds=10 * i))
+            for i in range(start_index, start_index + count)
+        ]
+
+    def stored_rows(self):
+        return list(Position.objects.filter(vehicle=self.vehicle).order_by('timestamp').values_list(*ARCHIVE_FIELDS))
+
+    def test_encode_decode_roundtrip(self):
+        save_positions(self.make_positions(datetime(2024, 1, 10).date(), 50))
+        rows = self.stored_rows()
+        # Reverse order exercises negative deltas
+        self.assertEqual(decode_positions(encode_positions(rows[::-1])), rows[::-1])
+        self.assertEqual(decode_positions(encode_positions([])), [])
+
+    def test_archive_moves_old_days_to_files(self):
+        old_day = datetime(2024, 1, 10).date()
+        save_positions(self.make_positions(old_day, 500))
+        save_positions(self.make_positions(datetime(2024, 3, 1).date(), 5))
+        expected = self.stored_rows()[:500]
+
+        summary = archive_positions(before=datetime(2024, 2, 1).date())
+
+        self.assertEqual(summary, {'vehicle_days': 1, 'positions': 500})
+        self.assertEqual(Position.objects.filter(vehicle=self.vehicle).count(), 5)
+        archive = PositionArchive.objects.get(vehicle=self.vehicle)
+        self.assertEqual(archive.day, old_day)
+        self.assertEqual(archive.point_count, 500)
+        self.assertEqual(archive.first_timestamp, expected[0][1])
+        self.assertEqual(read_archive(archive), expected)
+        # A few bytes per point instead of a table row and two index entries
+        self.assertLess(archive.size_bytes, 500 * 8)
+
+    def test_late_points_merged_into_existing_archive(self):
+        day = datetime(2024, 1, 10).date()
+        save_positions(self.make_positions(day, 10))
+        archive_positions(before=datetime(2024, 2, 1).date())
+
+        save_positions(self.make_positions(day, 5, start_index=20))
+        out = StringIO()
+        call_command('archive_positions', before=datetime(2024, 2, 1).date(), stdout=out)
+
+        self.assertIn('Archived 5 positions from 1 vehicle-days', out.getvalue())
+        archive = PositionArchive.objects.get(vehicle=self.vehicle)
+        self.assertEqual(archive.point_count, 15)
+        self.assertEqual(len(read_archive(archive)), 15)
+        self.assertFalse(Position.objects.filter(vehicle=self.vehicle).exists())
+
+    def archive_files(self):
+        return sorted(str(path.relative_to(self.archive_root)) for path in Path(self.archive_root).rglob('*.dmpa.*'))
+
+    def test_failed_archive_leaves_no_orphan_file(self):
+        day = datetime(2024, 1, 10).date()
+        save_positions(self.make_positions(day, 10))
+        archive_positions(before=datetime(2024, 2, 1).date())
+        archive = PositionArchive.objects.get(vehicle=self.vehicle)
+        self.assertEqual(self.archive_files(), [archive.path])
+
+        save_positions(self.make_positions(day, 5, start_index=20))
+        with patch('positions.archive.PositionArchive.objects.update_or_create', side_effect=IntegrityError('down')):
+            with self.assertRaises(IntegrityError):
+                archive_positions(before=datetime(2024, 2, 1).date())
+
+        # The manifest, its file and the rows are as before
+        self.assertEqual(self.archive_files(), [archive.path])
+        self.assertEqual(PositionArchive.objects.get(vehicle=self.vehicle).path, archive.path)
+        self.assertEqual(Position.objects.filter(vehicle=self.vehicle).count(), 5)
+
+        archive_positions(before=datetime(2024, 2, 1).date())
+        archive = PositionArchive.objects.get(vehicle=self.vehicle)
+        self.assertEqual(self.archive_files(), [archive.path])
+        self.assertEqual(archive.point_count, 15)
+
+    def test_reingested_archived_points_are_duplicates(self):
+        day = datetime(2024, 1, 10).date()
+        save_positions(self.make_positions(day, 10))
+        archive_positions(before=datetime(2024, 2, 1).date())
+
+        result = save_positions(self.make_positions(day, 12, start_index=5))
+
+        self.assertEqual(len(result['duplicates']), 5)
+        self.assertEqual(len(result['stored']), 7)
+        response = self.authenticated_request('GET', f'/api/positions/?vehicle={self.vehicle.id}&limit=100')
+        timestamps = [position['timestamp'] for position in response.json()['results']]
+        self.assertEqual(len(timestamps), 17)
+        self.assertEqual(len(set(timestamps)), 17)
+
+    def test_archive_dry_run(self):
+        save_positions(self.make_positions(datetime(2024, 1, 10).date(), 3))
+
+        out = StringIO()
+        call_command('archive_positions', older_than_days=30, dry_run=True, stdout=out)
+
+        self.assertIn('1 vehicle-days', out.getvalue())
+        self.assertEqual(Position.objects.count(), 3)
+        self.assertFalse(PositionArchive.objects.exists())
+
+    def archive_old_day(self):
+        save_positions(self.make_positions(datetime(2024, 1, 10).date(), 30))
+        save_positions(self.make_positions(datetime(2024, 3, 1).date(), 10))
+        expected = list(Position.objects.filter(vehicle=self.vehicle).order_by('-timestamp', '-id').values_list('id', flat=True))
+        archive_positions(before=datetime(2024, 2, 1).date())
+        return expected
+
+    def test_history_pages_across_table_and_archive(self):
+        expected = self.archive_old_day()
+        self.assertEqual(Position.objects.filter(vehicle=self.vehicle).count(), 10)
+
+        ids = []
+        url = f'/api/positions/?vehicle={self.vehicle.id}&limit=7'
+        while url:
+            data = self.authenticated_request('GET', url).json()
+            ids.extend(position['id'] for position in data['results'])
+            url = data['next_cursor'] and f'/api/positions/?vehicle={self.vehicle.id}&limit=7&cursor={data["next_cursor"]}'
+
+        self.assertEqual(ids, expected)
+        # The archived day is decoded once and served from memory for the following pages
+        self.assertEqual(archive_chunk_cache.misses, 1)
+        self.assertGreaterEqual(archive_chunk_cache.hits, 3)
+
+    def test_history_skips_archive_outside_window(self):
+        self.archive_old_day()
+
+        response = self.authenticated_request('GET', f'/api/positions/?vehicle={self.vehicle.id}&since=2024-02-01T00:00:00Z')
+
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(archive_chunk_cache.misses, 0)
+
+    def test_history_filtered_by_bbox(self):
+        self.archive_old_day()
+        # The first five points of each day, one of them archived
+        url = f'/api/positions/?vehicle={self.vehicle.id}&bbox=4.3508,50.85,4.3518,50.85075'
+
+        with CaptureQueriesContext(connection) as queries:
+            page = self.authenticated_request('GET', url + '&limit=6').json()
+        self.assertTrue(any('positions_position_rtree' in query['sql'] for query in queries.captured_queries))
+        results = page['results'] + self.authenticated_request(
+            'GET', url + f"&limit=6&cursor={page['next_cursor']}").json()['results']
+
+        self.assertEqual([position['timestamp'][:10] for position in results], ['2024-03-01'] * 5 + ['2024-01-10'] * 5)
+        self.assertTrue(all(float(position['latitude']) <= 50.85075 for position in results))
+        streamed = b''.join(self.authenticated_request('GET', url + '&stream=true').streaming_content)
+        self.assertEqual(json.loads(streamed)['results'], results)
+
+        response = self.authenticated_request('GET', '/api/positions/?bbox=4.35,50.8')
+        self.assertEqual(response.status_code, 400)
+
+    def test_archived_history_serialized_like_stored(self):
+        save_positions(self.make_positions(datetime(2024, 1, 10).date(), 3))
+        url = f'/api/positions/?vehicle={self.vehicle.id}'
+        stored = self.authenticated_request('GET', url).json()['results']
+        archive_positions(before=datetime(2024, 2, 1).date())
+
+        self.assertEqual(self.authenticated_request('GET', url).json()['results'], stored)
+        streamed = b''.join(self.authenticated_request('GET', url + '&stream=true').streaming_content)
+        self.assertEqual(json.loads(streamed)['results'], stored)
+
+    def test_track_and_rollups_read_archived_days(self):
+        self.archive_old_day()
+        url = (f'/api/positions/track/?vehicle={self.vehicle.id}&zoom=22'
+               f'&since=2024-01-10T00:00:00Z&until=2024-01-11T00:00:00Z')
+
+        results = self.authenticated_request('GET', url).json()['results']
+        # The archived drive is a straight line: only its two ends are kept
+        self.assertEqual([point['timestamp'] for point in results], ['2024-01-10T08:00:00+00:00', '2024-01-10T08:04:50+00:00'])
+
+        call_command('rebuild_position_rollups', workers=1, stdout=StringIO())
+        minute_points = sum(PositionMinuteRollup.objects.filter(vehicle=self.vehicle).values_list('point_count', flat=True))
+        self.assertEqual(minute_points, 40)
+
+    def test_chunk_cache_evicts_least_recently_used(self):
+        save_positions(self.make_positions(datetime(2024, 1, 10).date(), 3))
+        save_positions(self.make_positions(datetime(2024, 1, 11).date(), 3))
+        archive_positions(before=datetime(2024, 2, 1).date())
+        first, second = PositionArchive.objects.order_by('day')
+        chunks = ArchiveChunkCache(capacity=1)
+
+        chunks.get(first)
+        chunks.get(second)
+        chunks.get(second)
+        chunks.get(first)
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual((chunks.hits, chunks.misses), (1, 3))
+
+
+class PositionExportTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Export Company', address='1 Column Ave')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='EXP-001',
+            make='Scania',
+            model='R450',
+            year=2021,
+            capacity=24.0,
+            driver_name='Export Driver',
+            driver_email='export@example.com',
+        )
+        start = datetime(2024, 5, 1, 23, 59, 50, tzinfo=dt_timezone.utc)
+        save_positions([
+            Position(vehicle=self.vehicle, latitude=51.5 + i / 1000, longitude=-0.12, speed=30 + i, heading=90,
+                     altitude=None if i else 12.5, odometer=1000.25, fuel_level=None, engine_status='on',
+                     timestamp=start + timedelta(seconds=5 * i))
+            for i in range(4)
+        ])
+
+    def read_npy(self, data):
+        self.assertTrue(data.startswith(b'\x93NUMPY\x01\x00'))
+        header_length = int.from_bytes(data[8:10], 'little')
+        # Record data starts on a 64 byte boundary
+        self.assertEqual((10 + header_length) % 64, 0)
+        header = ast.literal_eval(data[10:10 + header_length].decode('latin1'))
+        self.assertEqual(header['descr'], EXPORT_DTYPE)
+        records = list(EXPORT_RECORD.iter_unpack(data[10 + header_length:]))
+        self.assertEqual(header['shape'], (len(records),))
+        return records
+
+    def test_export_command_writes_one_file_per_vehicle_day(self):
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+
+        out = StringIO()
+        call_command('export_positions', company=self.company.id, since=datetime(2024, 5, 1).date(),
+                     until=datetime(2024, 5, 2).date(), output=output.name, stdout=out)
+
+        self.assertIn('Exported 4 positions to 2 files', out.getvalue())
+        with open(f'{output.name}/{self.vehicle.id}/2024-05-01.npy', 'rb') as f:
+            first_day = self.read_npy(f.read())
+        self.assertEqual(len(first_day), 2)
+        position_id, timestamp, latitude, longitude, speed, heading, altitude, odometer, fuel_level, engine_status = first_day[0]
+        self.assertEqual(timestamp, int(datetime(2024, 5, 1, 23, 59, 50, tzinfo=dt_timezone.utc).timestamp()) * 10 ** 6)
+        self.assertEqual((latitude, speed, altitude, odometer, engine_status), (51.5, 30.0, 12.5, 1000.25, 1))
+        self.assertTrue(math.isnan(fuel_level))
+        self.assertTrue(math.isnan(first_day[1][6]))
+
+    def test_export_endpoint_streams_zip(self):
+        response = self.authenticated_request(
+            'GET', f'/api/positions/export/?company={self.company.id}&since=2024-05-01&until=2024-05-31'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f'{self.vehicle.id}/2024-05-01.npy', f'{self.vehicle.id}/2024-05-02.npy'])
+        self.assertEqual([info.compress_type for info in archive.infolist()], [zipfile.ZIP_STORED] * 2)
+        records = self.read_npy(archive.read(f'{self.vehicle.id}/2024-05-02.npy'))
+        self.assertEqual([record[4] for record in records], [32.0, 33.0])
+
+    def test_export_endpoint_invalid_parameters(self):
+        base = '/api/positions/export/'
+        self.assertEqual(self.authenticated_request('GET', base + '?since=2024-05-01&until=2024-05-02').status_code, 400)
+        self.assertEqual(self.authenticated_request('GET', base + f'?company={self.company.id}&since=2024-05-01').status_code, 400)
+        self.assertEqual(
+            self.authenticated_request('GET', base + f'?company={self.company.id}&since=2024-05-01&until=2024-07-01').status_code,
+            400
+        )
+        self.assertEqual(self.authenticated_request('GET', base + '?company=999&since=2024-05-01&until=2024-05-02').status_code, 400)
+
+
+@override_settings(GEOFENCE={'ENABLED': False})
+class DwellDetectionTestCase(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Dwell Company', address='1 Depot Rd')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='DWL-001',
+            make='Iveco',
+            model='Daily',
+            year=2022,
+            capacity=3.5,
+            driver_name='Dwell Driver',
+            driver_email='dwell@example.com',
+        )
+        dispatcher = User.objects.create_user(username='dwell-dispatcher', password='dispatch123')
+        self.trip = Trip.objects.create(
+            vehicle=self.vehicle, dispatcher=dispatcher, name='Deliveries', status='in_progress',
+            planned_start_date=datetime(2024, 6, 3).date(), planned_start_time=datetime(2024, 6, 3, 8).time(),
+            actual_start_datetime=datetime(2024, 6, 3, 8, tzinfo=dt_timezone.utc),
+        )
+        self.first_stop = TripStop.objects.create(
+            trip=self.trip, sequence=1, planned_arrival_time=datetime(2024, 6, 3, 9).time(),
+            stop=Stop.objects.create(name='Warehouse', address='1 Dock St', latitude=Decimal('48.850000'),
+                                     longitude=Decimal('2.350000'), stop_type='pickup'),
+        )
+        self.second_stop = TripStop.objects.create(
+            trip=self.trip, sequence=2, planned_arrival_time=datetime(2024, 6, 3, 11).time(),
+            stop=Stop.objects.create(name='Shop', address='9 High St', latitude=Decimal('48.900000'),
+                                     longitude=Decimal('2.400000'), stop_type='delivery'),
+        )
+        self.start = datetime(2024, 6, 3, 8, 50, tzinfo=dt_timezone.utc)
+
+    def drive(self, points):
+        """Positions every 30 seconds from (latitude offset, speed) pairs, relative to the first stop"""
+        return [
+            Position(vehicle=self.vehicle, latitude=48.85 + offset, longitude=2.35, speed=speed, heading=0,
+                     timestamp=self.start + timedelta(seconds=30 * i))
+            for i, (offset, speed) in enumerate(points)
+        ]
+
+    def test_dwell_at_next_stop_stamps_arrival_and_departure(self):
+        approach = [(-0.01 + 0.002 * i, 40) for i in range(5)]
+        # Ten minutes parked, drifting a few meters
+        parked = [(0.00002 * (i % 3), 0 if i % 4 else 2) for i in range(20)]
+        leave = [(0.002 * (i + 1), 35) for i in range(3)]
+        positions = self.drive(approach + parked + leave)
+
+        # Fed in small batches, as devices report
+        for start in range(0, len(positions), 4):
+            save_positions(positions[start:start + 4])
+
+        self.first_stop.refresh_from_db()
+        self.assertEqual(self.first_stop.actual_arrival_datetime, positions[5].timestamp)
+        self.assertEqual(self.first_stop.actual_departure_datetime, positions[24].timestamp)
+        self.second_stop.refresh_from_db()
+        self.assertIsNone(self.second_stop.actual_arrival_datetime)
+        dwell = VehicleDwell.objects.get(vehicle=self.vehicle)
+        self.assertIsNone(dwell.started_at)
+        self.assertEqual(dwell.last_timestamp, positions[-1].timestamp)
+
+    def test_short_or_distant_dwells_are_not_stop_arrivals(self):
+        # Two minutes at a traffic light near the stop, then ten minutes parked 1 km away
+        positions = self.drive([(0, 0)] * 4 + [(0.005, 40)] + [(0.01, 0)] * 20)
+        save_positions(positions)
+
+        self.first_stop.refresh_from_db()
+        self.assertIsNone(self.first_stop.actual_arrival_datetime)
+        self.assertEqual(VehicleDwell.objects.get(vehicle=self.vehicle).started_at, positions[5].timestamp)
+
+    def test_late_points_do_not_move_dwell_state(self):
+        positions = self.drive([(0, 0)] * 8)
+        save_positions(positions[4:])
+        save_positions(positions[:4])
+
+        dwell = VehicleDwell.objects.get(vehicle=self.vehicle)
+        self.assertEqual((dwell.started_at, dwell.last_timestamp), (positions[4].timestamp, positions[7].timestamp))
+        # Only 90 seconds of the dwell were seen in order: not long enough
+        self.first_stop.refresh_from_db()
+        self.assertIsNone(self.first_stop.actual_arrival_datetime)
+
+    @override_settings(DWELL_DETECTION={'ENABLED': False})
+    def test_dwell_detection_can_be_disabled(self):
+        save_positions(self.drive([(0, 0)] * 10))
+
+        self.assertFalse(VehicleDwell.objects.exists())
+
+
+class GeofenceTestCase(TestCase):
+    def setUp(self):
+        geofence_module._geofence_index = None
+        self.company = Company.objects.create(name='Fence Company', address='1 Ring Rd')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='GEO-001',
+            make='Renault',
+            model='Master',
+            year=2021,
+            capacity=3.0,
+            driver_name='Fence Driver',
+            driver_email='fence@example.com',
+        )
+        self.dispatcher = User.objects.create_user(username='fence-dispatcher', password='dispatch123')
+        self.trip = Trip.objects.create(
+            vehicle=self.vehicle, dispatcher=self.dispatcher, name='Round', status='in_progress',
+            planned_start_date=datetime(2024, 6, 3).date(), planned_start_time=datetime(2024, 6, 3, 8).time(),
+            actual_start_datetime=datetime(2024, 6, 3, 8, tzinfo=dt_timezone.utc),
+        )
+        self.first_stop = TripStop.objects.create(
+            trip=self.trip, sequence=1, planned_arrival_time=datetime(2024, 6, 3, 9).time(),
+            stop=Stop.objects.create(name='Depot', address='1 Dock St', latitude=Decimal('48.850000'),
+                                     longitude=Decimal('2.350000'), stop_type='pickup'),
+        )
+        self.second_stop = TripStop.objects.create(
+            trip=self.trip, sequence=2, planned_arrival_time=datetime(2024, 6, 3, 11).time(),
+            stop=Stop.objects.create(name='Market', address='9 High St', latitude=Decimal('48.900000'),
+                                     longitude=Decimal('2.400000'), stop_type='delivery'),
+        )
+        self.start = datetime(2024, 6, 3, 8, 50, tzinfo=dt_timezone.utc)
+
+    def drive(self, offsets, speed=40):
+        """Positions every 30 seconds at latitude offsets from the first stop"""
+        return [
+            Position(vehicle=self.vehicle, latitude=48.85 + offset, longitude=2.35, speed=speed, heading=0,
+                     timestamp=self.start + timedelta(seconds=30 * i))
+            for i, offset in enumerate(offsets)
+        ]
+
+    def save(self, positions):
+        with self.captureOnCommitCallbacks(execute=True):
+            return save_positions(positions)
+
+    def test_entering_and_leaving_fence_stamps_stop(self):
+        # Through the depot without stopping: 330 m, 110 m, 55 m away, passing by, then 165 m and 330 m beyond
+        positions = self.drive([-0.003, -0.001, -0.0005, 0, 0.0005, 0.0015, 0.003])
+        for position in positions:
+            self.save([position])
+
+        self.first_stop.refresh_from_db()
+        self.assertEqual(self.first_stop.actual_arrival_datetime, positions[2].timestamp)
+        self.assertEqual(self.first_stop.actual_departure_datetime, positions[5].timestamp)
+        self.assertTrue(self.first_stop.is_completed)
+        self.second_stop.refresh_from_db()
+        self.assertIsNone(self.second_stop.actual_arrival_datetime)
+        self.assertFalse(self.second_stop.is_completed)
+        # Completed stops leave the index
+        self.assertEqual(len(get_geofence_index()), 1)
+
+    def test_whole_pass_in_one_batch(self):
+        positions = self.drive([-0.003, -0.0005, 0.0005, 0.003])
+        self.save(list(reversed(positions)))
+
+        self.first_stop.refresh_from_db()
+        self.assertEqual(
+            (self.first_stop.actual_arrival_datetime, self.first_stop.actual_departure_datetime),
+            (positions[1].timestamp, positions[3].timestamp),
+        )
+        self.assertTrue(self.first_stop.is_completed)
+
+    def test_late_points_are_skipped(self):
+        arrival = self.drive([0])[0]
+        arrival.timestamp = datetime(2024, 6, 3, 9, tzinfo=dt_timezone.utc)
+        self.save([arrival])
+        # Backfilled by the device: 20 minutes earlier and 5 km away
+        late = self.drive([0.045])[0]
+        late.timestamp = arrival.timestamp - timedelta(minutes=20)
+        self.assertEqual(len(self.save([late])['stored']), 1)
+
+        self.first_stop.refresh_from_db()
+        self.assertEqual(self.first_stop.actual_arrival_datetime, arrival.timestamp)
+        self.assertIsNone(self.first_stop.actual_departure_datetime)
+        self.assertFalse(self.first_stop.is_completed)
+
+        departure = self.drive([0.045])[0]
+        departure.timestamp = arrival.timestamp + timedelta(minutes=5)
+        self.save([departure])
+        self.first_stop.refresh_from_db()
+        self.assertEqual(self.first_stop.actual_departure_datetime, departure.timestamp)
+        self.assertTrue(self.first_stop.is_completed)
+
+    def test_dwell_departure_is_kept(self):
+        # Parked five minutes at the depot, then driving off
+        positions = self.drive([-0.0005] + [0] * 10 + [0.003, 0.006], speed=0)
+        for position in positions[-2:]:
+            position.speed = 40
+        self.save(positions)
+
+        self.first_stop.refresh_from_db()
+        self.assertEqual(self.first_stop.actual_arrival_datetime, positions[0].timestamp)
+        self.assertEqual(self.first_stop.actual_departure_datetime, positions[10].timestamp)
+        self.assertTrue(self.first_stop.is_completed)
+
+    def test_other_vehicles_do_not_trigger_fences(self):
+        other = Vehicle.objects.create(
+            company=self.company, license_plate='GEO-002', make='Renault', model='Master', year=2021,
+            capacity=3.0, driver_name='Other Driver', driver_email='other@example.com',
+        )
+        self.save([
+            Position(vehicle=other, latitude=48.85, longitude=2.35, speed=0, heading=0, timestamp=self.start),
+        ])
+
+        self.first_stop.refresh_from_db()
+        self.assertIsNone(self.first_stop.actual_arrival_datetime)
+
+    def test_index_only_returns_fences_of_nearby_cells(self):
+        index = GeofenceIndex(radius=100, cell_size=0.01)
+        index.refresh()
+
+        self.assertEqual([fence.trip_stop_id for fence in index.nearby(48.8505, 2.3502)], [self.first_stop.id])
+        self.assertEqual([fence.trip_stop_id for fence in index.nearby(48.9, 2.4)], [self.second_stop.id])
+        self.assertEqual(index.nearby(48.87, 2.37), [])
+        # A fence straddling a cell border is found from both sides
+        self.assertEqual(len(index.nearby(48.8495, 2.3498)), 1)
+
+    def test_index_follows_trip_changes(self):
+        index = get_geofence_index()
+        index.refresh()
+        self.assertEqual(len(index), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            third_stop = TripStop.objects.create(
+                trip=self.trip, sequence=3, planned_arrival_time=datetime(2024, 6, 3, 12).time(),
+                stop=Stop.objects.create(name='Annex', address='3 Side St', latitude=Decimal('48.950000'),
+                                         longitude=Decimal('2.450000'), stop_type='delivery'),
+            )
+        self.assertEqual([fence.trip_stop_id for fence in index.nearby(48.95, 2.45)], [third_stop.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            third_stop.stop.latitude = Decimal('48.980000')
+            third_stop.stop.save()
+        self.assertEqual(index.nearby(48.95, 2.45), [])
+        self.assertEqual(len(index.nearby(48.98, 2.45)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.status = 'completed'
+            self.trip.save()
+        self.assertEqual(len(index), 0)
+
+    @override_settings(GEOFENCE={'ENABLED': False})
+    def test_geofences_can_be_disabled(self):
+        self.save(self.drive([-0.0005, 0.003]))
+
+        self.first_stop.refresh_from_db()
+        self.assertIsNone(self.first_stop.actual_arrival_datetime)
+        self.assertIsNone(get_geofence_index())
+
+
+@override_settings(POSITION_STREAM={'MAX_DURATION': 0})
+class PositionStreamTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Stream Company', address='1 Event St')
+        self.other_company = Company.objects.create(name='Other Company', address='2 Event St')
+        UserProfile.objects.create(user=self.auth_user, company=self.company)
+        self.vehicle = self.create_vehicle(self.company, 'SSE-001')
+        self.other_vehicle = self.create_vehicle(self.other_company, 'SSE-002')
+        self.start = timezone.now() - timedelta(minutes=10)
+
+    def create_vehicle(self, company, license_plate):
+        return Vehicle.objects.create(
+            company=company, license_plate=license_plate, make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+
+    def store(self, vehicle, minutes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return save_positions([
+                Position(vehicle=vehicle, latitude=45.764, longitude=4.8357, speed=30, heading=90,
+                         timestamp=self.start + timedelta(minutes=minute))
+                for minute in minutes
+            ])['stored']
+
+    def events(self, content):
+        """(id, data) of the position events of a stream body"""
+        events = []
+        for block in content.split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+            if fields.get('event') == 'position':
+                events.append((int(fields['id']), json.loads(fields['data'])))
+        return events
+
+    def stream(self, **headers):
+        response = self.authenticated_request('GET', '/api/positions/stream/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response
+
+    def test_resume_from_last_event_id(self):
+        first = self.store(self.vehicle, [0])[0]
+        self.store(self.other_vehicle, [1])
+        missed = self.store(self.vehicle, [2, 3])
+
+        body = b''.join(self.stream(**{'Last-Event-ID': str(first.id)}).streaming_content).decode()
+        self.assertTrue(body.startswith('retry: 3000\n\n'))
+        events = self.events(body)
+        self.assertEqual([event_id for event_id, _ in events], [position.id for position in missed])
+        self.assertEqual(events[0][1]['vehicle_license_plate'], 'SSE-001')
+
+        # Without Last-Event-ID, only positions stored from now on
+        self.assertEqual(self.events(b''.join(self.stream().streaming_content).decode()), [])
+
+    @override_settings(POSITION_STREAM={'MAX_DURATION': 60, 'POLL_INTERVAL': 30})
+    def test_new_positions_pushed(self):
+        response = self.stream()
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 3000\n\n')
+
+        stored = self.store(self.vehicle, [0, 1])
+        started_at = time.monotonic()
+        events = self.events(next(content).decode())
+        # Woken by the commit rather than the 30 second poll
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual([event_id for event_id, _ in events], [position.id for position in stored])
+        response.close()
+
+    @override_settings(POSITION_STREAM={'MAX_DURATION': 0.3, 'HEARTBEAT_INTERVAL': 0.05, 'POLL_INTERVAL': 0.05})
+    def test_heartbeats(self):
+        body = b''.join(self.stream().streaming_content).decode()
+        self.assertIn(': heartbeat\n\n', body)
+
+    def test_notifier(self):
+        notifier = PositionNotifier()
+        self.assertFalse(notifier.wait(0, 0.01))
+        threading.Timer(0.05, notifier.publish).start()
+        self.assertTrue(notifier.wait(0, 5))
+        self.assertFalse(notifier.wait(1, 0))
+
+        generation = position_notifier.generation
+        self.store(self.vehicle, [0])
+        self.assertEqual(position_notifier.generation, generation + 1)
+        # Only positions actually stored wake the streams
+        self.store(self.vehicle, [0])
+        self.assertEqual(position_notifier.generation, generation + 1)
+
+    def test_stream_validation(self):
+        response = self.authenticated_request('GET', '/api/positions/stream/', headers={'Last-Event-ID': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+        UserProfile.objects.filter(user=self.auth_user).delete()
+        self.auth_user.refresh_from_db()
+        response = self.authenticated_request('GET', '/api/positions/stream/')
+        self.assertEqual(response.status_code, 400)
+
+
+
+# The stream reads positions on a thread of its own, which only sees committed rows
+@override_settings(POSITION_STREAM={'MAX_DURATION': 60, 'POLL_INTERVAL': 0.1})
+class PositionStreamAsgiTestCase(TransactionTestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        company = Company.objects.create(name='Stream Company', address='1 Event St')
+        UserProfile.objects.create(user=self.auth_user, company=company)
+        vehicle = Vehicle.objects.create(
+            company=company, license_plate='SSE-ASGI', make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+        self.stored = save_positions([
+            Position(vehicle=vehicle, latitude=45.764, longitude=4.8357, speed=30, heading=90,
+                     timestamp=timezone.now() - timedelta(minutes=minute))
+            for minute in range(2)
+        ])['stored']
+
+    async def test_events_sent_while_stream_open(self):
+        communicator = ApplicationCommunicator(asgi_application, {
+            'type': 'http', 'method': 'GET', 'path': '/api/positions/stream/', 'query_string': b'',
+            'headers': [(b'authorization', f'Token {self.token.key}'.encode()), (b'last-event-id', b'0')],
+        })
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(5)
+        self.assertEqual(start['status'], 200)
+
+        # Sent right away rather than when the stream ends, a minute later
+        message = await communicator.receive_output(5)
+        self.assertEqual(message['body'], b'retry: 3000\n\n')
+        message = await communicator.receive_output(5)
+        for position in self.stored:
+            self.assertIn(f'id: {position.id}\nevent: position\n'.encode(), message['body'])
+        self.assertTrue(message['more_body'])
+        self.assertTrue(await communicator.receive_nothing(0.3))
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+
+
+class LiveUpdatesTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Live Company', address='1 Socket St')
+        self.other_company = Company.objects.create(name='Other Company', address='2 Socket St')
+        UserProfile.objects.create(user=self.auth_user, company=self.company)
+        self.vehicle = self.create_vehicle(self.company, 'LIVE-001')
+        self.other_vehicle = self.create_vehicle(self.other_company, 'LIVE-002')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def create_vehicle(self, company, license_plate):
+        return Vehicle.objects.create(
+            company=company, license_plate=license_plate, make='Ford', model='Transit', year=2022,
+            capacity=2.5, driver_name='Driver', driver_email='driver@example.com',
+        )
+
+    def subscribe(self, *topics, max_size=256):
+        subscription = Subscription(self.loop, max_size)
+        event_hub.subscribe(topics, subscription)
+        self.addCleanup(event_hub.unsubscribe, subscription)
+        return subscription
+
+    def received(self, subscription):
+        if not len(subscription):
+            return []
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+
+    def test_queue_coalesces_and_drops(self):
+        subscription = Subscription(self.loop, max_size=2)
+        subscription.push(('trip', 1), {'id': 1, 'version': 1})
+        subscription.push(('trip', 2), {'id': 2})
+        subscription.push(('trip', 1), {'id': 1, 'version': 2})
+        self.assertEqual(self.received(subscription), [{'id': 1, 'version': 2}, {'id': 2}])
+
+        for trip_id in range(5):
+            subscription.push(('trip', trip_id), {'id': trip_id})
+        self.assertEqual(self.received(subscription), [{'type': 'overflow', 'dropped': 3}, {'id': 3}, {'id': 4}])
+
+    def test_trip_and_order_changes_published_on_commit(self):
+        subscription = self.subscribe(company_topic(self.company.id), 'orders')
+        other = self.subscribe(company_topic(self.other_company.id))
+        dispatcher = User.objects.create_user(username='live-dispatcher', password='pass')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trip = Trip.objects.create(
+                vehicle=self.vehicle, dispatcher=dispatcher, name='Live run', status='planned',
+                planned_start_date=timezone.now().date(), planned_start_time=timezone.now().time(),
+            )
+            stop = Stop.objects.create(name='Dock', address='1 Dock St', stop_type='pickup')
+            trip_stop = TripStop.objects.create(trip=trip, stop=stop, sequence=1,
+                                                planned_arrival_time=timezone.now().time())
+            # Coalesced with the creation
+            trip.name = 'Renamed run'
+            trip.save()
+            self.assertEqual(self.received(subscription), [])
+
+        self.assertEqual(self.received(subscription), [
+            {'type': 'trip', 'action': 'updated', 'id': trip.id},
+            {'type': 'stop', 'action': 'created', 'id': stop.id, 'order_id': None},
+            {'type': 'trip_stop', 'action': 'created', 'id': trip_stop.id, 'trip_id': trip.id},
+        ])
+        self.assertEqual(self.received(other), [])
+
+        trip_stop_id = trip_stop.id
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(customer_name='Live Customer', goods_description='Boxes')
+            trip_stop.delete()
+        self.assertEqual(self.received(subscription), [
+            {'type': 'order', 'action': 'created', 'id': order.id},
+            {'type': 'trip_stop', 'action': 'deleted', 'id': trip_stop_id, 'trip_id': trip.id},
+        ])
+
+    def test_positions_published_per_vehicle(self):
+        subscription = self.subscribe(company_topic(self.company.id))
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            stored = save_positions([
+                Position(vehicle=vehicle, latitude=45.764, longitude=4.8357, speed=30, heading=90,
+                         timestamp=now - timedelta(seconds=seconds))
+                for vehicle in (self.vehicle, self.other_vehicle) for seconds in (0, 30)
+            ])['stored']
+
+        event, = self.received(subscription)
+        self.assertEqual(event['type'], 'position')
+        self.assertEqual(event['vehicle_id'], self.vehicle.id)
+        self.assertEqual(event['id'], stored[0].id)
+        self.assertEqual(event['timestamp'], now.isoformat())
+
+    async def connect(self, token):
+        communicator = ApplicationCommunicator(asgi_application, {
+            'type': 'websocket', 'path': '/ws/live/', 'query_string': f'token={token}'.encode(),
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(5)
+
+    async def test_websocket(self):
+        communicator, message = await self.connect(self.token.key)
+        self.assertEqual(message, {'type': 'websocket.accept'})
+
+        event_hub.publish(company_topic(self.company.id), ('trip', 1), {'type': 'trip', 'action': 'updated', 'id': 1})
+        event_hub.publish(company_topic(self.other_company.id), ('trip', 2), {'type': 'trip', 'id': 2})
+        message = await communicator.receive_output(5)
+        self.assertEqual(json.loads(message['text']), {'type': 'trip', 'action': 'updated', 'id': 1})
+        self.assertTrue(await communicator.receive_nothing(0.1))
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+        self.assertFalse(event_hub.has_subscribers())
+
+    async def test_websocket_refused(self):
+        communicator, message = await self.connect('not-a-token')
+        self.assertEqual(message, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+
+        await UserProfile.objects.filter(user=self.auth_user).adelete()
+        communicator, message = await self.connect(self.token.key)
+        self.assertEqual(message, {'type': 'websocket.close', 'code': CLOSE_NO_COMPANY})
+
+
+class PositionWriteBufferTestCase(TestCase, AuthenticatedTestMixin):
+    def setUp(self):
+        self.setUp_auth()
+        self.company = Company.objects.create(name='Buffer Company', address='1 Queue St')
+        self.vehicle = Vehicle.objects.create(
+            company=self.company,
+            license_plate='BUF-001',
+            make='Volvo',
+            model='FH',
+            year=2022,
+            capacity=26.0,
+            driver_name='Buffer Driver',
+            driver_email='buffer@example.com',
+        )
+        # Commit from the test thread instead of a background writer thread
+        patcher = patch.object(PositionWriteBuffer, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, buffer_module, '_buffer', None)
+
+    def make_positions(self, count):
+        start = timezone.now()
+        return [
+            Position(
+                vehicle=self.vehicle,
+                latitude=48.8566,
+                longitude=2.3522,
+                speed=50.0,
+                heading=90.0,
+                timestamp=start + timedelta(seconds=i),
+            )
+            for i in range(count)
+        ]
+
+    def test_flush_group_commits_in_batches(self):
+        buffer = PositionWriteBuffer(max_batch_size=2, max_delay=60)
+
+        self.assertTrue(buffer.submit(self.make_positions(5)))
+        self.assertEqual(buffer.stats()['queue_depth'], 5)
+        self.assertEqual(Position.objects.count(), 0)
+
+        self.assertEqual(buffer.flush(), 5)
+
+        stats = buffer.stats()
+        self.assertEqual(Position.objects.count(), 5)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['submitted'], 5)
+        self.assertEqual(stats['committed'], 5)
+
+    def test_partial_batch_keeps_age_of_remaining_positions(self):
+        buffer = PositionWriteBuffer(max_batch_size=2, max_delay=1)
+
+        with patch('positions.buffer.time.monotonic', return_value=100.0):
+            buffer.submit(self.make_positions(3))
+        with patch('positions.buffer.time.monotonic', return_value=100.5):
+            buffer.submit(self.make_positions(1))
+
+        with patch('positions.buffer.time.monotonic', return_value=101.0):
+            self.assertEqual(len(buffer._take_batch()), 2)
+            # The third position has waited since 100.0, so the rest is due now
+            self.assertEqual(buffer.stats()['oldest_pending_seconds'], 1.0)
+            self.assertTrue(buffer._batch_due())
+
+        with patch('positions.buffer.time.monotonic', return_value=101.0):
+            self.assertEqual(len(buffer._take_batch()), 2)
+        self.assertIsNone(buffer._oldest_enqueued_at)
+
+    def test_submit_rejects_when_queue_is_full(self):
+        buffer = PositionWriteBuffer(max_queue_size=3)
+
+        self.assertTrue(buffer.submit(self.make_positions(2)))
+        self.assertFalse(buffer.submit(self.make_positions(2)))
+        self.assertEqual(buffer.stats()['rejected_full'], 2)
+
+    def test_stop_flushes_pending_positions(self):
+        buffer = PositionWriteBuffer()
+        buffer.submit(self.make_positions(3))
+
+        buffer.stop()
+
+        self.assertEqual(Position.objects.count(), 3)
+
+    def test_failed_batch_is_retried_one_by_one(self):
+        buffer = PositionWriteBuffer()
+        positions = self.make_positions(3)
+        buffer.submit(positions)
+
+        def save_or_fail(batch):
+            if positions[1] in batch:
+                raise IntegrityError('broken row')
+            return save_positions(batch)
+
+        with patch('positions.services.save_positions', side_effect=save_or_fail):
+            with self.assertLogs('positions.buffer', level='ERROR'):
+                self.assertEqual(buffer.flush(), 2)
+
+        self.assertEqual(buffer.stats()['failed'], 1)
+        self.assertEqual(Position.objects.count(), 2)
+
+    @override_settings(POSITION_WRITE_BUFFER={'ENABLED': True, 'MAX_BATCH_SIZE': 500, 'MAX_DELAY': 0.2})
+    def test_create_position_is_queued_when_buffer_enabled(self):
+        position_data = {
+            'vehicle_id': self.vehicle.id,
+            'latitude': 48.8566,
+            'longitude': 2.3522,
+            'speed': 30.0,
+            'heading': 45.0,
+        }
+
+        response = self.authenticated_request('POST', '/api/positions/',
+                                            data=json.dumps(position_data),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+
+        response = self.authenticated_request('POST', '/api/positions/bulk/',
+                                            data=json.dumps([{**position_data, 'timestamp': '2024-01-15T14:30:00Z'}]),
+                                            content_type='application/json')
+        self.assertEqual(response.json()['accepted'], 1)
+
+        stats = self.authenticated_request('GET', '/api/positions/ingest-stats/').json()
+        self.assertTrue(stats['write_buffer_enabled'])
+        self.assertEqual(stats['queue_depth'], 2)
+        self.assertEqual(Position.objects.count(), 0)
+
+        get_position_buffer().flush()
+        self.assertEqual(Position.objects.count(), 2)
+
+    def test_ingest_stats_when_buffer_disabled(self):
+        response = self.authenticated_request('GET', '/api/positions/ingest-stats/')
+        self.assertEqual(response.json(), {'write_buffer_enabled': False})
@@ -0,0 +1,186 @@
+import math
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from django.core.cache import cache
+from django.db.models import Count, Max
+from .archive import ARCHIVE_FIELDS
+from .history import archive_chunk_cache, overlapping_archives, position_rows
+from .models import Position
+
+# Web Mercator: metres per pixel at zoom 0 with 256 px tiles
+EARTH_RADIUS = 6378137.0
+METERS_PER_PIXEL_ZOOM_0 = 2 * math.pi * EARTH_RADIUS / 256
+
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+# Points closer than this many screen pixels to the simplified line are dropped
+TRACK_TOLERANCE_PIXELS = 1.0
+
+# Simplified day tracks are cached for this long; entries are also keyed on the
+# day's point count and newest ID, so late points never serve a stale track
+TRACK_CACHE_TIMEOUT = 24 * 3600
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Simplification tolerance in Web Mercator metres for a map zoom level"""
+    return METERS_PER_PIXEL_ZOOM_0 / (2 ** zoom) * TRACK_TOLERANCE_PIXELS
+
+
+def mercator(latitude: float, longitude: float) -> Tuple[float, float]:
+    """Project WGS84 coordinates to Web Mercator metres"""
+    latitude = max(min(latitude, 85.05112878), -85.05112878)
+    x = EARTH_RADIUS * math.radians(longitude)
+    y = EARTH_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2))
+    return x, y
+
+
+def douglas_peucker(points: Sequence[Tuple[float, float]], tolerance: float) -> List[int]:
+    """
+    Simplify a polyline with the Douglas-Peucker algorithm.
+
+    Iterative rather than recursive, so long tracks cannot hit the recursion
+    limit. Distances are measured to the segment, not the infinite line, so
+    tracks that double back on themselves keep their turning points.
+
+    Args:
+        points: Planar (x, y) coordinates, in the same unit as ``tolerance``
+        tolerance: Maximum distance between a dropped point and the simplified line
+
+    Returns:
+        Sorted indexes of the points to keep, always including both ends
+    """
+    count = len(points)
+    if count < 3:
+        return list(range(count))
+
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    tolerance_squared = tolerance * tolerance
+    stack = [(0, count - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first]
+        bx, by = points[last]
+        dx, dy = bx - ax, by - ay
+        length_squared = dx * dx + dy * dy
+
+        farthest, farthest_distance = 0, -1.0
+        for index in range(first + 1, last):
+            px, py = points[index]
+            if length_squared:
+                t = ((px - ax) * dx + (py - ay) * dy) / length_squared
+                t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                ex, ey = px - (ax + t * dx), py - (ay + t * dy)
+            else:
+                ex, ey = px - ax, py - ay
+            distance = ex * ex + ey * ey
+            if distance > farthest_distance:
+                farthest, farthest_distance = index, distance
+
+        if farthest_distance > tolerance_squared:
+            keep[farthest] = True
+            if farthest - first > 1:
+                stack.append((first, farthest))
+            if last - farthest > 1:
+                stack.append((farthest, last))
+
+    return [index for index in range(count) if keep[index]]
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def simplified_day_track(vehicle_id: int, day: date, zoom: int) -> List[Tuple[datetime, str, str]]:
+    """
+    Simplified track of a vehicle over one UTC day, cached per (vehicle, day, tolerance).
+
+    Returns:
+        List of (timestamp, latitude, longitude) tuples, oldest first
+    """
+    start, end = day_bounds(day)
+    positions = Position.objects.filter(vehicle_id=vehicle_id, timestamp__gte=start, timestamp__lt=end)
+
+    version = positions.aggregate(count=Count('id'), newest_id=Max('id'))
+    archives = list(overlapping_archives(vehicle_id, start, end).order_by('id').values_list('id', 'updated_at'))
+    if not version['count'] and not archives:
+        return []
+
+    tolerance = zoom_tolerance(zoom)
+    # Archiving a day or merging late points into its file changes the key too
+    archive_version = '-'.join(f"{archive_id}.{updated_at.timestamp():.6f}" for archive_id, updated_at in archives)
+    cache_key = (
+        f"positions:track:{vehicle_id}:{day.isoformat()}:{tolerance:.3f}:"
+        f"{version['count']}:{version['newest_id']}:{archive_version}"
+    )
+    track = cache.get(cache_key)
+    if track is not None:
+        return track
+
+    rows = [(row[1], row[2], row[3]) for row in position_rows(vehicle_id, start, end)]
+    projected = [mercator(float(latitude), float(longitude)) for _, latitude, longitude in rows]
+
+    track = []
+    for index in douglas_peucker(projected, tolerance):
+        timestamp, latitude, longitude = rows[index]
+        track.append((timestamp, f"{latitude:.7f}", f"{longitude:.7f}"))
+
+    cache.set(cache_key, track, TRACK_CACHE_TIMEOUT)
+    return track
+
+
+def boundary_rows(vehicle_id: int, since: datetime, until: datetime) -> Tuple[Optional[Tuple], Optional[Tuple]]:
+    """A vehicle's first and last positions in [since, until), from the table or the archive, in ARCHIVE_FIELDS order"""
+    positions = Position.objects.filter(vehicle_id=vehicle_id, timestamp__gte=since, timestamp__lt=until)
+    first = positions.order_by('timestamp').values_list(*ARCHIVE_FIELDS).first()
+    last = positions.order_by('-timestamp').values_list(*ARCHIVE_FIELDS).first()
+    for archive in overlapping_archives(vehicle_id, since, until):
+        archived = [row for row in archive_chunk_cache.get(archive) if since <= row[1] < until]
+        if archived:
+            if first is None or archived[0][1] < first[1]:
+                first = archived[0]
+            if last is None or archived[-1][1] > last[1]:
+                last = archived[-1]
+    return first, last
+
+
+def simplified_track(vehicle_id: int, since: datetime, until: datetime, zoom: int) -> List[Dict[str, Any]]:
+    """
+    Simplified track of a vehicle between ``since`` and ``until``.
+
+    Each UTC day in the range is simplified and cached on its own, so moving
+    the range or refreshing the map only recomputes days whose points changed.
+    On days the range only partly covers, the simplified points are cut to the
+    range and its true first and last points are added back, as the day's
+    simplification keeps points based on the whole day.
+
+    Args:
+        vehicle_id: Vehicle whose track to return
+        since: Start of the range (inclusive)
+        until: End of the range (exclusive)
+        zoom: Map zoom level the track is drawn at
+
+    Returns:
+        List of points with 'latitude', 'longitude' and 'timestamp', oldest first
+    """
+    day = since.astimezone(dt_timezone.utc).date()
+    last_day = (until.astimezone(dt_timezone.utc) - timedelta(microseconds=1)).date()
+
+    results = []
+    while day <= last_day:
+        start, end = day_bounds(day)
+        track = [point for point in simplified_day_track(vehicle_id, day, zoom) if since <= point[0] < until]
+        if since > start or until < end:
+            first, last = boundary_rows(vehicle_id, max(since, start), min(until, end))
+            if first is not None and (not track or track[0][0] != first[1]):
+                track.insert(0, (first[1], f"{first[2]:.7f}", f"{first[3]:.7f}"))
+            if last is not None and track[-1][0] != last[1]:
+                track.append((last[1], f"{last[2]:.7f}", f"{last[3]:.7f}"))
+
+        for timestamp, latitude, longitude in track:
+            results.append({'latitude': latitude, 'longitude': longitude, 'timestamp': timestamp.isoformat()})
+        day += timedelta(days=1)
+    return results
@@ -1,8 +1,28 @@
 from django.urls import path
-from .views import PositionListCreateView, GenerateFakeView, LatestPositionsView
+from .views import (
+    PositionListCreateView,
+    PositionBulkCreateView,
+    PositionIngestStatsView,
+    GenerateFakeView,
+    LatestPositionsView,
+    RecentTrackView,
+    PositionStreamView,
+    SimplifiedTrackView,
+    PositionRollupListView,
+    PositionExportView,
+    PositionDistanceView,
+)
 
 urlpatterns = [
     path('positions/', PositionListCreateView.as_view(), name='position-list-create'),
+    path('positions/bulk/', PositionBulkCreateView.as_view(), name='position-bulk-create'),
+    path('positions/ingest-stats/', PositionIngestStatsView.as_view(), name='position-ingest-stats'),
     path('positions/latest/', LatestPositionsView.as_view(), name='latest-positions'),
+    path('positions/stream/', PositionStreamView.as_view(), name='position-stream'),
+    path('positions/recent/', RecentTrackView.as_view(), name='recent-track'),
+    path('positions/track/', SimplifiedTrackView.as_view(), name='simplified-track'),
+    path('positions/rollups/', PositionRollupListView.as_view(), name='position-rollups'),
+    path('positions/distance/', PositionDistanceView.as_view(), name='position-distance'),
+    path('positions/export/', PositionExportView.as_view(), name='position-export'),
     path('positions/generate-fake/', GenerateFakeView.as_view(), name='generate-fake-positions'),
 ]
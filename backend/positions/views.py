@@ -3,40 +3,115 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.utils import timezone
-from django.db.models import OuterRef, Subquery
 import json
 import random
-from datetime import datetime, timedelta
-from .models import Position
+from datetime import date, timedelta
+from .models import Position, VehicleLatestPosition, PositionMinuteRollup, PositionHourRollup
+from .buffer import get_position_buffer
+from .fleet_state import get_fleet_state
+from .stream import iter_position_events, stream_settings
+from .tracks import simplified_track, MIN_ZOOM, MAX_ZOOM
+from .export import export_vehicle_days, iter_export_zip
+from .distance import daily_distances, trip_distances
+from .services import (
+    build_position,
+    store_positions,
+    ingest_positions,
+    ingest_position_stream,
+    parse_timestamp,
+    position_history,
+    iter_position_history,
+    PositionValidationError,
+    DEFAULT_HISTORY_LIMIT,
+)
+from companies.models import Company
 from vehicles.models import Vehicle
+from dashmap.streaming import IncrementalStreamingHttpResponse, stream_results, wants_stream
+from dashmap.bbox import request_bbox
+
+MAX_BULK_POSITIONS = 5000
+DEFAULT_RECENT_TRACK_MINUTES = 60
+MAX_RECENT_TRACK_MINUTES = 24 * 60
+MAX_TRACK_RANGE = timedelta(days=7)
+MAX_EXPORT_DAYS = 31
+MAX_DISTANCE_DAYS = 31
+
+# Rollup table and longest range served for each resolution
+ROLLUP_RESOLUTIONS = {
+    'minute': (PositionMinuteRollup, timedelta(days=7)),
+    'hour': (PositionHourRollup, timedelta(days=366)),
+}
+
+
+def serialize_position(position):
+    """Serialize a position with its vehicle, as returned by the position endpoints"""
+    return {
+        'id': position.id,
+        'vehicle_id': position.vehicle.id,
+        'vehicle_license_plate': position.vehicle.license_plate,
+        'latitude': f"{position.latitude:.7f}",
+        'longitude': f"{position.longitude:.7f}",
+        'speed': f"{position.speed:.2f}",
+        'heading': f"{position.heading:.2f}",
+        'altitude': f"{position.altitude:.2f}" if position.altitude else None,
+        'timestamp': position.timestamp.isoformat(),
+        'odometer': f"{position.odometer:.2f}" if position.odometer else None,
+        'fuel_level': f"{position.fuel_level:.2f}" if position.fuel_level else None,
+        'engine_status': position.engine_status,
+        'created_at': position.created_at.isoformat()
+    }
+
+
+def serialize_latest_position(latest):
+    """Serialize a latest-position snapshot with its vehicle, as returned by /api/positions/latest/"""
+    return {
+        'id': latest.position_id,
+        'vehicle_id': latest.vehicle.id,
+        'vehicle_license_plate': latest.vehicle.license_plate,
+        'vehicle_make_model': f"{latest.vehicle.make} {latest.vehicle.model}",
+        'latitude': f"{latest.latitude:.7f}",
+        'longitude': f"{latest.longitude:.7f}",
+        'speed': f"{latest.speed:.2f}",
+        'heading': f"{latest.heading:.2f}",
+        'altitude': f"{latest.altitude:.2f}" if latest.altitude else None,
+        'timestamp': latest.timestamp.isoformat(),
+        'odometer': f"{latest.odometer:.2f}" if latest.odometer else None,
+        'fuel_level': f"{latest.fuel_level:.2f}" if latest.fuel_level else None,
+        'engine_status': latest.engine_status,
+        'created_at': latest.created_at.isoformat()
+    }
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class PositionListCreateView(View):
     def get(self, request):
-        positions = Position.objects.select_related('vehicle', 'vehicle__company').all()
+        """Get one page of position history, newest first"""
+        try:
+            vehicle_id = request.GET.get('vehicle')
+            since = request.GET.get('since')
+            until = request.GET.get('until')
+            filters = {
+                'vehicle_id': int(vehicle_id) if vehicle_id else None,
+                'since': parse_timestamp(since) if since else None,
+                'until': parse_timestamp(until) if until else None,
+                'bbox': request_bbox(request),
+            }
 
-        vehicle_id = request.GET.get('vehicle')
-        if vehicle_id:
-            positions = positions.filter(vehicle_id=vehicle_id)
+            if wants_stream(request):
+                # Export the whole range without holding it in memory
+                return stream_results(iter_position_history(**filters), serialize_position)
 
-        data = []
-        for position in positions:
-            data.append({
-                'id': position.id,
-                'vehicle_id': position.vehicle.id,
-                'vehicle_license_plate': position.vehicle.license_plate,
-                'latitude': f"{position.latitude:.7f}",
-                'longitude': f"{position.longitude:.7f}",
-                'speed': f"{position.speed:.2f}",
-                'heading': f"{position.heading:.2f}",
-                'altitude': f"{position.altitude:.2f}" if position.altitude else None,
-                'timestamp': position.timestamp.isoformat(),
-                'odometer': f"{position.odometer:.2f}" if position.odometer else None,
-                'fuel_level': f"{position.fuel_level:.2f}" if position.fuel_level else None,
-                'engine_status': position.engine_status,
-                'created_at': position.created_at.isoformat()
-            })
-        return JsonResponse({'results': data})
+            limit = int(request.GET.get('limit', DEFAULT_HISTORY_LIMIT))
+            if limit < 1:
+                raise ValueError('limit must be a positive integer')
+            positions, next_cursor = position_history(cursor=request.GET.get('cursor'), limit=limit, **filters)
+        except PositionValidationError as e:
+            return JsonResponse({'error': f'Invalid data: {e.message}'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        data = [serialize_position(position) for position in positions]
+        return JsonResponse({'results': data, 'next_cursor': next_cursor})
 
     def post(self, request):
         try:
@@ -48,45 +123,77 @@ class PositionListCreateView(View):
             except Vehicle.DoesNotExist:
                 return JsonResponse({'error': 'Vehicle not found'}, status=400)
 
-            # Parse timestamp if provided, otherwise use current time
-            timestamp = data.get('timestamp')
-            if timestamp:
-                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            else:
-                timestamp = timezone.now()
-
-            position = Position.objects.create(
-                vehicle=vehicle,
-                latitude=data['latitude'],
-                longitude=data['longitude'],
-                speed=data['speed'],
-                heading=data['heading'],
-                altitude=data.get('altitude'),
-                timestamp=timestamp,
-                odometer=data.get('odometer'),
-                fuel_level=data.get('fuel_level'),
-                engine_status=data.get('engine_status', 'off')
-            )
+            position = build_position(data, {vehicle.id})
+            position.vehicle = vehicle
 
-            return JsonResponse({
-                'id': position.id,
-                'vehicle_id': position.vehicle.id,
-                'vehicle_license_plate': position.vehicle.license_plate,
-                'latitude': f"{position.latitude:.7f}",
-                'longitude': f"{position.longitude:.7f}",
-                'speed': f"{position.speed:.2f}",
-                'heading': f"{position.heading:.2f}",
-                'altitude': f"{position.altitude:.2f}" if position.altitude else None,
-                'timestamp': position.timestamp.isoformat(),
-                'odometer': f"{position.odometer:.2f}" if position.odometer else None,
-                'fuel_level': f"{position.fuel_level:.2f}" if position.fuel_level else None,
-                'engine_status': position.engine_status,
-                'created_at': position.created_at.isoformat()
-            }, status=201)
+            result = store_positions([position])
+            if result['duplicates']:
+                # Already stored: retries of the same point are acknowledged, not duplicated
+                return JsonResponse({
+                    'status': 'duplicate',
+                    'vehicle_id': vehicle.id,
+                    'timestamp': position.timestamp.isoformat()
+                }, status=200)
+
+            if result['queued']:
+                # Queued in the write-behind buffer, committed within a few hundred ms
+                return JsonResponse({
+                    'status': 'queued',
+                    'vehicle_id': vehicle.id,
+                    'timestamp': position.timestamp.isoformat()
+                }, status=202)
+
+            return JsonResponse(serialize_position(position), status=201)
+        except PositionValidationError as e:
+            return JsonResponse({'error': f'Invalid data: {e.message}'}, status=400)
         except (KeyError, json.JSONDecodeError, ValueError) as e:
             return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class PositionBulkCreateView(View):
+    def post(self, request):
+        """Ingest a batch of positions for any number of vehicles"""
+        if request.content_type == 'application/x-ndjson':
+            # Read the body line by line instead of loading it into memory
+            return JsonResponse(ingest_position_stream(request))
+
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        items = data.get('positions') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return JsonResponse({'error': 'Expected a list of positions'}, status=400)
+        if len(items) > MAX_BULK_POSITIONS:
+            return JsonResponse(
+                {'error': f'Too many positions: at most {MAX_BULK_POSITIONS} per request'},
+                status=400
+            )
+
+        results = ingest_positions(items)
+        statuses = [result['status'] for result in results]
+
+        return JsonResponse({
+            'accepted': statuses.count('accepted'),
+            'duplicates': statuses.count('duplicate'),
+            'rejected': statuses.count('rejected'),
+            'results': results
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PositionIngestStatsView(View):
+    def get(self, request):
+        """Report the state of the write-behind ingest buffer"""
+        buffer = get_position_buffer()
+        if buffer is None:
+            return JsonResponse({'write_buffer_enabled': False})
+
+        return JsonResponse({'write_buffer_enabled': True, **buffer.stats()})
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class GenerateFakeView(View):
     def post(self, request):
@@ -117,7 +224,7 @@ class GenerateFakeView(View):
                 lat_offset = random.uniform(-0.05, 0.05)
                 lng_offset = random.uniform(-0.05, 0.05)
 
-                position = Position.objects.create(
+                positions.append(Position(
                     vehicle=vehicle,
                     latitude=base_lat + lat_offset,
                     longitude=base_lng + lng_offset,
@@ -128,8 +235,9 @@ class GenerateFakeView(View):
                     odometer=random.uniform(10000, 50000) if random.random() > 0.3 else None,
                     fuel_level=random.uniform(10, 100) if random.random() > 0.2 else None,
                     engine_status=random.choice(['on', 'off', 'idle'])
-                )
-                positions.append(position)
+                ))
+
+            store_positions(positions)
 
             return JsonResponse({
                 'message': f'Generated {count} fake positions for vehicle {vehicle.license_plate}',
@@ -144,33 +252,281 @@ class GenerateFakeView(View):
 @method_decorator(csrf_exempt, name='dispatch')
 class LatestPositionsView(View):
     def get(self, request):
-        """Get the latest position for each vehicle"""
-        # Get latest position for each vehicle using subquery
-        latest_positions_subquery = Position.objects.filter(
-            vehicle=OuterRef('vehicle')
-        ).order_by('-timestamp').values('id')[:1]
+        """
+        Get the latest position for each vehicle, optionally within a ?bbox= viewport.
+
+        With ?since=<cursor>, only the vehicles whose latest position changed
+        after the cursor are returned, with the cursor to pass next time.
+        """
+        try:
+            bbox = request_bbox(request)
+            since = request.GET.get('since')
+            if since is not None:
+                since = int(since)
+                if since < 0:
+                    raise ValueError('since must not be negative')
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        if since is not None:
+            # Delta sync, always from the database, whose sequence numbers the cursor refers to
+            changed = VehicleLatestPosition.objects.select_related('vehicle').filter(sequence__gt=since)
+            if bbox is not None:
+                changed = changed.filter(bbox.q())
+            data = []
+            cursor = since
+            for latest in changed.order_by('sequence'):
+                data.append(serialize_latest_position(latest))
+                cursor = latest.sequence
+            return JsonResponse({'results': data, 'cursor': cursor})
+
+        fleet_state = get_fleet_state()
+        if fleet_state is not None:
+            # Served from memory, without touching the database
+            return JsonResponse({'results': fleet_state.latest(bbox)})
+
+        # One snapshot row per vehicle, maintained on ingest; deleted vehicles are left off, as in the fleet state
+        latest_positions = VehicleLatestPosition.objects.select_related('vehicle').filter(vehicle__deleted_at__isnull=True)
+        if bbox is not None:
+            latest_positions = latest_positions.filter(bbox.q())
+
+        data = []
+        for latest in latest_positions:
+            data.append(serialize_latest_position(latest))
+
+        return JsonResponse({'results': data})
+
+
+class PositionStreamView(View):
+    def get(self, request):
+        """Stream the positions of the caller's company as Server-Sent Events"""
+        profile = getattr(request.user, 'profile', None)
+        if profile is None:
+            return JsonResponse({'error': 'User has no associated company'}, status=400)
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        try:
+            last_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return JsonResponse({'error': f'Invalid data: invalid Last-Event-ID {last_event_id!r}'}, status=400)
+
+        response = IncrementalStreamingHttpResponse(
+            iter_position_events(profile.company_id, last_id, serialize_position, **stream_settings()),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Keeps nginx from buffering the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class RecentTrackView(View):
+    def get(self, request):
+        """Get the recent track of a vehicle, oldest point first"""
+        vehicle_id = request.GET.get('vehicle')
+        if not vehicle_id:
+            return JsonResponse({'error': 'vehicle parameter is required'}, status=400)
+
+        try:
+            vehicle_id = int(vehicle_id)
+            minutes = int(request.GET.get('minutes', DEFAULT_RECENT_TRACK_MINUTES))
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+        if not 0 < minutes <= MAX_RECENT_TRACK_MINUTES:
+            return JsonResponse(
+                {'error': f'minutes must be between 1 and {MAX_RECENT_TRACK_MINUTES}'},
+                status=400
+            )
 
-        latest_positions = Position.objects.filter(
-            id__in=Subquery(latest_positions_subquery)
-        ).select_related('vehicle', 'vehicle__company')
+        since = timezone.now() - timedelta(minutes=minutes)
+        fleet_state = get_fleet_state()
+        if fleet_state is not None and fleet_state.covers(vehicle_id, since):
+            return JsonResponse({'vehicle_id': vehicle_id, 'results': fleet_state.track(vehicle_id, since)})
 
+        # Older than what is kept in memory
+        positions = Position.objects.filter(vehicle_id=vehicle_id, timestamp__gte=since).order_by('timestamp')
         data = []
-        for position in latest_positions:
+        for latitude, longitude, speed, heading, timestamp in positions.values_list(
+            'latitude', 'longitude', 'speed', 'heading', 'timestamp'
+        ):
             data.append({
-                'id': position.id,
-                'vehicle_id': position.vehicle.id,
-                'vehicle_license_plate': position.vehicle.license_plate,
-                'vehicle_make_model': f"{position.vehicle.make} {position.vehicle.model}",
-                'latitude': f"{position.latitude:.7f}",
-                'longitude': f"{position.longitude:.7f}",
-                'speed': f"{position.speed:.2f}",
-                'heading': f"{position.heading:.2f}",
-                'altitude': f"{position.altitude:.2f}" if position.altitude else None,
-                'timestamp': position.timestamp.isoformat(),
-                'odometer': f"{position.odometer:.2f}" if position.odometer else None,
-                'fuel_level': f"{position.fuel_level:.2f}" if position.fuel_level else None,
-                'engine_status': position.engine_status,
-                'created_at': position.created_at.isoformat()
+                'latitude': f"{latitude:.7f}",
+                'longitude': f"{longitude:.7f}",
+                'speed': f"{speed:.2f}",
+                'heading': f"{heading:.2f}",
+                'timestamp': timestamp.isoformat()
             })
+        return JsonResponse({'vehicle_id': vehicle_id, 'results': data})
 
-        return JsonResponse({'results': data})
+
+class SimplifiedTrackView(View):
+    def get(self, request):
+        """Get a vehicle's track over a time range, simplified for a map zoom level"""
+        vehicle_id = request.GET.get('vehicle')
+        if not vehicle_id:
+            return JsonResponse({'error': 'vehicle parameter is required'}, status=400)
+
+        try:
+            vehicle_id = int(vehicle_id)
+            zoom = int(request.GET.get('zoom', MAX_ZOOM))
+            until = request.GET.get('until')
+            until = parse_timestamp(until) if until else timezone.now()
+            since = request.GET.get('since')
+            since = parse_timestamp(since) if since else until - timedelta(days=1)
+        except PositionValidationError as e:
+            return JsonResponse({'error': f'Invalid data: {e.message}'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            return JsonResponse({'error': f'zoom must be between {MIN_ZOOM} and {MAX_ZOOM}'}, status=400)
+        if not since < until <= since + MAX_TRACK_RANGE:
+            return JsonResponse(
+                {'error': f'since must be before until, at most {MAX_TRACK_RANGE.days} days apart'},
+                status=400
+            )
+
+        return JsonResponse({
+            'vehicle_id': vehicle_id,
+            'zoom': zoom,
+            'results': simplified_track(vehicle_id, since, until, zoom)
+        })
+
+
+def serialize_rollup(rollup):
+    """Serialize a minute or hour rollup of a vehicle's positions"""
+    return {
+        'bucket': rollup.bucket.isoformat(),
+        'point_count': rollup.point_count,
+        'first_timestamp': rollup.first_timestamp.isoformat(),
+        'last_timestamp': rollup.last_timestamp.isoformat(),
+        'first_latitude': f"{rollup.first_latitude:.7f}",
+        'first_longitude': f"{rollup.first_longitude:.7f}",
+        'last_latitude': f"{rollup.last_latitude:.7f}",
+        'last_longitude': f"{rollup.last_longitude:.7f}",
+        'average_speed': f"{rollup.average_speed:.2f}",
+        'max_speed': f"{rollup.max_speed:.2f}",
+        'distance': f"{rollup.distance:.2f}",
+        'min_fuel_level': f"{rollup.min_fuel_level:.2f}" if rollup.min_fuel_level is not None else None,
+        'max_fuel_level': f"{rollup.max_fuel_level:.2f}" if rollup.max_fuel_level is not None else None,
+        'min_odometer': f"{rollup.min_odometer:.2f}" if rollup.min_odometer is not None else None,
+        'max_odometer': f"{rollup.max_odometer:.2f}" if rollup.max_odometer is not None else None,
+    }
+
+
+class PositionRollupListView(View):
+    def get(self, request):
+        """Get a vehicle's per-minute or per-hour position rollups over a time range"""
+        vehicle_id = request.GET.get('vehicle')
+        if not vehicle_id:
+            return JsonResponse({'error': 'vehicle parameter is required'}, status=400)
+
+        resolution = request.GET.get('resolution', 'hour')
+        if resolution not in ROLLUP_RESOLUTIONS:
+            return JsonResponse({'error': f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}"}, status=400)
+        model, max_range = ROLLUP_RESOLUTIONS[resolution]
+
+        try:
+            vehicle_id = int(vehicle_id)
+            until = request.GET.get('until')
+            until = parse_timestamp(until) if until else timezone.now()
+            since = request.GET.get('since')
+            since = parse_timestamp(since) if since else until - timedelta(days=1)
+        except PositionValidationError as e:
+            return JsonResponse({'error': f'Invalid data: {e.message}'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        if not since < until <= since + max_range:
+            return JsonResponse(
+                {'error': f'since must be before until, at most {max_range.days} days apart for {resolution} rollups'},
+                status=400
+            )
+
+        rollups = model.objects.filter(vehicle_id=vehicle_id, bucket__gte=since, bucket__lt=until)
+        return JsonResponse({
+            'vehicle_id': vehicle_id,
+            'resolution': resolution,
+            'results': [serialize_rollup(rollup) for rollup in rollups]
+        })
+
+
+class PositionExportView(View):
+    def get(self, request):
+        """Download a company's positions as a zip of .npy files, one per vehicle-day"""
+        company_id = request.GET.get('company')
+        if not company_id:
+            return JsonResponse({'error': 'company parameter is required'}, status=400)
+
+        try:
+            company_id = int(company_id)
+            since = date.fromisoformat(request.GET.get('since', ''))
+            until = date.fromisoformat(request.GET.get('until', ''))
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        if not since <= until < since + timedelta(days=MAX_EXPORT_DAYS):
+            return JsonResponse(
+                {'error': f'since must not be after until, at most {MAX_EXPORT_DAYS} days in total'},
+                status=400
+            )
+        if not Company.objects.filter(id=company_id).exists():
+            return JsonResponse({'error': 'Company not found'}, status=400)
+
+        vehicle_ids = Vehicle.objects.filter(company_id=company_id).values_list('id', flat=True)
+        response = IncrementalStreamingHttpResponse(
+            iter_export_zip(export_vehicle_days(vehicle_ids, since, until)),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="positions-{company_id}-{since}-{until}.zip"'
+        return response
+
+
+class PositionDistanceView(View):
+    def get(self, request):
+        """Get the distance driven per vehicle-day and per trip, computed from the positions"""
+        vehicle_id = request.GET.get('vehicle')
+        company_id = request.GET.get('company')
+        if not vehicle_id and not company_id:
+            return JsonResponse({'error': 'vehicle or company parameter is required'}, status=400)
+
+        try:
+            since = date.fromisoformat(request.GET.get('since', ''))
+            until = date.fromisoformat(request.GET.get('until', ''))
+            if vehicle_id:
+                vehicle_ids = [int(vehicle_id)]
+            else:
+                vehicle_ids = list(Vehicle.objects.filter(company_id=int(company_id)).values_list('id', flat=True))
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid data: {str(e)}'}, status=400)
+
+        if not since <= until < since + timedelta(days=MAX_DISTANCE_DAYS):
+            return JsonResponse(
+                {'error': f'since must not be after until, at most {MAX_DISTANCE_DAYS} days in total'},
+                status=400
+            )
+
+        return JsonResponse({
+            'results': [
+                {
+                    'vehicle_id': day['vehicle_id'],
+                    'day': day['day'].isoformat(),
+                    'point_count': day['point_count'],
+                    'distance_km': f"{day['distance'] / 1000:.3f}",
+                    'odometer_km': f"{day['odometer_distance']:.2f}" if day['odometer_distance'] is not None else None,
+                }
+                for day in daily_distances(vehicle_ids, since, until)
+            ],
+            'trips': [
+                {
+                    'trip_id': window['trip'].id,
+                    'trip_name': window['trip'].name,
+                    'vehicle_id': window['trip'].vehicle_id,
+                    'start': window['start'].isoformat(),
+                    'end': window['end'].isoformat(),
+                    'point_count': window['point_count'],
+                    'distance_km': f"{window['distance'] / 1000:.3f}",
+                }
+                for window in trip_distances(vehicle_ids, since, until)
+            ],
+        })
@@ -292,16 +292,15 @@ def update_trip_stop_sequences(trip: Trip, new_sequences: List[Dict[str, Any]])
             raise TripValidationError("Some trip stops do not belong to this trip")
 
         # First, set all orders to very high values to avoid constraint conflicts
-        # Use values starting from 10000 to avoid conflicts with existing orders
+        # Use values starting from 10000 to avoid conflicts with existing orders.
+        # Updated without signals: only the final order is logged and published
         for i, sequence_item in enumerate(new_sequences):
-            trip_stop = TripStop.objects.get(id=sequence_item["id"], trip=trip)
-            trip_stop.sequence = 10000 + i  # Use high values temporarily
-            trip_stop.save()
+            TripStop.objects.filter(id=sequence_item["id"], trip=trip).update(sequence=10000 + i)
 
-        # Then set the final order values
+        # Then set the final order values, saving each stop once
         for sequence_item in new_sequences:
             trip_stop = TripStop.objects.get(id=sequence_item["id"], trip=trip)
             sequence_value = sequence_item.get("sequence")
             if sequence_value is not None:
                 trip_stop.sequence = sequence_value
-                trip_stop.save()
+            trip_stop.save()
@@ -98,6 +98,31 @@ class TripAPITestCase(TripsAPITestCase):
         self.assertEqual(trip_data['name'], 'Test Trip')
         self.assertEqual(trip_data['vehicle_license_plate'], 'ABC123')
 
+    def test_get_trips_list_streamed(self):
+        response = self.authenticated_request('GET', '/api/trips/?stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, self.authenticated_request('GET', '/api/trips/').json())
+
+    def test_filter_trips_by_viewport(self):
+        other_trip = Trip.objects.create(
+            vehicle=self.vehicle, dispatcher=self.user, name='New York Trip', status='draft',
+            planned_start_date=date(2024, 1, 16), planned_start_time=time(8, 0),
+        )
+        TripStop.objects.create(trip=other_trip, stop=self.stop2, sequence=1, planned_arrival_time=time(9, 0))
+
+        response = self.authenticated_request('GET', '/api/trips/?bbox=-74.1,40.6,-73.9,40.8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([trip['id'] for trip in response.json()['results']], [other_trip.id])
+
+        response = self.authenticated_request('GET', '/api/trips/?bbox=-88,40,-73,42')
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.authenticated_request('GET', '/api/trips/?bbox=-74.1,40.8,-73.9,40.6')
+        self.assertEqual(response.status_code, 400)
+
     def test_filter_trips_by_vehicle(self):
         response = self.authenticated_request('GET', f'/api/trips/?vehicle={self.vehicle.id}')
         self.assertEqual(response.status_code, 200)
@@ -217,6 +242,14 @@ class TripStopAPITestCase(TripsAPITestCase):
         self.assertEqual(stop_data['latitude'], '41.878113')
         self.assertEqual(stop_data['longitude'], '-87.629799')
 
+    def test_get_trip_stops_list_streamed(self):
+        response = self.authenticated_request('GET', '/api/trip-stops/?stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, self.authenticated_request('GET', '/api/trip-stops/').json())
+
     def test_filter_trip_stops_by_trip(self):
         response = self.authenticated_request('GET', f'/api/trip-stops/?trip={self.trip.id}')
         self.assertEqual(response.status_code, 200)
@@ -3,6 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.db import transaction
 from django.core.mail import send_mail
 import json
 from datetime import datetime
@@ -13,7 +14,10 @@ from .services import (
     update_trip_stop_sequences,
     TripValidationError,
 )
-from orders.models import Order
+from orders.models import Order, Stop
+from dashmap.streaming import stream_results, wants_stream
+from dashmap.bbox import request_bbox
+from dashmap.spatial import filter_bbox
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,67 @@ def get_linked_order_for_stop(stop):
     return None
 
 
+def serialize_trip(trip):
+    """Serialize a trip with its ordered stops, as returned by the trip list"""
+    # Include trip_stops data in list view to eliminate N+1 queries
+    trip_stops = []
+    for trip_stop in sorted(trip.trip_stops.all(), key=lambda item: item.sequence):
+        trip_stops.append(
+            {
+                "id": trip_stop.id,
+                "stop": {
+                    "id": trip_stop.stop.id,
+                    "name": trip_stop.stop.name,
+                    "address": trip_stop.stop.address,
+                    "latitude": str(trip_stop.stop.latitude)
+                    if trip_stop.stop.latitude
+                    else None,
+                    "longitude": str(trip_stop.stop.longitude)
+                    if trip_stop.stop.longitude
+                    else None,
+                    "stop_type": trip_stop.stop.stop_type,
+                    "contact_name": trip_stop.stop.contact_name,
+                    "contact_phone": trip_stop.stop.contact_phone,
+                    "notes": trip_stop.stop.notes,
+                },
+                "sequence": trip_stop.sequence,
+                "planned_arrival_time": trip_stop.planned_arrival_time.isoformat(),
+                "actual_arrival_datetime": trip_stop.actual_arrival_datetime.isoformat()
+                if trip_stop.actual_arrival_datetime
+                else None,
+                "actual_departure_datetime": trip_stop.actual_departure_datetime.isoformat()
+                if trip_stop.actual_departure_datetime
+                else None,
+                "notes": trip_stop.notes,
+                "is_completed": trip_stop.is_completed,
+                "linked_order": get_linked_order_for_stop(trip_stop.stop),
+            }
+        )
+
+    return {
+        "id": trip.id,
+        "vehicle": trip.vehicle.id,
+        "vehicle_license_plate": trip.vehicle.license_plate,
+        "dispatcher": trip.dispatcher.id,
+        "dispatcher_name": trip.dispatcher.get_full_name(),
+        "name": trip.name,
+        "status": trip.status,
+        "planned_start_date": trip.planned_start_date.isoformat(),
+        "planned_start_time": trip.planned_start_time.isoformat(),
+        "actual_start_datetime": trip.actual_start_datetime.isoformat()
+        if trip.actual_start_datetime
+        else None,
+        "actual_end_datetime": trip.actual_end_datetime.isoformat()
+        if trip.actual_end_datetime
+        else None,
+        "notes": trip.notes,
+        "driver_notified": trip.driver_notified,
+        "trip_stops": trip_stops,
+        "created_at": trip.created_at.isoformat(),
+        "updated_at": trip.updated_at.isoformat(),
+    }
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class TripListCreateView(View):
     def get(self, request):
@@ -46,69 +111,24 @@ class TripListCreateView(View):
         if company_id:
             trips = trips.filter(vehicle__company_id=company_id)
 
-        data = []
-        for trip in trips:
-            # Include trip_stops data in list view to eliminate N+1 queries
-            trip_stops = []
-            for trip_stop in trip.trip_stops.all().order_by("sequence"):
-                trip_stops.append(
-                    {
-                        "id": trip_stop.id,
-                        "stop": {
-                            "id": trip_stop.stop.id,
-                            "name": trip_stop.stop.name,
-                            "address": trip_stop.stop.address,
-                            "latitude": str(trip_stop.stop.latitude)
-                            if trip_stop.stop.latitude
-                            else None,
-                            "longitude": str(trip_stop.stop.longitude)
-                            if trip_stop.stop.longitude
-                            else None,
-                            "stop_type": trip_stop.stop.stop_type,
-                            "contact_name": trip_stop.stop.contact_name,
-                            "contact_phone": trip_stop.stop.contact_phone,
-                            "notes": trip_stop.stop.notes,
-                        },
-                        "sequence": trip_stop.sequence,
-                        "planned_arrival_time": trip_stop.planned_arrival_time.isoformat(),
-                        "actual_arrival_datetime": trip_stop.actual_arrival_datetime.isoformat()
-                        if trip_stop.actual_arrival_datetime
-                        else None,
-                        "actual_departure_datetime": trip_stop.actual_departure_datetime.isoformat()
-                        if trip_stop.actual_departure_datetime
-                        else None,
-                        "notes": trip_stop.notes,
-                        "is_completed": trip_stop.is_completed,
-                        "linked_order": get_linked_order_for_stop(trip_stop.stop),
-                    }
-                )
-
-            data.append(
-                {
-                    "id": trip.id,
-                    "vehicle": trip.vehicle.id,
-                    "vehicle_license_plate": trip.vehicle.license_plate,
-                    "dispatcher": trip.dispatcher.id,
-                    "dispatcher_name": trip.dispatcher.get_full_name(),
-                    "name": trip.name,
-                    "status": trip.status,
-                    "planned_start_date": trip.planned_start_date.isoformat(),
-                    "planned_start_time": trip.planned_start_time.isoformat(),
-                    "actual_start_datetime": trip.actual_start_datetime.isoformat()
-                    if trip.actual_start_datetime
-                    else None,
-                    "actual_end_datetime": trip.actual_end_datetime.isoformat()
-                    if trip.actual_end_datetime
-                    else None,
-                    "notes": trip.notes,
-                    "driver_notified": trip.driver_notified,
-                    "trip_stops": trip_stops,
-                    "created_at": trip.created_at.isoformat(),
-                    "updated_at": trip.updated_at.isoformat(),
-                }
+        # Trips with a stop within the map viewport
+        try:
+            bbox = request_bbox(request)
+        except ValueError as e:
+            return JsonResponse({"error": f"Invalid data: {str(e)}"}, status=400)
+        if bbox is not None:
+            stops = filter_bbox(Stop.objects.all(), bbox)
+            trips = trips.filter(
+                id__in=TripStop.objects.filter(stop__in=stops).values("trip_id")
             )
+
+        if wants_stream(request):
+            return stream_results(trips, serialize_trip)
+
+        data = [serialize_trip(trip) for trip in trips]
         return JsonResponse({"results": data})
 
+    @transaction.atomic
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -226,6 +246,7 @@ class TripDetailView(View):
             }
         )
 
+    @transaction.atomic
     def put(self, request, pk):
         trip = self.get_object(pk)
         if not trip:
@@ -340,14 +361,45 @@ Stops:"""
                 fail_silently=False,
             )
 
-            trip.driver_notified = True
-            trip.save()
+            with transaction.atomic():
+                trip.driver_notified = True
+                trip.save()
 
             return JsonResponse({"message": "Driver notified successfully"})
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
 
 
+def serialize_trip_stop(trip_stop):
+    """Serialize a trip stop, as returned by the trip stop list"""
+    return {
+        "id": trip_stop.id,
+        "trip": trip_stop.trip.id,
+        "stop": {
+            "id": trip_stop.stop.id,
+            "name": trip_stop.stop.name,
+            "address": trip_stop.stop.address,
+            "latitude": str(trip_stop.stop.latitude)
+            if trip_stop.stop.latitude
+            else None,
+            "longitude": str(trip_stop.stop.longitude)
+            if trip_stop.stop.longitude
+            else None,
+            "stop_type": trip_stop.stop.stop_type,
+        },
+        "sequence": trip_stop.sequence,
+        "planned_arrival_time": trip_stop.planned_arrival_time.isoformat(),
+        "actual_arrival_datetime": trip_stop.actual_arrival_datetime.isoformat()
+        if trip_stop.actual_arrival_datetime
+        else None,
+        "actual_departure_datetime": trip_stop.actual_departure_datetime.isoformat()
+        if trip_stop.actual_departure_datetime
+        else None,
+        "notes": trip_stop.notes,
+        "is_completed": trip_stop.is_completed,
+    }
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class TripStopListView(View):
     def get(self, request):
@@ -357,36 +409,11 @@ class TripStopListView(View):
         if trip_id:
             trip_stops = trip_stops.filter(trip_id=trip_id)
 
-        data = []
-        for trip_stop in trip_stops.order_by("sequence"):
-            data.append(
-                {
-                    "id": trip_stop.id,
-                    "trip": trip_stop.trip.id,
-                    "stop": {
-                        "id": trip_stop.stop.id,
-                        "name": trip_stop.stop.name,
-                        "address": trip_stop.stop.address,
-                        "latitude": str(trip_stop.stop.latitude)
-                        if trip_stop.stop.latitude
-                        else None,
-                        "longitude": str(trip_stop.stop.longitude)
-                        if trip_stop.stop.longitude
-                        else None,
-                        "stop_type": trip_stop.stop.stop_type,
-                    },
-                    "sequence": trip_stop.sequence,
-                    "planned_arrival_time": trip_stop.planned_arrival_time.isoformat(),
-                    "actual_arrival_datetime": trip_stop.actual_arrival_datetime.isoformat()
-                    if trip_stop.actual_arrival_datetime
-                    else None,
-                    "actual_departure_datetime": trip_stop.actual_departure_datetime.isoformat()
-                    if trip_stop.actual_departure_datetime
-                    else None,
-                    "notes": trip_stop.notes,
-                    "is_completed": trip_stop.is_completed,
-                }
-            )
+        trip_stops = trip_stops.order_by("sequence")
+        if wants_stream(request):
+            return stream_results(trip_stops, serialize_trip_stop)
+
+        data = [serialize_trip_stop(trip_stop) for trip_stop in trip_stops]
         return JsonResponse({"results": data})
 
 
@@ -432,6 +459,7 @@ class TripStopDetailView(View):
             }
         )
 
+    @transaction.atomic
     def put(self, request, pk):
         trip_stop = self.get_object(pk)
         if not trip_stop:
@@ -478,6 +506,7 @@ class TripStopDetailView(View):
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
 
+    @transaction.atomic
     def delete(self, request, pk):
         trip_stop = self.get_object(pk)
         if not trip_stop:
@@ -504,6 +533,7 @@ class TripStopDetailView(View):
 
 @method_decorator(csrf_exempt, name="dispatch")
 class TripStopReorderView(View):
+    @transaction.atomic
     def post(self, request, trip_pk):
         """Reorder trip stops for a given trip"""
         try:
@@ -526,6 +556,8 @@ class TripStopReorderView(View):
                 update_trip_stop_sequences(trip, new_sequences)
                 validate_pickup_before_delivery(trip)
             except TripValidationError as e:
+                # The rejected order and its change log entries are not committed
+                transaction.set_rollback(True)
                 return JsonResponse({"error": str(e)}, status=400)
 
             # Return updated trip stops
@@ -568,6 +600,7 @@ class TripStopReorderView(View):
         except (KeyError, json.JSONDecodeError, ValueError) as e:
             return JsonResponse({"error": "Invalid data format"}, status=400)
         except Exception as e:
+            transaction.set_rollback(True)
             return JsonResponse({"error": str(e)}, status=500)
 
 
@@ -2,6 +2,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.db import transaction
 import json
 from .models import Vehicle
 
@@ -37,6 +38,7 @@ class VehicleListCreateView(View):
             )
         return JsonResponse({"results": data})
 
+    @transaction.atomic
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -109,6 +111,7 @@ class VehicleDetailView(View):
             }
         )
 
+    @transaction.atomic
     def put(self, request, pk):
         vehicle = self.get_object(pk)
         if not vehicle:
@@ -149,6 +152,7 @@ class VehicleDetailView(View):
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
 
+    @transaction.atomic
     def delete(self, request, pk):
         vehicle = self.get_object(pk)
         if not vehicle: